@@ -0,0 +1,1296 @@
+r"""
+Skime Benchmarks
+
+This script measures the data structure layer against a local stand-in
+database. The stand-in is an in-memory SQLite database whose tables are
+created from the compiled structure schemas, so the benchmarks can be
+run on a workstation without the production SQL Server.
+
+The first command line argument names the benchmark to run. Any further
+arguments are passed to the benchmark. If no benchmark is named, the
+following usage message (assuming the script is named @c benchmark.py)
+will be printed along with the list of benchmarks:
+@verbatim
+Usage: benchmark.py NAME [ARGS...]
+@endverbatim
+
+@remarks The benchmarks use @c sys.getsizeof() and @c sqlite3, so they
+         require Python 2.6 or later, unlike the rest of Skime.
+"""
+
+import os
+import sys
+import time
+
+import env
+
+# START Stand-In Database Section
+
+def standInEnv(provider=None, database=':memory:'):
+	r"""
+	Create an env connected to an empty stand-in database.
+
+	@param provider The provider string to pass to the env.
+	@param database The file name of the SQLite database. Only a file
+	                can be shared by several connections.
+
+	@return An instance of the @em env class whose @c con is a SQLite
+	        connection.
+	"""
+	import sqlite3
+
+	e = env.env(None, provider)
+	e.con = sqlite3.connect(database, check_same_thread=False)
+	e.dbDialect = 'sqlite'
+	return e
+
+def standInValue(field, i):
+	r"""
+	Make up a value for @a field in row @a i.
+	"""
+	if field.dbType in ('bit',):
+		return i % 2
+	if field.dbType in ('int', 'integer', 'smallint', 'tinyint',
+	                    'bigint', 'money', 'smallmoney', 'decimal'):
+		return i
+	if field.dbType in ('datetime', 'smalldatetime'):
+		return '2006-01-%02d 12:00:00' % (i % 28 + 1)
+	value = '%s %d' % (field.dbName, i)
+	if field.maxlength:
+		value = value[:field.maxlength]
+	return value
+
+def standInTable(e, structureClass, rows=0):
+	r"""
+	Create the table of @a structureClass in the stand-in database.
+
+	@param e              An env from standInEnv().
+	@param structureClass The Structure::Structure subclass.
+	@param rows           The number of made-up rows to insert.
+
+	@return An empty record of @a structureClass.
+	"""
+	rec = structureClass.newRecord(e)
+	fields = [x for x in rec.fields
+	          if not rec.allFields[x].dbDynamicProperty]
+	columns = ['[' + rec.allFields[x].dbName + ']' for x in fields]
+
+	# The declared types give the columns SQLite's type affinity, so
+	# values included in the SQL query as strings still compare equal.
+	# An INTEGER PRIMARY KEY column is numbered by SQLite, as an
+	# IDENTITY column is by SQL Server.
+	types = []
+	for x in fields:
+		if rec.allFields[x].dbIdentity:
+			types.append('INTEGER PRIMARY KEY')
+		else:
+			types.append(rec.allFields[x].dbType)
+	e.con.execute('CREATE TABLE [' + rec.dbTable + '] (' +
+	              ','.join([x + ' ' + y
+	                        for x, y in zip(columns, types)]) + ')')
+	PK = rec.findPK()
+	if len(PK) > 0:
+		e.con.execute('CREATE INDEX [' + rec.dbTable + 'PK] ON [' +
+		              rec.dbTable + '] ([' + '],['.join(
+		              [rec.allFields[x].dbName for x in PK]) + '])')
+	sql = 'INSERT INTO [' + rec.dbTable + '] (' + ','.join(columns) + \
+	      ') VALUES (' + ','.join(['?' for x in columns]) + ')'
+	e.con.executemany(sql, [[standInValue(rec.allFields[x], i)
+	                         for x in fields] for i in xrange(rows)])
+	e.con.commit()
+	return rec
+
+def standInTables(e, structures, rows=0):
+	r"""
+	Create the tables of a data module in the stand-in database.
+
+	The tables of the structures which the fields look up values in,
+	such as Regions, are created, too.
+
+	@param e          An env from standInEnv().
+	@param structures The @c structures of the data module.
+	@param rows       The number of made-up rows to insert in each
+	                  table.
+	"""
+	created = {}
+	tree = [structures]
+	while tree:
+		structures = tree.pop()
+		for structureClass in structures:
+			if created.has_key(structureClass):
+				continue
+			created[structureClass] = True
+			rec = standInTable(e, structureClass, rows)
+			lookups = {}
+			for field in [rec.allFields[x] for x in rec.fields]:
+				if field.display != None and \
+				   field.display.type in ('dbDropdown', 'dbLookup'):
+					lookups[field.display.table] = {}
+			tree.append(structures[structureClass])
+			tree.append(lookups)
+
+# END Stand-In Database Section
+
+# START Measurement Helpers Section
+
+def sizeOf(obj, seen):
+	r"""
+	Get the memory used by @a obj and everything it refers to.
+
+	Objects already in @a seen are not counted again, so objects shared
+	between records are only counted once. Classes, functions and
+	modules are never counted.
+
+	@param obj  The object to measure.
+	@param seen A dictionary of the ids of objects already counted.
+
+	@return The size in bytes.
+	"""
+	import types
+
+	if seen.has_key(id(obj)) or \
+	   isinstance(obj, (types.ClassType, type, types.FunctionType,
+	                    types.MethodType, types.ModuleType)):
+		return 0
+	seen[id(obj)] = True
+
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		for key, value in obj.items():
+			size += sizeOf(key, seen) + sizeOf(value, seen)
+	elif isinstance(obj, (list, tuple)):
+		for value in obj:
+			size += sizeOf(value, seen)
+	else:
+		if hasattr(obj, '__dict__'):
+			size += sizeOf(obj.__dict__, seen)
+		for slot in getattr(type(obj), '__slots__', ()):
+			if hasattr(obj, slot):
+				size += sizeOf(getattr(obj, slot), seen)
+	return size
+
+def timed(function, *args):
+	r"""
+	Call @a function and measure how long it takes.
+
+	@return A tuple of the result and the elapsed time in seconds.
+	"""
+	start = time.time()
+	result = function(*args)
+	return (result, time.time() - start)
+
+class CountingConnection:
+	r"""
+	A DB-API connection wrapper which counts the statements executed
+	through its cursors.
+
+	Each statement can also be delayed by a fixed @c latency, in
+	seconds, to stand in for the round trip to a database server.
+	"""
+
+	def __init__(self, con, latency=0):
+		self.con = con
+		self.statements = 0
+		self.latency = latency
+
+		import util.CursorWrapper
+		util.CursorWrapper.CursorWrapper.registerParamStyle(self,
+		                                                    'qmark')
+
+	def cursor(self):
+		return CountingCursor(self, self.con.cursor())
+
+	def __getattr__(self, name):
+		return getattr(self.con, name)
+
+class CountingCursor:
+	r"""
+	A cursor of a CountingConnection.
+	"""
+
+	def __init__(self, counter, cur):
+		self.counter = counter
+		self.cur = cur
+
+	def execute(self, *args):
+		self.counter.statements += 1
+		if self.counter.latency:
+			time.sleep(self.counter.latency)
+		return self.cur.execute(*args)
+
+	def executemany(self, *args):
+		self.counter.statements += 1
+		if self.counter.latency:
+			time.sleep(self.counter.latency)
+		return self.cur.executemany(*args)
+
+	def __getattr__(self, name):
+		return getattr(self.cur, name)
+
+# END Measurement Helpers Section
+
+# START Benchmarks Section
+
+def benchmarkRecords(count='5000'):
+	r"""
+	Report the memory used per record for large result sets.
+
+	Each structure is loaded three ways:
+	 - @c constructor builds every record with the structure's
+	   constructor, as dbLoad() did before schemas were compiled.
+	 - @c schema is the default dbLoad(), with dictionary values.
+	 - @c lean is dbLoad() with @c lean set.
+
+	@param count The number of rows to load.
+	"""
+	from structures.GreylistTriplet import GreylistTriplet
+	from structures.MailEvent import MailEvent
+	from structures.SubAccount import SubAccount
+
+	count = int(count)
+
+	def loadConstructor(e, structureClass):
+		cur = e.con.cursor()
+		rec = structureClass.newRecord(e)
+		cur.execute('SELECT [' + '],['.join(
+		  [rec.allFields[x].dbName for x in rec.fields]) +
+		  '] FROM [' + rec.dbTable + ']')
+		out = []
+		for row in cur.fetchall():
+			rec = structureClass(e)
+			rec.dbLoadRecord(row)
+			out.append(rec)
+		return out
+
+	def loadSchema(e, structureClass):
+		return list(structureClass.dbLoad(e, e.con))
+
+	def loadLean(e, structureClass):
+		return list(structureClass.dbLoad(e, e.con, lean=True))
+
+	print '%-16s %-12s %14s %10s' % ('Structure', 'Mode',
+	                                 'Bytes/Record', 'Seconds')
+	for structureClass in (MailEvent, GreylistTriplet, SubAccount):
+		e = standInEnv()
+		standInTable(e, structureClass, count)
+		for (mode, load) in (('constructor', loadConstructor),
+		                     ('schema', loadSchema),
+		                     ('lean', loadLean)):
+			(records, seconds) = timed(load, e, structureClass)
+			assert len(records) == count
+			size = sizeOf(records, {}) - sys.getsizeof(records)
+			print '%-16s %-12s %14d %10.3f' % (
+			  structureClass.__name__, mode, size / count, seconds)
+
+def benchmarkBinding(count='2000'):
+	r"""
+	Compare bound parameters with values included in the SQL query.
+
+	The same primary key lookups are executed twice through
+	util::CursorWrapper::CursorWrapper::execute():
+	 - @c bound binds the values with the driver's native parameter
+	   style, so every lookup has the same SQL text.
+	 - @c inlined includes the values in the SQL query, as is still
+	   done for linked servers, so every lookup has its own SQL text.
+
+	The number of distinct SQL texts is the number of plans the
+	database would have to compile and cache.
+
+	@param count The number of rows to look up.
+	"""
+	from structures.SubAccount import SubAccount
+	import util.CursorWrapper
+
+	count = int(count)
+
+	e = standInEnv()
+	rec = standInTable(e, SubAccount, count)
+	pk = rec.findPK()[0]
+	sql = 'SELECT [' + '],['.join(
+	  [rec.allFields[x].dbName for x in rec.fields]) + '] FROM [' + \
+	  rec.dbTable + '] WHERE [' + rec.allFields[pk].dbName + ']=?'
+
+	def lookUp(toParamStyle):
+		texts = {}
+		found = 0
+		cur = e.con.cursor()
+		for i in xrange(count):
+			if toParamStyle == None:
+				texts[util.CursorWrapper.CursorWrapper.convert(
+				  sql, [i])] = True
+			else:
+				texts[sql] = True
+			util.CursorWrapper.CursorWrapper.execute(cur, sql, [i],
+			  toParamStyle=toParamStyle)
+			found += len(cur.fetchall())
+		cur.close()
+		return (found, len(texts))
+
+	print '%-10s %10s %10s %10s' % ('Mode', 'Rows', 'Texts', 'Seconds')
+	for (mode, toParamStyle) in (('bound', 'native'),
+	                             ('inlined', None)):
+		((found, texts), seconds) = timed(lookUp, toParamStyle)
+		assert found == count
+		print '%-10s %10d %10d %10.3f' % (mode, found, texts, seconds)
+
+def benchmarkRender(count='2000'):
+	r"""
+	Compare rendering a list of WebUsers with DataModule::getHtml() and
+	writing it out with DataModule::writeAction().
+
+	The time until the first piece of the page is written and the total
+	time are reported for each. The pages must be identical.
+
+	Afterwards, two of the records are rendered with different custom
+	form views, which each must keep.
+
+	Finally, the list is rendered with a LookupCache::LookupCache too
+	small for the titles of the page, which must still be looked up
+	with one query rather than one per record.
+
+	@param count The number of WebUsers on the page.
+	"""
+	from datamodules.Generic import Generic
+	from structures.WebUser import WebUser
+	from util.BufferedWriter import BufferedWriter
+
+	count = int(count)
+
+	e = standInEnv()
+	standInTables(e, {WebUser: {}}, count)
+	WebUser.dbPageSize = count
+
+	class StandInRequest:
+		uri = 'index.py'
+	e.req = StandInRequest()
+	e.fieldStorage = {'structure': 'WebUser'}
+
+	pages = {}
+	print '%-10s %10s %12s %10s' % ('Mode', 'Records', 'First Byte',
+	                                'Seconds')
+	for mode in ('getHtml', 'stream'):
+		out = []
+		first = []
+		start = time.time()
+		def write(string):
+			if not first:
+				first.append(time.time() - start)
+			out.append(string)
+
+		module = Generic(e)
+		if mode == 'getHtml':
+			write(module.handleAction(e, 'list'))
+		else:
+			writer = BufferedWriter(write)
+			module.writeAction(e, 'list', writer.write)
+			writer.flush()
+		seconds = time.time() - start
+
+		pages[mode] = ''.join(out)
+		print '%-10s %10d %12.3f %10.3f' % (mode, count, first[0],
+		                                    seconds)
+
+	assert pages['getHtml'] == pages['stream'], 'The pages differ.'
+
+	# Records rendered with different custom form views keep their
+	# own, although they share their field properties.
+	records = list(WebUser.dbLoad(e, e.con, max=count))
+	(a, b) = records[:2]
+	a.getSingleItemRow('WebID', e, False, 'form', 0, True)
+	b.getSingleItemRow('WebID', e, False, 'form', 1, False)
+	assert a.allFields['WebID'] is b.allFields['WebID']
+	assert a.hasCustomFormView('WebID')
+	assert not b.hasCustomFormView('WebID')
+	assert not records[2].hasCustomFormView('WebID')
+
+	from structures.LookupCache import LookupCache
+	LookupCache.flush()
+	LookupCache.maxSize = count / 4
+	con = e.con
+	e.con = CountingConnection(con)
+	try:
+		Generic(e).handleAction(e, 'list')
+		statements = e.con.statements
+	finally:
+		e.con = con
+		del LookupCache.maxSize
+	print 'Rendering with a small lookup cache: %d statements' % statements
+	assert statements < count / 4, 'The titles were looked up one at a time.'
+
+def benchmarkSave(count='5000', latency='0.001'):
+	r"""
+	Compare saving records one at a time with dbSaveMany().
+
+	Each statement is delayed by @a latency to stand in for the round
+	trip to the database server, which is what batching saves.
+
+	The inserted records are then changed and saved again, which must
+	update their rows, since the inserts gave them their IDs.
+
+	Afterwards, a BlacklistEntry::BlacklistEntry whose primary key has
+	changed is saved, which must update the row it was loaded from, and
+	one whose row was deleted, which must fail.
+
+	@param count   The number of records to insert and then update.
+	@param latency The round trip time of a statement, in seconds.
+	"""
+	from structures.SubAccount import SubAccount
+	import util.CursorWrapper
+
+	count = int(count)
+	latency = float(latency)
+
+	def saveEach(e, records):
+		cur = e.con.cursor()
+		identities = []
+		for rec in records:
+			(sql, args) = rec.dbGenerateSaveQuery(e)
+			util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
+			if rec.loadedValues == None:
+				identities.extend(SubAccount.dbFetchIdentities(cur,
+				                                                [rec]))
+		cur.close()
+		e.con.commit()
+		for (rec, identity, value) in identities:
+			rec.values[identity] = value
+		for rec in records:
+			rec.dbMarkSaved()
+
+	def saveMany(e, records):
+		SubAccount.dbSaveMany(e, records)
+
+	print '%-10s %-8s %10s %10s' % ('Mode', 'Action', 'Statements',
+	                                'Seconds')
+	for (mode, save) in (('each', saveEach), ('many', saveMany)):
+		e = standInEnv()
+		rec = standInTable(e, SubAccount)
+		pk = rec.findPK()[0]
+		e.con = CountingConnection(e.con, latency)
+
+		records = []
+		for i in xrange(count):
+			rec = SubAccount.newRecord(e)
+			for x in rec.fields:
+				if x != pk:
+					rec.values[x] = standInValue(rec.allFields[x], i)
+			records.append(rec)
+		e.con.statements = 0
+		(result, seconds) = timed(save, e, records)
+		print '%-10s %-8s %10d %10.3f' % (mode, 'insert',
+		                                  e.con.statements, seconds)
+
+		for rec in records:
+			assert rec.values[pk] != None, 'The ID was not read back.'
+			rec.values['Username'] = 'changed %d' % rec.values[pk]
+		e.con.statements = 0
+		(result, seconds) = timed(save, e, records)
+		print '%-10s %-8s %10d %10.3f' % (mode, 'update',
+		                                  e.con.statements, seconds)
+
+		records = list(SubAccount.dbLoad(e, e.con))
+		assert len(records) == count, 'The records were inserted again.'
+		for rec in records:
+			assert rec.values['Username'] == \
+			       'changed %d' % rec.values[pk]
+
+	# dbSave() reads the ID back, too.
+	rec = SubAccount.newRecord(e)
+	for x in rec.fields:
+		if x != pk:
+			rec.values[x] = standInValue(rec.allFields[x], count)
+	rec.dbSave(e)
+	rec.values['Username'] = 'changed'
+	rec.dbSave(e)
+	assert len(list(SubAccount.dbLoad(e, e.con))) == count + 1, \
+	       'The record was inserted again.'
+
+	from structures.BlacklistEntry import BlacklistEntry
+	rec = standInTable(e, BlacklistEntry, 2)
+	table = rec.dbTable
+	rec = list(BlacklistEntry.dbLoad(e, e.con))[0]
+	expected = [1 - rec.values['AccountID'], 100]
+	rec.values['AccountID'] = 100
+	rec.dbSave(e)
+	accounts = [x.values['AccountID']
+	            for x in BlacklistEntry.dbLoad(e, e.con)]
+	accounts.sort()
+	assert accounts == expected, accounts
+
+	e.con.execute('DELETE FROM [' + table + ']')
+	e.con.commit()
+	rec.values['AccountID'] = 200
+	try:
+		rec.dbSave(e)
+	except RuntimeError:
+		pass
+	else:
+		assert 0, 'The UPDATE of a deleted row was not reported.'
+
+def benchmarkDispatch(count='10000'):
+	r"""
+	Compare looking up data modules with @c __import__ and @c eval, as
+	index.py used to on every request, with looking them up in the
+	registry::Registry.
+
+	The time taken to preload the registry is reported first.
+
+	@param count The number of lookups.
+	"""
+	from registry import Registry
+	from util.ConnectionPool import ConnectionPool
+
+	count = int(count)
+
+	(result, seconds) = timed(Registry.preload)
+	print 'Preloaded %(modules)d modules and %(structures)d structures' \
+	      % Registry.getStats() + ' in %.3f seconds' % seconds
+	(result, seconds) = timed(Registry.preload, None)
+	pool = ConnectionPool.get('provider1.example.com', env.connectProvider1)
+	checkouts = pool.getStats()['checkouts']
+	print 'Compiled the schemas in %.3f seconds' % timed(
+	      Registry.preload, 'provider1.example.com')[1]
+	assert pool.getStats()['checkouts'] == checkouts, \
+	       'Compiling the schemas leased a database connection.'
+
+	names = ['CustomerRecord', 'GeneralSearch', 'Generic', 'WebRecord']
+
+	def oldLookup():
+		for i in xrange(count):
+			module = names[i % len(names)]
+			modFile = __import__('datamodules.'+module)
+			modCls = eval('modFile.'+module+'.'+module)
+
+	def registryLookup():
+		for i in xrange(count):
+			modCls = Registry.getModule(names[i % len(names)])
+
+	print '%-10s %10s %10s %12s' % ('Mode', 'Lookups', 'Seconds',
+	                                'us/Lookup')
+	for (mode, lookup) in (('eval', oldLookup),
+	                       ('registry', registryLookup)):
+		(result, seconds) = timed(lookup)
+		print '%-10s %10d %10.3f %12.2f' % (mode, count, seconds,
+		                                    seconds * 1000000 / count)
+
+def benchmarkDeferred(count='5000', size='4000'):
+	r"""
+	Compare loading a list with and without deferring @c text fields.
+
+	MSNote::MSNote records are loaded three ways:
+	 - @c all is the default dbLoad(), which selects every field,
+	   including the @c Note text.
+	 - @c deferred defers the @c Note and never reads it, as a
+	   row-arrangement list view does.
+	 - @c read defers the @c Note and then reads every one, which loads
+	   them one batch at a time.
+
+	Afterwards, a list of the records is rendered with MSNote opted in
+	to deferring its @c text fields. Reading the deferred @c Notes must
+	cost one query per page, not one per record.
+
+	@param count The number of rows to load.
+	@param size  The length of each @c Note.
+	"""
+	from structures.MSNote import MSNote
+
+	count = int(count)
+	size = int(size)
+
+	e = standInEnv()
+	rec = standInTable(e, MSNote, count)
+	e.con.execute('UPDATE [' + rec.dbTable + '] SET [' +
+	              rec.allFields['Note'].dbName + ']=?', ['x' * size])
+	e.con.commit()
+
+	def loadAll():
+		return list(MSNote.dbLoad(e, e.con))
+
+	def loadDeferred():
+		return list(MSNote.dbLoad(e, e.con, deferred=('Note',)))
+
+	def loadRead():
+		records = list(MSNote.dbLoad(e, e.con, deferred=('Note',)))
+		for rec in records:
+			rec.values['Note']
+		return records
+
+	print '%-10s %10s %10s' % ('Mode', 'Records', 'Seconds')
+	for (mode, load) in (('all', loadAll), ('deferred', loadDeferred),
+	                     ('read', loadRead)):
+		(records, seconds) = timed(load)
+		assert len(records) == count
+		print '%-10s %10d %10.3f' % (mode, len(records), seconds)
+
+	from datamodules.Generic import Generic
+
+	class StandInRequest:
+		uri = 'index.py'
+	e.req = StandInRequest()
+	e.fieldStorage = {'structure': 'MSNote'}
+	e.con = CountingConnection(e.con)
+
+	def render():
+		module = Generic(e)
+		module.structures = {MSNote: {}}
+		module.rootStructure = MSNote
+		start = e.con.statements
+		page = module.handleAction(e, 'list')
+		return (page, e.con.statements - start)
+
+	(page, statements) = render()
+	MSNote.dbDeferredTypes = ('text',)
+	try:
+		(deferredPage, deferredStatements) = render()
+	finally:
+		del MSNote.dbDeferredTypes
+	print 'Rendering a page of %d: %d statements, %d deferred' % \
+	      (MSNote.dbPageSize, statements, deferredStatements)
+	assert page.find('x' * size) >= 0, 'The Notes were not shown.'
+	assert deferredPage == page, 'The pages differ.'
+	assert deferredStatements <= statements + 1, \
+	       'The deferred fields were loaded one record at a time.'
+
+def benchmarkChildren(count='200'):
+	r"""
+	Count the statements needed to load the children of many records.
+
+	The records of WebRecord::WebRecord (Web, with its WebUser,
+	WebRedirect and SubWeb children, three of each per Web) are loaded
+	two ways:
+	 - @c each loads the children of each Web with its own dbLoad(),
+	   as DataModule::DataModule::dbLoadChildren() used to.
+	 - @c batched is DataModule::DataModule::dbLoadChildren().
+
+	@param count The largest number of Webs to load.
+	"""
+	from datamodules.WebRecord import WebRecord
+	from structures.SubWeb import SubWeb
+	from structures.Web import Web
+	from structures.WebRedirect import WebRedirect
+	from structures.WebUser import WebUser
+
+	count = int(count)
+
+	e = standInEnv()
+	standInTable(e, Web, count)
+	for structureClass in (WebUser, WebRedirect, SubWeb):
+		rec = standInTable(e, structureClass, count * 3)
+		e.con.execute('UPDATE [' + rec.dbTable + '] SET [' +
+		              rec.allFields['WebID'].dbName + ']=rowid%?',
+		              [count])
+	e.con.commit()
+	e.con = CountingConnection(e.con)
+
+	def loadEach(module, webs):
+		for web in webs:
+			for structureClass in module.structures[Web]:
+				module.data.append(list(structureClass.dbLoad(e, e.con,
+				  query={'WebID': web.values['WebID']})))
+
+	def loadBatched(module, webs):
+		module.dbLoadChildren(e, module.structures[Web], e.con, webs)
+
+	print '%-10s %10s %10s %10s %10s' % ('Mode', 'Webs', 'Children',
+	                                     'Statements', 'Seconds')
+	webs = list(Web.dbLoad(e, e.con))
+	size = 1
+	while size <= count:
+		for (mode, load) in (('each', loadEach),
+		                     ('batched', loadBatched)):
+			module = WebRecord(e)
+			e.con.statements = 0
+			(result, seconds) = timed(load, module, webs[:size])
+			print '%-10s %10d %10d %10d %10.3f' % (mode, size,
+			  sum([len(x) for x in module.data]), e.con.statements,
+			  seconds)
+		size *= 10
+
+def benchmarkConcurrent(latency='0.05'):
+	r"""
+	Compare loading the structures of CustomerRecord::CustomerRecord
+	one after another with loading them at the same time.
+
+	@param latency The time, in seconds, each statement is delayed to
+	               stand in for the round trip to a database server.
+	"""
+	import sqlite3
+	import tempfile
+
+	from datamodules.CustomerRecord import CustomerRecord
+
+	latency = float(latency)
+
+	(fd, database) = tempfile.mkstemp('.db')
+	os.close(fd)
+	try:
+		e = standInEnv(database=database)
+		module = CustomerRecord(e)
+		tree = [module.structures]
+		while tree:
+			structures = tree.pop()
+			for structureClass in structures:
+				standInTable(e, structureClass, 10)
+				tree.append(structures[structureClass])
+		e.con.close()
+
+		e.con = CountingConnection(sqlite3.connect(database,
+		                           check_same_thread=False), latency)
+		e.connect = lambda: CountingConnection(sqlite3.connect(database,
+		                    check_same_thread=False), latency)
+
+		print '%-12s %10s %10s' % ('Mode', 'Sets', 'Seconds')
+		for concurrently in (False, True):
+			module = CustomerRecord(e)
+			module.dbLoadConcurrently = concurrently
+			(result, seconds) = timed(module.dbLoad, e,
+			                          {'CustomerID': 1})
+			if concurrently:
+				mode = 'concurrent'
+			else:
+				mode = 'sequential'
+			print '%-12s %10d %10.3f' % (mode, len(module.data),
+			                             seconds)
+	finally:
+		os.remove(database)
+
+def benchmarkPool(requests='200', handshake='0.02'):
+	r"""
+	Compare opening a database connection for every request with leasing
+	one from a util::ConnectionPool::ConnectionPool.
+
+	Each request creates an env, runs one query and closes the env, the
+	way index.py does.
+
+	@param requests  The number of requests.
+	@param handshake The time, in seconds, opening a connection is
+	                 delayed to stand in for the login to a database
+	                 server.
+	"""
+	import sqlite3
+	import tempfile
+
+	import structures.InternalUser
+	from util.ConnectionPool import ConnectionPool
+
+	requests = int(requests)
+	handshake = float(handshake)
+
+	(fd, database) = tempfile.mkstemp('.db')
+	os.close(fd)
+	try:
+		e = standInEnv(database=database)
+		standInTable(e, structures.InternalUser.InternalUser, 10)
+		e.close()
+
+		def connect():
+			time.sleep(handshake)
+			return CountingConnection(sqlite3.connect(database,
+			                          check_same_thread=False))
+
+		def request(pool):
+			e = env.env(None, None)
+			e.dbDialect = 'sqlite'
+			if pool == None:
+				e.con = connect()
+			else:
+				e.pool = pool
+				e.con = pool.acquire()
+			structures.InternalUser.InternalUser.dbLoad(e, e.con,
+			  query={'Username': 'Username1'}, orderBy=('Username',))
+			e.close()
+
+		def run(pool):
+			for i in xrange(requests):
+				request(pool)
+
+		pool = ConnectionPool(connect)
+		print '%-10s %10s %10s' % ('Mode', 'Requests', 'Seconds')
+		for mode in ('connect', 'pool'):
+			if mode == 'pool':
+				(result, seconds) = timed(run, pool)
+			else:
+				(result, seconds) = timed(run, None)
+			print '%-10s %10d %10.3f' % (mode, requests, seconds)
+
+		stats = pool.getStats()
+		assert stats['created'] - stats['closed'] == \
+		       stats['inUse'] + stats['idle'], stats
+		names = stats.keys()
+		names.sort()
+		for name in names:
+			print '%-12s %s' % (name, stats[name])
+		pool.flush()
+	finally:
+		os.remove(database)
+
+def benchmarkWSGI(requests='200', threads='8', latency='0.01'):
+	r"""
+	Measure the requests per second served by wsgi.py.
+
+	Customer records are requested through the WSGI application, first
+	one at a time, as each mod_python process serves them under Apache
+	prefork, and then from @a threads threads at once. The connection
+	pool of the provider is filled from the stand-in database.
+
+	@param requests The number of requests.
+	@param threads  The number of threads.
+	@param latency  The time, in seconds, each statement is delayed to
+	                stand in for the round trip to a database server.
+	"""
+	import base64
+	import sqlite3
+	import tempfile
+	import threading
+	import StringIO
+
+	from datamodules.CustomerRecord import CustomerRecord
+	from structures.InternalUser import InternalUser
+	from util.ConnectionPool import ConnectionPool
+
+	requests = int(requests)
+	threads = int(threads)
+	latency = float(latency)
+
+	(fd, database) = tempfile.mkstemp('.db')
+	os.close(fd)
+	try:
+		# The env of each request leases from this pool.
+		pool = ConnectionPool.get('provider1.example.com',
+		  lambda: CountingConnection(sqlite3.connect(database,
+		                             check_same_thread=False), latency))
+		pool.maxSize = threads * 2
+
+		# The tables must have the fields of the provider's
+		# configuration.
+		e = env.env(None, 'provider1.example.com')
+		e.dbDialect = 'sqlite'
+		structures = CustomerRecord(e).structures.copy()
+		structures[InternalUser] = {}
+		standInTables(e, structures, 10)
+		e.close()
+
+		# Importing index.py preloads the registry, which must use the
+		# pool above.
+		import index
+		import wsgi
+
+		class StandInApplication(wsgi.Application):
+			def createEnv(self, req):
+				e = wsgi.Application.createEnv(self, req)
+				e.dbDialect = 'sqlite'
+				return e
+
+		application = StandInApplication()
+		environ = {
+			'REQUEST_METHOD': 'GET',
+			'SCRIPT_NAME': '/skime',
+			'PATH_INFO': '/index.py',
+			'QUERY_STRING': 'module=CustomerRecord&action=view'
+			                '&criterion=CustomerID&value=1',
+			'SERVER_NAME': 'localhost',
+			'SERVER_PORT': '80',
+			'HTTP_AUTHORIZATION': 'Basic ' + base64.encodestring(
+			  'Username 1:Password 1').strip(),
+			'wsgi.url_scheme': 'http',
+		}
+
+		def request(expected='200 OK'):
+			status = []
+			body = []
+			def start_response(s, headers):
+				status.append(s)
+				return body.append
+			environ2 = environ.copy()
+			environ2['wsgi.input'] = StringIO.StringIO()
+			body.extend(application(environ2, start_response))
+			assert status == [expected], status
+			return ''.join(body)
+
+		# Check the page once before timing it.
+		assert request().find('Customer Record') >= 0, 'The customer record was not shown.'
+
+		# With every connection leased, a request is turned away after
+		# poolTimeout rather than the pool's longer timeout.
+		application.poolTimeout = 0.1
+		leased = [pool.acquire() for i in xrange(pool.maxSize)]
+		try:
+			(result, seconds) = timed(request, '503 Service Unavailable')
+			assert seconds < pool.timeout, seconds
+
+			# The mod_python handlers turn the request away, too.
+			for handler in (index.authenhandler, index.handler):
+				environ2 = environ.copy()
+				environ2['wsgi.input'] = StringIO.StringIO()
+				req = wsgi.WSGIRequest(environ2, None)
+				env.getRequestEnv(req, 'provider1.example.com', {}, 0.1)
+				try:
+					assert handler(req) == \
+					       index.apache.HTTP_SERVICE_UNAVAILABLE
+				finally:
+					req.cleanup()
+		finally:
+			for con in leased:
+				pool.release(con)
+		application.poolTimeout = wsgi.Application.poolTimeout
+
+		def run(threads):
+			count = [requests]
+			lock = threading.Lock()
+			def work():
+				while True:
+					lock.acquire()
+					try:
+						if count[0] == 0:
+							return
+						count[0] -= 1
+					finally:
+						lock.release()
+					request()
+			workers = [threading.Thread(target=work)
+			           for i in xrange(threads)]
+			for worker in workers:
+				worker.start()
+			for worker in workers:
+				worker.join()
+
+		print '%-10s %8s %10s %12s' % ('Mode', 'Threads', 'Seconds',
+		                               'Requests/s')
+		for (mode, n) in (('prefork', 1), ('wsgi', threads)):
+			(result, seconds) = timed(run, n)
+			print '%-10s %8d %10.3f %12.1f' % (mode, n, seconds,
+			                                   requests / seconds)
+
+		stats = pool.getStats()
+		names = stats.keys()
+		names.sort()
+		for name in names:
+			print '%-12s %s' % (name, stats[name])
+		pool.flush()
+	finally:
+		os.remove(database)
+
+def benchmarkDynamic(count='20'):
+	r"""
+	Compare the DynamicStructure::DynamicStructure load strategies.
+
+	Structures with 5, 20 and 50 dynamic properties are loaded with the
+	@c 'join' strategy, which joins the property table once per
+	property, the @c 'pivot' strategy, which reads it once, and from a
+	@c 'wide' table with an indexed column per property. Each is loaded
+	three ways:
+	 - @c all loads every record.
+	 - @c query loads the records with a given value of one property.
+	 - @c list pages through every record with the @c list action of
+	   the Generic data module, ten records per page.
+
+	The structure with a wide table must load as the @c 'join' strategy
+	does until the wide table is created.
+
+	@param count The number of records of each structure. On the
+	             stand-in database, the time of the @c 'join' strategy
+	             with 50 properties grows faster than @a count: the
+	             default takes a few seconds, but 100 takes minutes.
+	"""
+	from datamodules.Generic import Generic
+	from structures.DynamicStructure import DynamicStructure
+	from structures.fp import fp
+
+	count = int(count)
+
+	def listAll(structureClass):
+		records = []
+		pageToken = None
+		while True:
+			e.fieldStorage = {'structure': 'WebUser'}
+			if pageToken != None:
+				e.fieldStorage['pageToken'] = pageToken
+			module = Generic(e)
+			module.structures = {structureClass: {}}
+			module.rootStructure = structureClass
+			page = module.handleAction(e, 'list')
+			assert len(module.data[0]) <= 10
+			for rec in module.data[0]:
+				assert page.find(rec.values['Name']) != -1
+			records.extend(module.data[0])
+			pageToken = module.nextPageToken
+			if pageToken == None:
+				return records
+
+	def makeStructure(properties, strategy):
+		class Dynamic(DynamicStructure):
+			def __init__(self, env):
+				self.allFields2 = {
+					'ItemID': fp(type='int', dbName='ItemID',
+					             dbPrimaryKey=True),
+					'Name': fp(dbName='Name', maxlength=50),
+				}
+				fieldOrder = ['ItemID', 'Name']
+				for i in xrange(properties):
+					name = 'Property%d' % i
+					if i % 2:
+						field = fp(type='int', dbName=name,
+						           dbDynamicProperty=True)
+					else:
+						field = fp(dbName=name, maxlength=50,
+						           dbDynamicProperty=True)
+					self.allFields2[name] = field
+					fieldOrder.append(name)
+				self.fieldOrder2 = tuple(fieldOrder)
+
+				if strategy == 'wide':
+					dbWideTable = 'Items%dWide' % properties
+				else:
+					dbWideTable = None
+
+				DynamicStructure.__init__(self,
+				                          'Items%d' % properties,
+				                          'Item', 'Item', 'Items',
+				                          dbWideTable=dbWideTable)
+				self.buildFields()
+		if strategy != 'wide':
+			Dynamic.dbLoadStrategy = strategy
+		Dynamic.dbPageSize = 10
+		return Dynamic
+
+	print '%-10s %-8s %-8s %10s %10s' % ('Properties', 'Strategy',
+	                                     'Mode', 'Records', 'Seconds')
+	e = standInEnv()
+	class StandInRequest:
+		uri = 'index.py'
+	e.req = StandInRequest()
+	for properties in (5, 20, 50):
+		structures = {}
+		for strategy in ('join', 'pivot', 'wide'):
+			structures[strategy] = makeStructure(properties, strategy)
+
+		rec = standInTable(e, structures['join'], count)
+		e.con.execute('CREATE TABLE [' + rec.dbPropertyTable +
+		              '] ([ItemID] integer, [' +
+		              rec.propertyNameColumn + '] varchar(255), [' +
+		              rec.propertyValueColumn + '] varchar(4000), ' +
+		              'PRIMARY KEY ([ItemID], [' +
+		              rec.propertyNameColumn + ']))')
+		# Every record lacks a few of its properties.
+		rows = []
+		for i in xrange(count):
+			for j in xrange(properties):
+				if (i + j) % 7:
+					field = rec.allFields['Property%d' % j]
+					rows.append((i, field.dbName,
+					             str(standInValue(field, i))))
+		e.con.executemany('INSERT INTO [' + rec.dbPropertyTable +
+		                  '] VALUES (?,?,?)', rows)
+
+		# Until its wide table is created, the wide structure falls
+		# back to the join strategy.
+		structures['wide'].dbWideTableTTL = 0
+		assert structures['wide'].dbGetLoadStrategy(e) == 'join'
+		records = [[x.values[y] for y in x.fields]
+		           for x in structures['wide'].dbLoad(e, e.con)]
+		records.sort()
+
+		# The wide table, as install.py creates it.
+		rec = structures['wide'].newRecord(e)
+		e.con.execute('CREATE TABLE [' + rec.dbWideTable +
+		              '] ([ItemID] integer PRIMARY KEY, ' +
+		              ','.join(['[' + rec.allFields[x].dbName + '] ' +
+		                        rec.allFields[x].dbType
+		                        for x in rec.fields
+		                        if rec.allFields[x].dbDynamicProperty]) +
+		              ')')
+		e.con.execute('CREATE INDEX [idx_' + rec.dbWideTable +
+		              '] ON [' + rec.dbWideTable + '] ([Property1])')
+		e.con.execute(rec.dbGenerateWideTableInsert(e))
+		e.con.commit()
+		assert structures['wide'].dbGetLoadStrategy(e) == 'wide'
+
+		# Loading on another connection, as a worker thread does,
+		# never asks env.con for the strategy.
+		con = e.con
+		e.con = CountingConnection(con)
+		try:
+			list(structures['wide'].dbLoad(e, con,
+			                               query={'Property2': '2'}))
+			structures['wide'].dbLoadPage(e, con, pageSize=5)
+			assert e.con.statements == 0, \
+			       'The strategy was worked out on env.con.'
+		finally:
+			e.con = con
+		del structures['wide'].dbWideTableTTL
+
+		query = {'Property1': '1'}
+		results = {}
+		for strategy in ('join', 'pivot', 'wide'):
+			structureClass = structures[strategy]
+			for mode in ('all', 'query', 'list'):
+				if mode == 'list':
+					(records, seconds) = timed(listAll,
+					                           structureClass)
+				else:
+					if mode == 'query':
+						args = {'query': query}
+					else:
+						args = {}
+					(records, seconds) = timed(list,
+					  structureClass.dbLoad(e, e.con, **args))
+				records = [[x.values[y] for y in x.fields]
+				           for x in records]
+				records.sort()
+				results[(strategy, mode)] = records
+				print '%-10d %-8s %-8s %10d %10.3f' % (properties,
+				  strategy, mode, len(records), seconds)
+		for mode in ('all', 'query', 'list'):
+			assert results[('join', mode)] == results[('pivot', mode)]
+			assert results[('join', mode)] == results[('wide', mode)]
+		assert records == results[('join', 'all')]
+		# The join strategy skips records without property rows.
+		assert results[('pivot', 'list')] == results[('pivot', 'all')]
+
+def benchmarkFlatFile(records='1000000'):
+	r"""
+	Measure the throughput of FlatFileStructure::FlatFileStructure
+	reads.
+
+	A flat file of 200 byte records is written to a temporary file and
+	read five ways:
+	 - @c read reads one record at a time with @c read() and loads it
+	   with dbLoadRecord(), as dbLoad() did before it used @c mmap.
+	 - @c mmap is dbLoad().
+	 - @c fields is dbLoad() with two of the ten fields.
+	 - @c query is dbLoad() matching one field, by the old reader and
+	   by dbLoad().
+	 - @c lookup is dbLoad() matching one indexed field. The @c build
+	   reader is the first lookup, which builds the index, and the
+	   @c index reader is the average of 100 more lookups.
+
+	@param records The number of records in the file. A multi-gigabyte
+	               file has more than 5000000.
+	"""
+	import tempfile
+	from structures.FlatFileStructure import FlatFileStructure
+	from structures.fp import fp
+
+	records = int(records)
+
+	(handle, filename) = tempfile.mkstemp()
+	os.close(handle)
+
+	class Ledger(FlatFileStructure):
+		def __init__(self, env):
+			self.allFields = {}
+			self.fieldOrder = []
+			for i in xrange(10):
+				name = 'Field%d' % i
+				self.allFields[name] = fp(dbName=name, maxlength=20,
+				                          dbIndexed=(i == 3))
+				self.fieldOrder.append(name)
+
+			FlatFileStructure.__init__(self, filename, 'Ledger',
+			                           'Ledger', 'Ledgers')
+			self.buildFields()
+
+	def readOld(query=None):
+		recordClass = Ledger.getSchema(e).recordClass
+		instance = recordClass(e)
+		getField = instance._FlatFileStructure__getField
+		db = file(filename)
+		db.seek(instance.fileHeader)
+		count = 0
+		while True:
+			row = db.read(instance.recordLength)
+			if len(row) == 0: break
+			if query != None:
+				for field in query:
+					if query[field] == getField(row, field):
+						rec = recordClass(e)
+						rec.dbLoadRecord(row)
+						count += 1
+			else:
+				rec = recordClass(e)
+				rec.dbLoadRecord(row)
+				count += 1
+		db.close()
+		return count
+
+	def readNew(query=None, fields=None):
+		count = 0
+		for rec in Ledger.dbLoad(e, None, query=query, fields=fields):
+			count += 1
+		return count
+
+	try:
+		e = env.env(None)
+		rec = Ledger.newRecord(e)
+
+		out = file(filename, 'wb')
+		out.write(' ' * rec.fileHeader)
+		chunk = []
+		for i in xrange(records):
+			chunk.append(''.join(['%-20s' % ('%s %d' % (x, i))
+			                      for x in rec.fileFieldOrder]))
+			if len(chunk) == 10000:
+				out.write(''.join(chunk))
+				chunk = []
+		out.write(''.join(chunk))
+		out.close()
+		megabytes = os.path.getsize(filename) / 1048576.0
+
+		query = {'Field4': 'Field4 %d' % (records / 2)}
+		print '%-8s %-8s %10s %10s %14s %10s' % ('Mode', 'Reader',
+		  'Records', 'Seconds', 'Records/Second', 'MB/Second')
+		for (mode, reader, read, args) in (
+		  ('all', 'read', readOld, ()),
+		  ('all', 'mmap', readNew, ()),
+		  ('fields', 'mmap', readNew, (None, ('Field0', 'Field3'))),
+		  ('query', 'read', readOld, (query,)),
+		  ('query', 'mmap', readNew, (query,))):
+			(count, seconds) = timed(read, *args)
+			print '%-8s %-8s %10d %10.3f %14d %10.1f' % (mode, reader,
+			  count, seconds, records / seconds, megabytes / seconds)
+
+		def lookups(count):
+			found = 0
+			for i in xrange(count):
+				found += readNew({'Field3': 'Field3 %d' %
+				                  (i * 7919 % records)})
+			return found
+
+		(count, seconds) = timed(lookups, 1)
+		print '%-8s %-8s %10d %10.3f' % ('lookup', 'build', count,
+		                                 seconds)
+		(count, seconds) = timed(lookups, 100)
+		print '%-8s %-8s %10d %10.6f' % ('lookup', 'index', count / 100,
+		                                 seconds / 100)
+	finally:
+		os.remove(filename)
+		if os.path.exists(filename + '.Field3.idx'):
+			os.remove(filename + '.Field3.idx')
+
+# END Benchmarks Section
+
+benchmarks = {
+	'binding': benchmarkBinding,
+	'children': benchmarkChildren,
+	'concurrent': benchmarkConcurrent,
+	'deferred': benchmarkDeferred,
+	'dispatch': benchmarkDispatch,
+	'dynamic': benchmarkDynamic,
+	'flatfile': benchmarkFlatFile,
+	'pool': benchmarkPool,
+	'records': benchmarkRecords,
+	'render': benchmarkRender,
+	'save': benchmarkSave,
+	'wsgi': benchmarkWSGI,
+}
+
+if __name__ == '__main__':
+	(path, name) = os.path.split(sys.argv[0])
+
+	if len(sys.argv) < 2 or not benchmarks.has_key(sys.argv[1]):
+		print 'Usage: ' + name + ' NAME [ARGS...]'
+		names = benchmarks.keys()
+		names.sort()
+		print 'Benchmarks: ' + ', '.join(names)
+		sys.exit()
+
+	benchmarks[sys.argv[1]](*sys.argv[2:])
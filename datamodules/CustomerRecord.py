@@ -20,6 +20,9 @@ class CustomerRecord(DataModule):
 				"update":	action(loadFromDb=1, editable=0, preFunction=self.dbSave, chainAction="view") }
 
 		self.structures = {MasterAccount: {}, SubAccount: {}, Web: {WebRedirect: {}}, SubWeb: {}}
+		# These are independent of each other, so they are loaded at
+		# the same time.
+		self.dbLoadConcurrently = True
 		self.rootStructure = MasterAccount
 		self.extraVars = []
 		self.arrangement = 'auto'
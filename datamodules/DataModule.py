@@ -1,11 +1,42 @@
+import sys
+import threading
+
 from display.html import *
 
 class DataModule:
 
+	# The token of the page after the one loaded by dbLoadPage(), if any.
+	nextPageToken = None
+	# The number of records of the root structure matching the query
+	# loaded by dbLoadPage(), if any.
+	totalCount = None
+
+	# If True, dbLoadCore() loads sibling structures at the same time,
+	# each on its own connection, with up to dbLoadThreads threads.
+	dbLoadConcurrently = False
+	dbLoadThreads = 4
+
 	def __init__(self, env):
 		self.data = []
 
 	def handleAction(self, env, actionString):
+		a = self.loadAction(env, actionString)
+		return self.getHtml(env, a, moduleName=self.moduleName, arrangement=self.arrangement)
+
+	def writeAction(self, env, actionString, write):
+		r"""
+		Handle an action like handleAction(), but pass the page to
+		@a write a piece at a time. (See writeHtml().)
+		"""
+		a = self.loadAction(env, actionString)
+		self.writeHtml(env, a, write, moduleName=self.moduleName, arrangement=self.arrangement)
+
+	def loadAction(self, env, actionString):
+		r"""
+		Load the data of an action.
+
+		@return The action whose page should be shown.
+		"""
 		self.env = env
 		self.hasCriterion = False
 
@@ -19,6 +50,16 @@ class DataModule:
 			a = self.actions[a.chainAction]
 
 		if a.loadFromForm: self.formLoad(env)
+		elif a.loadFromDb and a.paged:
+			query = None
+			if self.hasCriterionInForm():
+				self.setCriterion()
+				self.setQueryFromCriterion()
+				query = self.query
+			pageToken = None
+			if env.fieldStorage.has_key('pageToken'):
+				pageToken = env.fieldStorage['pageToken']
+			self.dbLoadPage(env, query, pageToken)
 		elif a.loadFromDb:
 			self.setCriterion()
 			self.setQueryFromCriterion()
@@ -28,46 +69,72 @@ class DataModule:
 			self.dbLoad(env, query)
 		else: self.nullLoad(env)
 
-		return self.getHtml(env, a, moduleName=self.moduleName, arrangement=self.arrangement)
+		return a
 
 	def getHtml(self, env, a, moduleName=None, arrangement=None):
 		out = []
+		self.writeHtml(env, a, out.append, moduleName=moduleName, arrangement=arrangement)
+		return ''.join(out)
+
+	def writeHtml(self, env, a, write, moduleName=None, arrangement=None):
+		r"""
+		Write the page a piece at a time.
+
+		This produces the same HTML as getHtml(), but passes it to
+		@a write as it goes, a record at a time, instead of building the
+		whole page first.
+
+		@param write A function which is given each piece of the page.
+		"""
 
 		# We don't want to show the primary key(s) on the joined structures
 		# since this information is already available from the root structure.
-		keys = self.rootStructure(env).findPK()
+		keys = self.rootStructure.newRecord(env).findPK()
 		for structures in [x for x in self.data if x]:
 			for structure in structures:
 				if not isinstance(structure, self.rootStructure):
-					for key in keys:
-						structure.allFields[key].visible = False
+					# Grandchildren, like WebRedirects, may not have them.
+					for key in [x for x in keys if structure.allFields.has_key(x)]:
+						structure.privateField(key).visible = False
+
+		write(formOpen(action=env.req.uri))
+		write('<p>' + span(self.pageTitle, 'page_header') + '</p>\n')
 
 		# Print out title + set of accounts for each type of account
 		for structure in [x for x in self.data if x]:
-			accountArea = []
+			# If this is the root structure, don't stick a title on
+			isRoot = self.rootStructure and isinstance(structure[0], self.rootStructure)
+			if not isRoot:
+				write(regionTitle(structure[0].groupTitle))
+			write(tableOpen(structure[0].formTitle, cellpadding=3))
 
 			if arrangement == 'row' or (not arrangement and structure[0].defaultFieldArrangement == 'row'):
-				accountArea.append(structure[0].getFormTitleRow(editable=a.editable))
+				write(structure[0].getFormTitleRow(editable=a.editable))
 
 			if arrangement != 'auto':
-				accountArea.append(structure[0].getFormSet(env, structure, a.editable, arrangement=arrangement))
+				structure[0].writeFormSet(env, structure, write, a.editable, arrangement=arrangement)
 
-			# If this is the root structure, don't stick a title on
-			if self.rootStructure and isinstance(structure[0], self.rootStructure):
-				if arrangement == 'auto':
-					accountArea.append(structure[0].getFormSet(env, structure, a.editable, arrangement='form'))
-				out.append(table(structure[0].formTitle, ''.join(accountArea), cellpadding=3))
-			else:
-				if arrangement == 'auto':
-					accountArea.append(structure[0].getFormTitleRow(editable=a.editable, arrangement='row'))
-					accountArea.append(structure[0].getFormSet(env, structure, a.editable, arrangement='row'))
-				out.append(region(structure[0].groupTitle, table(structure[0].formTitle, ''.join(accountArea), cellpadding=3)))
+			if arrangement == 'auto':
+				if isRoot:
+					structure[0].writeFormSet(env, structure, write, a.editable, arrangement='form')
+				else:
+					write(structure[0].getFormTitleRow(editable=a.editable, arrangement='row'))
+					structure[0].writeFormSet(env, structure, write, a.editable, arrangement='row')
+
+			write(tableClose())
 
+		out = []
 		out.append('<p>');
+		if self.totalCount != None:
+			out.append(span(str(len(self.data[0])) + ' of ' + str(self.totalCount) + ' records', 'record_count'))
+
 		# TODO: These should probably be rolled into something javascripty to allow buttons to do different things
 		if a.nextTitle:
 			out.append(button("submit", value=a.nextTitle, content=a.nextTitle))
 
+		if self.nextPageToken != None:
+			out.append(button("pageToken", value=self.nextPageToken, content="Next Page"))
+
 		out.append(hiddenInput("action", value=a.nextAction))
 		out.append(hiddenInput("module", value=moduleName))
 
@@ -82,7 +149,8 @@ class DataModule:
 
 		out.append(''.join([hiddenInput(x, value=env.fieldStorage[x]) for x in [x for x in self.extraVars if env.fieldStorage.has_key(x)]]))
 
-		return form('<p>' + span(self.pageTitle, 'page_header') + '</p>\n' + ''.join(out), action=env.req.uri)
+		write(''.join(out))
+		write(formClose())
 
 	def buildQueryFromForm(self, env):
 		query = {}
@@ -95,6 +163,11 @@ class DataModule:
 		for x, y in zip(self.criterion, self.value):
 			self.query[x] = y
 
+	def hasCriterionInForm(self):
+		fs = self.env.fieldStorage
+		return (fs.has_key('criterion') and fs.has_key('value')) or \
+		       (fs.has_key('criterion.0') and fs.has_key('value.0'))
+
 	def setCriterion(self):
 		fs = self.env.fieldStorage
 
@@ -141,23 +214,190 @@ class DataModule:
 	def dbLoad(self, env, query):
 		self.dbLoadCore(env, self.structures, env.con, query)
 
+	def dbLoadPage(self, env, query=None, pageToken=None):
+		r"""
+		Load one page of the root structure and the records joined to
+		it. The token of the next page is kept in @c nextPageToken and
+		the number of matching records in @c totalCount.
+		"""
+		(structureSet, self.nextPageToken) = self.rootStructure.dbLoadPage(env, env.con, query=query, pageToken=pageToken)
+		self.totalCount = self.rootStructure.dbCount(env, query)
+		self.data.append(structureSet)
+
+		if self.structures[self.rootStructure]:
+			self.dbLoadChildren(env, self.structures[self.rootStructure], env.con, structureSet)
+
 	def dbLoadCore(self, env, structures, con, query):
+		results = None
+		if self.dbLoadConcurrently and len(structures) > 1:
+			results = self.dbLoadConcurrent(env, structures, query)
+
 		for structure in structures:
-			structureSet = list(structure.dbLoad(env, con, query=query))
+			if results != None:
+				(structureSet, children) = results[structure]
+			else:
+				(structureSet, children) = self.dbLoadTree(env, structure, structures[structure], con, query)
 			#env.req.write('<p>Structure: ' + htmlEscape(structureSet) + '</p>')
 			self.data.append(structureSet)
 
 			if structures[structure]:
-				for record in structureSet:
-					PK = record.findPK()
+				self.appendChildSets(structures[structure], structureSet, children)
+
+	def dbLoadTree(self, env, structure, childStructures, con, query):
+		r"""
+		Load the records of @a structure matching @a query and the
+		records joined to them.
+
+		@return A two element tuple of the records of @a structure and
+		        the children from dbLoadChildSets().
+		"""
+		structureSet = list(structure.dbLoad(env, con, query=query))
+
+		children = {}
+		if childStructures:
+			self.dbLoadChildSets(env, childStructures, con, structureSet, children)
+
+		return (structureSet, children)
+
+	def dbLoadConcurrent(self, env, structures, query):
+		r"""
+		Load the trees of sibling structures at the same time.
+
+		Each thread loads one structure's tree at a time (see
+		dbLoadTree()) on a connection from @em env getConnection(), so
+		the time taken is close to that of the slowest tree rather than
+		the sum of them all. An exception raised by any of the loads is
+		raised again once all of the threads have finished.
+
+		@return A dictionary of the results of dbLoadTree() keyed on the
+		        structure, or @c None if no connection could be opened,
+		        in which case the caller should load the structures one
+		        after another.
+		"""
+		pending = structures.keys()
+		results = {}
+		errors = []
+		lock = threading.Lock()
+
+		def work(con):
+			try:
+				while 1:
+					lock.acquire()
+					try:
+						if len(pending) == 0 or len(errors) > 0:
+							return
+						structure = pending.pop(0)
+					finally:
+						lock.release()
+
+					try:
+						result = self.dbLoadTree(env, structure, structures[structure], con, query)
+					except:
+						errors.append(sys.exc_info())
+						return
+					results[structure] = result
+			finally:
+				env.releaseConnection(con)
+
+		threads = []
+		for i in range(min(self.dbLoadThreads, len(structures))):
+			con = env.getConnection()
+			if con == None:
+				break
+			thread = threading.Thread(target=work, args=(con,))
+			thread.start()
+			threads.append(thread)
+
+		if len(threads) == 0:
+			return None
+
+		for thread in threads:
+			thread.join()
+
+		if len(errors) > 0:
+			raise errors[0][0], errors[0][1], errors[0][2]
+
+		return results
+
+	def dbLoadChildren(self, env, structures, con, structureSet):
+		r"""
+		Load the records joined to the records of @a structureSet.
+
+		Each structure in the tree below @a structureSet is loaded for
+		all of its parent records with one query (see
+		Structure::Structure::dbLoadMatching()), so the number of
+		queries depends on the tree and not on the number of records.
+		The records are then split up by their parent and appended to
+		@c data in the same order as if each parent's children had been
+		loaded on their own.
+		"""
+		children = {}
+		self.dbLoadChildSets(env, structures, con, structureSet, children)
+		self.appendChildSets(structures, structureSet, children)
+
+	def dbLoadChildSets(self, env, structures, con, parents, children):
+		r"""
+		Load the records of @a structures joined to @a parents, and
+		their children in turn.
+
+		@param children A dictionary which is filled in with a list of
+		                the records of each structure in @a structures
+		                joined to each parent, keyed on the id() of the
+		                parent.
+		"""
+		if len(parents) == 0:
+			return
+
+		PK = parents[0].findPK()
+
+		assert len(PK) >= 1, 'Only tables with one or more primary keys can be recursed here'
+
+		# The join fields are the fields of the child with the same
+		# name as the parent's primary key fields in the database.
+		joinFields = [parents[0].allFields[key].dbName for key in PK]
+		parentKeys = [tuple([record.values[key] for key in PK]) for record in parents]
+
+		for record in parents:
+			children[id(record)] = []
 
-					assert len(PK) >= 1, 'Only tables with one or more primary keys can be recursed here'
+		for structure in structures:
+			instance = structure.getSchema(env)
+			indexes = [i for i in range(len(joinFields))
+			           if instance.allFields.has_key(joinFields[i]) and
+			              instance.allFields[joinFields[i]].present]
+			assert len(indexes) > 0, 'No valid fields were present in query.' + str(joinFields)
+
+			fields = [joinFields[i] for i in indexes]
+			keys = {}
+			for key in parentKeys:
+				keys[tuple([key[i] for i in indexes])] = True
+
+			groups = {}
+			structureSet = []
+			for record in structure.dbLoadMatching(env, con, fields, keys.keys()):
+				key = tuple([record.values[x] for x in fields])
+				if groups.has_key(key):
+					groups[key].append(record)
+				else:
+					groups[key] = [record]
+				structureSet.append(record)
+
+			for (record, key) in zip(parents, parentKeys):
+				children[id(record)].append(groups.get(tuple([key[i] for i in indexes]), []))
 
-					joinQuery = {}
-					for key in PK:
-						joinQuery[record.allFields[key].dbName] = record.values[key]
+			if structures[structure]:
+				self.dbLoadChildSets(env, structures[structure], con, structureSet, children)
 
-					self.dbLoadCore(env, structures[structure], con, joinQuery)
+	def appendChildSets(self, structures, parents, children):
+		r"""
+		Append the records loaded by dbLoadChildSets() to @c data.
+		"""
+		for record in parents:
+			for (structure, structureSet) in zip(structures.keys(), children[id(record)]):
+				self.data.append(structureSet)
+
+				if structures[structure]:
+					self.appendChildSets(structures[structure], structureSet, children)
 
 	def TEMPdbLoadCore(self, env, structures, cur, query):
 		for structure in structures:
@@ -175,14 +415,19 @@ class DataModule:
 			self.data.append(structureSet)
 
 	def dbSave(self, env):
-		# FIXME: dbSave is not yet implemented.
-		#raise NotImplementedError, 'This function is not yet implemented.'
+		r"""
+		Save the records submitted with the form.
+
+		The records of each structure are loaded from the form and
+		saved with Structure::Structure::dbSaveMany(), which commits
+		them.
 
+		@param env An instance of the @em env class which keeps track
+		           of the current operational environment.
+		"""
 		self.formLoad(env)
 
 		for structure in self.data:
-			env.req.write('<p>' + htmlEscape('Structure = ' + str(structure)) + '</p>')
-			for record in structure:
-				env.req.write('<p>' + htmlEscape('Record = ' + str(record)) + '</p>')
-				record.dbSave(env)
+			if len(structure) > 0:
+				structure[0].dbSaveMany(env, structure)
 
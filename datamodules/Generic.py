@@ -1,5 +1,6 @@
 from datamodules.action import action
 from datamodules.DataModule import DataModule
+from registry import Registry
 
 class Generic(DataModule):
 
@@ -7,12 +8,13 @@ class Generic(DataModule):
 		self.moduleName = 'Generic'
 
 		structureName = env.fieldStorage['structure']
-		structureFile = __import__('structures.'+structureName)
-		structureCls = eval('structureFile.'+structureName+'.'+structureName)
+		structureCls = Registry.getStructure(structureName)
+		assert structureCls != None, "Unrecognized structure: " + structureName
 		structureCls.defaultFieldArrangement = 'list'
 
 		self.actions = {"edit":		action(loadFromDb=1, editable=1, nextAction="update", nextTitle="Save"),
 				"view":		action(loadFromDb=1, editable=0, nextAction="edit", nextTitle="Edit"),
+				"list":		action(loadFromDb=1, paged=1, editable=0, nextAction="list"),
 				"verify":	action(loadFromForm=1, editable=1, nextAction="update", nextTitle="Save"),
 				"update":	action(loadFromDb=1, editable=0, preFunction=self.dbSave, chainAction="view") }
 
@@ -27,11 +29,13 @@ class Generic(DataModule):
 
 		self.pageTitle = ""
 
-	def getHtml(self, env, a, moduleName=None, arrangement=None):
+	def writeHtml(self, env, a, write, moduleName=None, arrangement=None):
 
-		if len(self.data[0]) > 1:
+		if len(self.data[0]) == 0:
+			self.pageTitle = self.rootStructure.newRecord(env).groupTitle
+		elif len(self.data[0]) > 1 or self.nextPageToken != None:
 			self.pageTitle = self.data[0][0].groupTitle
 		else:
 			self.pageTitle = self.data[0][0].formTitle
 
-		return DataModule.getHtml(self, env, a, moduleName=moduleName, arrangement=arrangement)
+		DataModule.writeHtml(self, env, a, write, moduleName=moduleName, arrangement=arrangement)
@@ -1,6 +1,6 @@
 class action:
 
-	def __init__(self, editable=0, queryFromForm=0, loadFromDb=0, loadFromForm=0, nextModule=None, nextAction=None, nextTitle=None, nextLink=None, preFunction=None, chainAction=None):
+	def __init__(self, editable=0, queryFromForm=0, loadFromDb=0, loadFromForm=0, nextModule=None, nextAction=None, nextTitle=None, nextLink=None, preFunction=None, chainAction=None, paged=0):
 		self.editable=editable
 		self.queryFromForm=queryFromForm
 		self.loadFromDb=loadFromDb
@@ -11,3 +11,4 @@ class action:
 		self.nextLink=nextLink
 		self.preFunction=preFunction
 		self.chainAction=chainAction
+		self.paged=paged
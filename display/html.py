@@ -68,6 +68,22 @@ def form(text, action=None, method='post'):
 	text = str(text)
 	assert text != "", 'text must not be the empty string.'
 
+	return formOpen(action, method) + text + formClose()
+
+def formOpen(action=None, method='post'):
+	r"""
+	Creates the start tag of an HTML form.
+
+	The form must be ended with formClose(). Together, they produce the
+	same HTML as form(), but the inside of the form can be written out
+	a piece at a time.
+
+	@param action The file handling the output from the form.
+	@param method The HTTP method to use when submitting the form.
+
+	@pre @a method must be @c get or @c post.
+	"""
+
 	assert method == 'get' or method == 'post', \
 	  'method must be "get" or "post".'
 
@@ -81,10 +97,17 @@ def form(text, action=None, method='post'):
 	out += ' action="' + htmlEscape(action) + '"'
 	out += ' method="' + htmlEscape(method) + '"'
 
-	out += '>\n' + text + '</form>\n'
+	out += '>\n'
 
 	return out
 
+def formClose():
+	r"""
+	Creates the end tag of an HTML form started with formOpen().
+	"""
+
+	return '</form>\n'
+
 def table(summary, text, cellspacing=0, cellpadding=0):
 	r"""
 	Creates an HTML table.
@@ -106,14 +129,33 @@ def table(summary, text, cellspacing=0, cellpadding=0):
 	@pre @a cellpadding must be an integer greater than or equal to zero.
 	"""
 
-	assert summary != None, 'summary must not be None.'
-	summary = str(summary)
-	assert summary != "", 'summary must not be the empty string.'
-
 	assert text != None, 'text must not be None.'
 	text = str(text)
 	assert text != "", 'text must not be the empty string.'
 
+	return tableOpen(summary, cellspacing, cellpadding) + text + tableClose()
+
+def tableOpen(summary, cellspacing=0, cellpadding=0):
+	r"""
+	Creates the start tag of an HTML table.
+
+	The table must be ended with tableClose(). Together, they produce
+	the same HTML as table(), but the rows of the table can be written
+	out a piece at a time.
+
+	@param summary     The purpose of the content of the table.
+	@param cellspacing The spacing between the table's cells.
+	@param cellpadding The spacing within the table's cells.
+
+	@pre @a summary must not be @c None or the empty string.
+	@pre @a cellspacing must be an integer greater than or equal to zero.
+	@pre @a cellpadding must be an integer greater than or equal to zero.
+	"""
+
+	assert summary != None, 'summary must not be None.'
+	summary = str(summary)
+	assert summary != "", 'summary must not be the empty string.'
+
 	try:
 		cellspacing = int(cellspacing)
 		assert (cellspacing >= 0), \
@@ -129,8 +171,14 @@ def table(summary, text, cellspacing=0, cellpadding=0):
 		assert 0, 'cellpadding must be convertable to an int.'
 
 	return '<table summary="' + htmlEscape(summary) + '" cellspacing="' + \
-	  str(cellspacing) + '" cellpadding="' + str(cellpadding) + '">\n' + \
-	  text + '</table>\n'
+	  str(cellspacing) + '" cellpadding="' + str(cellpadding) + '">\n'
+
+def tableClose():
+	r"""
+	Creates the end tag of an HTML table started with tableOpen().
+	"""
+
+	return '</table>\n'
 
 def row(text):
 	r"""
@@ -399,7 +447,7 @@ def textInput(name, value=None, width=25, maxLength=None, editable=True):
 
 
 # START HTML Advanced Widgets
-def dropDown(name, values, titles=None, default=None):
+def dropDown(name, values=None, titles=None, default=None, options=None):
 	r"""
 	Creates a selectable drop-down list.
 
@@ -408,6 +456,9 @@ def dropDown(name, values, titles=None, default=None):
 	@param titles  The viewed list to select from.
 	@param default Determines which value is selected in the list as the
 	               default value.
+	@param options The items of the list from dropDownOptions(), which
+	               are used instead of @a values and @a titles. This
+	               saves escaping the same items for every list.
 
 	@pre @a name must not be @c None or the empty string.
 	"""
@@ -416,19 +467,42 @@ def dropDown(name, values, titles=None, default=None):
 	name = str(name)
 	assert name != "", 'name must not be the empty string.'
 
+	if options == None:
+		options = dropDownOptions(values, titles)
+
+	if default != None:
+		default = str(default)
+
+	out = ['<select']
+	out.append(' name="' + htmlEscape(name) + '"')
+	out.append('>\n')
+	for value, start, end in options:
+		out.append(start)
+		if value == default:
+			out.append(' selected="selected"')
+		out.append(end)
+	out.append('</select>')
+	return ''.join(out)
+
+def dropDownOptions(values, titles=None):
+	r"""
+	Prepares the items of a drop-down list for dropDown().
+
+	@param values The value of each item in the list.
+	@param titles The viewed list to select from.
+
+	@return A list of the items, each a tuple of the value as a string
+	        and the HTML code before and after the point where an item
+	        is marked as selected.
+	"""
+
 	if titles == None:
 		titles=values
 
-	out = '<select'
-	out += ' name="' + htmlEscape(name) + '"'
-	out += '>\n'
-	for value, title in zip(values, titles):
-		out += '<option value="' + htmlEscape(value) + '"'
-		if default != None and str(value) == str(default):
-			out += ' selected="selected"'
-		out += '>' + htmlEscape(title) + '</option>\n'
-	out += '</select>'
-	return out
+	return [(str(value),
+	         '<option value="' + htmlEscape(value) + '"',
+	         '>' + htmlEscape(title) + '</option>\n')
+	        for value, title in zip(values, titles)]
 
 def region(title, text, cssClass=None):
 	r"""
@@ -447,14 +521,30 @@ def region(title, text, cssClass=None):
 	@pre @a cssClass must not be the empty string.
 	"""
 
-	assert title != None, 'title must not be None.'
-	title = str(title)
-	assert title != "", 'title must not be the empty string.'
-
 	assert text != None, 'text must not be None.'
 	text = str(text)
 	assert text != "", 'text must not be the empty string.'
 
+	return regionTitle(title, cssClass) + text
+
+def regionTitle(title, cssClass=None):
+	r"""
+	Defines the title paragraph of a region.
+
+	This is the HTML region() puts before its text, so that the text can
+	be written out a piece at a time.
+
+	@param title    The title associated with the paragraph.
+	@param cssClass The CSS class to use to display @a title. If @a cssClass is @c None, @c region_header will be used.
+
+	@pre @a title must not be @c None or the empty string.
+	@pre @a cssClass must not be the empty string.
+	"""
+
+	assert title != None, 'title must not be None.'
+	title = str(title)
+	assert title != "", 'title must not be the empty string.'
+
 	if cssClass == None:
 		cssClass = 'region_header'
 	else:
@@ -462,6 +552,6 @@ def region(title, text, cssClass=None):
 
 	assert cssClass != "", 'cssClass must not be the empty string.'
 
-	return '<p>' + span(title, cssClass) + '</p>\n' + text
+	return '<p>' + span(title, cssClass) + '</p>\n'
 
 # END HTML Advanced Widgets
@@ -1,6 +1,35 @@
 # This is needed for the barf function
 from display.html import htmlEscape
 
+from util.ConnectionPool import ConnectionPool
+
+def connectProvider1():
+	r"""
+	Open a new connection to the database of provider1.example.com.
+
+	@return A DB-API connection, or @c None if the database cannot be
+	        reached.
+	"""
+	# TEMP: Connect to the database.
+	try:
+		import dbi
+		import odbc
+		con = odbc.odbc('DSN/user/pass')
+		# The odbc module predates paramstyle, but
+		# ODBC binds qmark parameters natively.
+		paramStyle = 'qmark'
+	except:
+		try:
+			import Sybase
+			con = Sybase.connect('127.0.0.1:1433', 'username', 'password')
+			paramStyle = Sybase.paramstyle
+		except:
+			return None
+
+	import util.CursorWrapper
+	util.CursorWrapper.CursorWrapper.registerParamStyle(con, paramStyle)
+	return con
+
 class env:
 	r"""
 	Contains info about the state of Skime, like the provider and preferences
@@ -8,15 +37,139 @@ class env:
 
 	def __del__(self):
 		try:
-			if self.con != None:
-				self.con.close()
+			self.close()
 		except AttributeError:
 			pass
 
-	def __init__(self, req, provider=None):
+	# The feature flags of the structures, and the configuration hooks
+	# which adjust their fields, before any provider configuration.
+	# A flag of 0 hides the structure; see getProviderConfig().
+	abuseEvent = 1
+	configAbuseEvent = None
+	abuseGracePeriod = 1
+	configAbuseGracePeriod = None
+	abuseHandler = 1
+	configAbuseHandler = None
+	accountType = 1
+	configAccountType = None
+	blacklistEntry = 1
+	configBlacklistEntry = None
+	dnsRecord = 1
+	configDNSRecord = None
+	domain = 1
+	configDomain = None
+	dslAccount = 1
+	configDSLAccount = None
+	dslBlock = 1
+	configDSLBlock = None
+	dslChannel = 1
+	configDSLChannel = None
+	equipmentClass = 1
+	configEquipmentClass = None
+	equipmentType = 1
+	configEquipmentType = None
+	greylistTriplet = 1
+	configGreylistTriplet = None
+	internalUser = 1
+	externalSystem = 1
+	configExternalSystem = None
+	group = 1
+	configGroup = None
+	configInternalUser = None
+	mailEvent = 1
+	configMailEvent = None
+	mailSenderCacheEntry = 1
+	configMailSenderCacheEntry = None
+	manufacturer = 1
+	configManufacturer = None
+	masterAccount = 1
+	configMasterAccount = None
+	msAddressBookIndividual = 1
+	configMSAddressBookIndividual = None
+	msAddressBookGroupEntry = 1
+	configMSAddressBookGroupEntry = None
+	msNote = 1
+	configMSNote = None
+	networkDevice = 1
+	configNetworkDevice = None
+	problem = 1
+	configProblem = None
+	problemCategory = 1
+	configProblemCategory = None
+	project = 1
+	configProject = None
+	projectComment = 1
+	configProjectComment = None
+	projectStatus = 1
+	configProjectStatus = None
+	projectUser = 1
+	configProjectUser = None
+	provider = 1
+	configProvider = None
+	region = 1
+	configRegion = None
+	subAccount = 1
+	configSubAccount = None
+	subWeb = 1
+	configSubWeb = None
+	subWebUser = 1
+	configSubWebUser = None
+	task = 1
+	configTask = None
+	taskDate = 1
+	configTaskDate = None
+	taskException = 1
+	configTaskException = None
+	taskUser = 1
+	configTaskUser = None
+	terminal = 1
+	configTerminal = None
+	terminalPhone = 1
+	configTerminalPhone = None
+	troubleTicket = 1
+	configTroubleTicket = None
+	troubleTicketComment = 1
+	configTroubleTicketComment = None
+	wantAdCategory = 1
+	configWantAdCategory = None
+	wantAdEntry = 1
+	configWantAdEntry = None
+	wirelessAccount = 1
+	configWirelessAccount = None
+	web = 1
+	configWeb = None
+	webRedirect = 1
+	configWebRedirect = None
+	webUser = 1
+	configWebUser = None
+	whitelistEntry = 1
+	configWhitelistEntry = None
+
+	# The getProviderConfig() of each provider string.
+	__providerConfigs = {}
+
+	def __init__(self, req, provider=None, fieldStorage=None,
+	             poolTimeout=None, connect=True):
+		r"""
+		@param req          The request, or @c None outside of a web
+		                    request.
+		@param provider     The provider string, which is only used
+		                    if @a req is @c None.
+		@param fieldStorage The form fields of the request as a
+		                    dictionary, or @c None to parse them from
+		                    @a req with mod_python.
+		@param poolTimeout  The number of seconds to wait for a pooled
+		                    connection, or @c None for the timeout of
+		                    the pool. See @c poolExhausted.
+		@param connect      If @c False, no database connection is
+		                    leased, as when only the configuration of
+		                    the provider is needed.
+		"""
 		self.req = req
 
-		if self.req != None:
+		if fieldStorage != None:
+			self.fieldStorage = fieldStorage
+		elif self.req != None:
 			try:
 				from mod_python import util
 				self.fieldStorage = util.FieldStorage(self.req)
@@ -26,108 +179,24 @@ class env:
 			self.fieldStorage = {}
 
 		self.con = None
+		# The ConnectionPool con is leased from, if any.
+		self.pool = None
+		# True if every connection of the pool was leased, so the env
+		# has no connection.
+		self.poolExhausted = False
+		# Extra connections returned by releaseConnection() for reuse
+		# when there is no pool.
+		self.idleCons = []
+		# The name of the SQL dialect of con: 'mssql' for SQL Server or
+		# 'sqlite' for the stand-in database used by the benchmarks.
+		# (See util.SQLDialect.)
+		self.dbDialect = 'mssql'
 		self.requireSSL = False
 
-		self.abuseEvent = 1
-		self.configAbuseEvent = None
-		self.abuseGracePeriod = 1
-		self.configAbuseGracePeriod = None
-		self.abuseHandler = 1
-		self.configAbuseHandler = None
-		self.accountType = 1
-		self.configAccountType = None
-		self.blacklistEntry = 1
-		self.configBlacklistEntry = None
-		self.dnsRecord = 1
-		self.configDNSRecord = None
-		self.domain = 1
-		self.configDomain = None
-		self.dslAccount = 1
-		self.configDSLAccount = None
-		self.dslBlock = 1
-		self.configDSLBlock = None
-		self.dslChannel = 1
-		self.configDSLChannel = None
-		self.equipmentClass = 1
-		self.configEquipmentClass = None
-		self.equipmentType = 1
-		self.configEquipmentType = None
-		self.greylistTriplet = 1
-		self.configGreylistTriplet = None
-		self.internalUser = 1
-		self.externalSystem = 1
-		self.configExternalSystem = None
-		self.group = 1
-		self.configGroup = None
-		self.configInternalUser = None
-		self.mailEvent = 1
-		self.configMailEvent = None
-		self.mailSenderCacheEntry = 1
-		self.configMailSenderCacheEntry = None
-		self.manufacturer = 1
-		self.configManufacturer = None
-		self.masterAccount = 1
-		self.configMasterAccount = None
-		self.msAddressBookIndividual = 1
-		self.configMSAddressBookIndividual = None
-		self.msAddressBookGroupEntry = 1
-		self.configMSAddressBookGroupEntry = None
-		self.msNote = 1
-		self.configMSNote = None
-		self.networkDevice = 1
-		self.configNetworkDevice = None
-		self.problem = 1
-		self.configProblem = None
-		self.problemCategory = 1
-		self.configProblemCategory = None
-		self.project = 1
-		self.configProject = None
-		self.projectComment = 1
-		self.configProjectComment = None
-		self.projectStatus = 1
-		self.configProjectStatus = None
-		self.projectUser = 1
-		self.configProjectUser = None
-		self.provider = 1
-		self.configProvider = None
-		self.region = 1
-		self.configRegion = None
-		self.subAccount = 1
-		self.configSubAccount = None
-		self.subWeb = 1
-		self.configSubWeb = None
-		self.subWebUser = 1
-		self.configSubWebUser = None
-		self.task = 1
-		self.configTask = None
-		self.taskDate = 1
-		self.configTaskDate = None
-		self.taskException = 1
-		self.configTaskException = None
-		self.taskUser = 1
-		self.configTaskUser = None
-		self.terminal = 1
-		self.configTerminal = None
-		self.terminalPhone = 1
-		self.configTerminalPhone = None
-		self.troubleTicket = 1
-		self.configTroubleTicket = None
-		self.troubleTicketComment = 1
-		self.configTroubleTicketComment = None
-		self.wantAdCategory = 1
-		self.configWantAdCategory = None
-		self.wantAdEntry = 1
-		self.configWantAdEntry = None
-		self.wirelessAccount = 1
-		self.configWirelessAccount = None
-		self.web = 1
-		self.configWeb = None
-		self.webRedirect = 1
-		self.configWebRedirect = None
-		self.webUser = 1
-		self.configWebUser = None
-		self.whitelistEntry = 1
-		self.configWhitelistEntry = None
+		# The username and the @c Name of the InternalUser who made the
+		# request, once authenhandler has verified them.
+		self.username = None
+		self.realName = None
 
 		if self.req == None:
 			if provider == None and self.req == None:
@@ -139,77 +208,151 @@ class env:
 			# FIXME: Get Provider from req somehow (probably from the fieldStorage object)
 			self.providerString = 'provider1.example.com'
 
-		if self.providerString == "provider1.example.com":
-			# TEMP: Connect to the database.
+		(flags, hooks) = self.getProviderConfig(self.providerString)
+		self.__dict__.update(flags)
+		for name in hooks.keys():
+			setattr(self, name, getattr(self, hooks[name]))
+
+		if connect and self.providerString == "provider1.example.com":
+			self.pool = ConnectionPool.get(self.providerString, connectProvider1)
 			try:
-				import dbi
-				import odbc
-				self.con = odbc.odbc('DSN/user/pass')
-			except:
-				try:
-					import Sybase
-					self.con = Sybase.connect('127.0.0.1:1433', 'username', 'password')
-				except:
-					self.con = None
-
-			self.configMasterAccount = self.provider1ConfigMasterAccount
-			self.configSubAccount = self.provider1ConfigSubAccount
-			self.configWeb = self.provider1ConfigWeb
+				self.con = self.pool.acquire(poolTimeout)
+			except RuntimeError:
+				# Every connection is leased; carry on as though
+				# the database could not be reached.
+				self.con = None
+				self.poolExhausted = True
+
+	def getProviderConfig(cls, providerString):
+		r"""
+		Get the configuration of a provider.
+
+		The configuration only depends on the provider string, so it is
+		worked out the first time it is needed and then reused by every
+		env of the process.
+
+		@param providerString The provider string.
+
+		@return A (@e flags, @e hooks) tuple. @e flags is a dictionary
+		        of the feature flags which differ from the class
+		        defaults. @e hooks is a dictionary of the names of the
+		        methods to use as the @c configXxx hooks, keyed on the
+		        hook.
+		"""
+		try:
+			return cls.__providerConfigs[providerString]
+		except KeyError:
+			pass
+
+		flags = {}
+		hooks = {}
+
+		if providerString == "provider1.example.com":
+			hooks['configMasterAccount'] = 'provider1ConfigMasterAccount'
+			hooks['configSubAccount'] = 'provider1ConfigSubAccount'
+			hooks['configWeb'] = 'provider1ConfigWeb'
 
 			# TEMP: These tables doesn't exist in the database yet.
-			self.dslAccount = 0
-			self.wirelessAccount = 0
-
-		elif self.providerString == "provider2.example.com":
-			self.abuseEvent = 0
-			self.abuseGracePeriod = 0
-			self.abuseHandler = 0
-			self.blacklistEntry = 0
-			self.dnsRecord = 0
-			self.dslAccount = 0
-			self.dslBlock = 0
-			self.dslChannel = 0
-			self.equipmentClass = 0
-			self.equipmentType = 0
-			self.greylistTriplet = 0
-			self.internalUser = 0
-			self.mailEvent = 0
-			self.mailSenderCacheEntry = 0
-			self.manufacturer = 0
-			self.configMasterAccount = self.provider2ConfigMasterAccount
-			self.msAddressBookIndividual = 0
-			self.msAddressBookGroupEntry = 0
-			self.msNote = 0
-			self.networkDevice = 0
-			self.problem = 0
-			self.problemCategory = 0
-			self.project = 0
-			self.projectComment = 0
-			self.projectStatus = 0
-			self.projectUser = 0
-			self.configSubAccount = self.provider2ConfigSubAccount
-			self.subWeb = 0
-			self.subWebUser = 0
-			self.task = 0
-			self.taskDate = 0
-			self.taskException = 0
-			self.taskUser = 0
-			self.terminal = 0
-			self.terminalPhone = 0
-			self.troubleTicket = 0
-			self.troubleTicketComment = 0
-			self.wantAdCategory = 0
-			self.wantAdEntry = 0
-			self.wirelessAccount = 0
-			self.web = 0
-			self.webRedirect = 0
-			self.webUser = 0
-			self.whitelistEntry = 0
-
-		assert ((self.web and self.webUser) or ((not self.web) and (not self.webUser))), 'webs and webUsers must stick together.'
-		assert (not self.subWeb or (self.subWeb and self.web)), 'One cannot have subWebs without webs to subdivide.'
-		assert (not self.webRedirect or (self.webRedirect and self.web)), 'One cannot have webRedirects without webs to redirect to.'
-		assert (not self.troubleTicketComment or (self.troubleTicketComment and self.troubleTicket)), 'One cannot have troubleTicketComments without troubleTickets to comment on.'
+			flags['dslAccount'] = 0
+			flags['wirelessAccount'] = 0
+
+		elif providerString == "provider2.example.com":
+			for name in ('abuseEvent', 'abuseGracePeriod', 'abuseHandler',
+			             'blacklistEntry', 'dnsRecord', 'dslAccount',
+			             'dslBlock', 'dslChannel', 'equipmentClass',
+			             'equipmentType', 'greylistTriplet',
+			             'internalUser', 'mailEvent',
+			             'mailSenderCacheEntry', 'manufacturer',
+			             'msAddressBookIndividual',
+			             'msAddressBookGroupEntry', 'msNote',
+			             'networkDevice', 'problem', 'problemCategory',
+			             'project', 'projectComment', 'projectStatus',
+			             'projectUser', 'subWeb', 'subWebUser', 'task',
+			             'taskDate', 'taskException', 'taskUser',
+			             'terminal', 'terminalPhone', 'troubleTicket',
+			             'troubleTicketComment', 'wantAdCategory',
+			             'wantAdEntry', 'wirelessAccount', 'web',
+			             'webRedirect', 'webUser', 'whitelistEntry'):
+				flags[name] = 0
+			hooks['configMasterAccount'] = 'provider2ConfigMasterAccount'
+			hooks['configSubAccount'] = 'provider2ConfigSubAccount'
+
+		def flag(name):
+			return flags.get(name, getattr(cls, name))
+
+		assert ((flag('web') and flag('webUser')) or ((not flag('web')) and (not flag('webUser')))), 'webs and webUsers must stick together.'
+		assert (not flag('subWeb') or (flag('subWeb') and flag('web'))), 'One cannot have subWebs without webs to subdivide.'
+		assert (not flag('webRedirect') or (flag('webRedirect') and flag('web'))), 'One cannot have webRedirects without webs to redirect to.'
+		assert (not flag('troubleTicketComment') or (flag('troubleTicketComment') and flag('troubleTicket'))), 'One cannot have troubleTicketComments without troubleTickets to comment on.'
+
+		cls.__providerConfigs[providerString] = (flags, hooks)
+		return (flags, hooks)
+	getProviderConfig = classmethod(getProviderConfig)
+
+	def connect(self):
+		r"""
+		Open a new connection to the database of the provider.
+
+		This is only used when the provider has no ConnectionPool.
+
+		@return A DB-API connection, or @c None if the provider has no
+		        database or it cannot be reached.
+		"""
+		return None
+
+	def getConnection(self):
+		r"""
+		Get a connection other than @c con, such as for loading data
+		on another thread.
+
+		The connection must be given back with releaseConnection().
+
+		@return A DB-API connection, or @c None if no more connections
+		        can be opened.
+		"""
+		if self.pool != None:
+			# Do not wait for one; the caller can make do with con.
+			try:
+				return self.pool.acquire(0)
+			except RuntimeError:
+				return None
+
+		try:
+			return self.idleCons.pop()
+		except IndexError:
+			return self.connect()
+
+	def releaseConnection(self, con):
+		r"""
+		Give back a connection from getConnection() for reuse.
+
+		@param con The connection.
+		"""
+		if self.pool != None:
+			self.pool.release(con)
+		else:
+			self.idleCons.append(con)
+
+	def close(self):
+		r"""
+		End the env's lease of @c con.
+
+		The connection is given back to the pool, or closed if there
+		is none. This should be called at the end of each request.
+		Calling it more than once does nothing.
+		"""
+		con = self.con
+		self.con = None
+		if con != None:
+			if self.pool != None:
+				self.pool.release(con)
+			else:
+				con.close()
+
+		idleCons = self.idleCons
+		self.idleCons = []
+		for con in idleCons:
+			con.close()
 
 	# provider1.example.com Provider Configuration
 	def provider1ConfigMasterAccount(self, rec):
@@ -325,3 +468,45 @@ class env:
 
 	def barf(self, string):
 		self.req.write('<p>' + htmlEscape(str(string)) + '</p>')
+
+def getRequestEnv(req, provider=None, fieldStorage=None, poolTimeout=None):
+	r"""
+	Get the env of a request.
+
+	The env is created the first time it is asked for and kept on
+	@a req, so that authenhandler, handler and the data modules share
+	one env, one FieldStorage and one database connection. The env is
+	closed by closeRequestEnv() when the request ends.
+
+	@param req          The mod_python request, or a request which
+	                    acts like one, such as a wsgi::WSGIRequest.
+	@param provider     The provider string to pass to the env.
+	@param fieldStorage The form fields to pass to the env.
+	@param poolTimeout  The pool timeout to pass to the env.
+
+	@return The @em env of @a req.
+	"""
+	try:
+		return req.skimeEnv
+	except AttributeError:
+		pass
+
+	e = env(req, provider, fieldStorage, poolTimeout)
+	req.skimeEnv = e
+	req.register_cleanup(closeRequestEnv, req)
+	return e
+
+def closeRequestEnv(req):
+	r"""
+	Close the env of a request, if it has one, and forget it.
+
+	@param req The request given to getRequestEnv().
+	"""
+	try:
+		e = req.skimeEnv
+	except AttributeError:
+		return
+	# The env refers back to the request, so the reference must be
+	# broken for both to be freed.
+	del req.skimeEnv
+	e.close()
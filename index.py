@@ -1,20 +1,29 @@
 import sys
 #sys.path.append('/srv/www/skime/html')
 
-from mod_python import apache
-from mod_python import util
+try:
+	from mod_python import apache
+except ImportError:
+	# Running under wsgi.py, which only needs the status codes.
+	class apache:
+		OK = 0
+		HTTP_MOVED_PERMANENTLY = 301
+		HTTP_UNAUTHORIZED = 401
+		HTTP_SERVICE_UNAVAILABLE = 503
 
 import base64
 import re
 
-import datamodules.CustomerRecord
-import datamodules.GeneralSearch
 import env
+from display.html import htmlEscape
+from registry import Registry
+from util.BufferedWriter import BufferedWriter
 
 import structures.InternalUser
+from structures.CredentialCache import CredentialCache
 
-username = ""
-name = ""
+# Load everything now rather than on the first request.
+Registry.preload('provider1.example.com')
 
 def formGet(env, varName):
 	if env.fieldStorage.has_key(varName):
@@ -25,9 +34,15 @@ def formGet(env, varName):
 	return var
 
 def handler(req):
-	e = env.env(req, 'provider1.example.com')
-	auth = authenhandler(req)
-	if auth != apache.OK: return(auth)
+	e = env.getRequestEnv(req, 'provider1.example.com')
+	# Every pooled connection is leased, so the request cannot be served.
+	if e.poolExhausted:
+		return apache.HTTP_SERVICE_UNAVAILABLE
+
+	# The authentication phase has usually verified the user already.
+	if e.username == None:
+		auth = authenhandler(req)
+		if auth != apache.OK: return(auth)
 	
 	module = formGet(e, 'module')
 	action = formGet(e, 'action')
@@ -76,7 +91,7 @@ def handler(req):
 				<td class="top_header_text">Skime</td>
 			</tr>
 			<tr class="top_header_row2">
-				<td colspan="2">User: """ + name + ' (' + username + ')' + """</td>
+				<td colspan="2">User: """ + e.realName + ' (' + e.username + ')' + """</td>
 			</tr>
 		</table>
 """)
@@ -85,33 +100,47 @@ def handler(req):
 		module = 'GeneralSearch'
 		action = 'searchform'
 
-	try:
-		modFile = __import__('datamodules.'+module)
-		modCls = eval('modFile.'+module+'.'+module)
+	# The page is sent as it is rendered, in pieces of a bounded size.
+	out = BufferedWriter(req.write)
+
+	modCls = Registry.getModule(module)
+	if modCls == None:
+		out.write('<p>Unknown module: ' + htmlEscape(module) + '</p>')
+	else:
 		mod = modCls(e)
-		req.write(mod.handleAction(e, action))
-	except:
-		req.write('Uh-oh.  Couldn\'t even load the standard module')
+		if hasattr(mod, 'writeAction'):
+			mod.writeAction(e, action, out.write)
+		else:
+			out.write(mod.handleAction(e, action))
 
-	req.write("</body></html>\n")
+	out.write("</body></html>\n")
+	out.flush()
 
 	return apache.OK
 
 def authenhandler(req):
-	global username, name
-	e = env.env(req, 'provider1.example.com')
+	e = env.getRequestEnv(req, 'provider1.example.com')
+	if e.poolExhausted:
+		return apache.HTTP_SERVICE_UNAVAILABLE
 	
 	password = req.get_basic_auth_pw()
 	username = req.user
+	name = None
 	
 	if (username and password):
-		for user in structures.InternalUser.InternalUser.dbLoad(e, e.con, query={'Username': username, 'Password': password}, orderBy=('Username',)):
-			# Reverify password because of possible database case-insensitivity.
-			if user.values['Username'].lower() == username.lower() and user.values['Password'] == password:
-				name = user.values['Name']
-				break
+		name = CredentialCache.get(e.providerString, username, password)
+		if name == None:
+			for user in structures.InternalUser.InternalUser.dbLoad(e, e.con, query={'Username': username, 'Password': password}, orderBy=('Username',)):
+				# Reverify password because of possible database case-insensitivity.
+				if user.values['Username'].lower() == username.lower() and user.values['Password'] == password:
+					name = user.values['Name']
+					if user.values['Active']:
+						CredentialCache.put(e.providerString, username, password, name)
+					break
 
 	if (name):
+		e.username = username
+		e.realName = name
 		return apache.OK
 	else:
 		return apache.HTTP_UNAUTHORIZED
\ No newline at end of file
@@ -158,6 +158,74 @@ def create_table(env, record):
 
 	return ''.join(out)
 
+def create_wide_table(env, record):
+	fields = [x for x in record.fieldOrder if record.allFields[x].present and (record.allFields[x].dbPrimaryKey or record.allFields[x].dbDynamicProperty)]
+	PK = [record.allFields[fieldName].dbName
+	  for fieldName in fields
+	  if record.allFields[fieldName].dbPrimaryKey]
+
+	out = []
+
+	out.append('CREATE TABLE [')
+	out.append(record.dbWideTable)
+	out.append('] (\n')
+
+	for fieldName in fields:
+		field = record.allFields[fieldName]
+
+		out.append('[')
+		out.append(field.dbName)
+		out.append('] ')
+		out.append(field.dbType)
+
+		if field.dbType.endswith('char'):
+			out.append('(')
+			# Deal with differences between database length and HTML maxlength.
+			if field.dbPrimaryKey and field.type == 'mac':
+				out.append('12')
+			elif field.dbPrimaryKey and field.type == 'phone':
+				out.append('10')
+			else:
+				# Dynamic properties are converted to the maxlength.
+				out.append(str(field.maxlength))
+
+			out.append(')')
+
+		if field.dbNulls or field.dbDynamicProperty:
+			out.append(' NULL')
+		else:
+			out.append(' NOT NULL')
+
+		out.append(',\n')
+
+	out.append('PRIMARY KEY CLUSTERED ([')
+	out.append('],['.join(PK))
+	out.append(']),\n')
+	out.append('FOREIGN KEY ([')
+	out.append('],['.join(PK))
+	out.append(']) REFERENCES [')
+	out.append(record.dbTable)
+	out.append(']\n')
+	out.append(');\n\n')
+
+	for fieldName in fields:
+		field = record.allFields[fieldName]
+		if not (field.dbIndexed and field.dbDynamicProperty):
+			continue
+		out.append('CREATE INDEX [idx_')
+		out.append(field.dbName)
+		out.append('] ON [')
+		out.append(record.dbWideTable)
+		out.append('] ([')
+		out.append(field.dbName)
+		out.append(']);\n')
+
+	# Fill the wide table from the existing property rows.
+	out.append(record.dbGenerateWideTableInsert(env))
+	out.append(';\n')
+
+	return ''.join(out)
+
 e = env.env(None)
 tables = []
 
@@ -324,14 +392,32 @@ if e.whitelistEntry:
 	import structures.WhitelistEntry
 	tables.append(structures.WhitelistEntry.WhitelistEntry)
 
+#
+# NOTE:
+#
+# Unlike the list above, every structure whose dynamic properties are
+# kept in a materialized wide table (one with a dbWideTable) is found
+# here, so none can be left out.
+#
+
+from registry import Registry
+
+wideTables = []
+for _structure in Registry.getStructures():
+	if getattr(_structure.newRecord(e), 'dbWideTable', None):
+		wideTables.append(_structure)
+
 # FIXME: Eventually, these SQL commands should be run on the database instead of being printed.
 
 for table in tables:
 	print create_table(e, table(e))
 
+for table in wideTables:
+	print create_wide_table(e, table(e))
+
 print "GO\n"
 
-for table in tables:
+for table in tables + wideTables:
 	_instance = table(e)
 	trigger = _instance.dbTriggers(e)
 	if trigger:
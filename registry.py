@@ -0,0 +1,215 @@
+r"""
+Skime Module Registry
+
+This module finds the data modules and structures of Skime by name, so
+that index.py and datamodules::Generic::Generic can dispatch on a form
+field through a dictionary instead of calling @c __import__ and
+@c eval on every request.
+"""
+
+import os
+import sys
+import threading
+import time
+import traceback
+import types
+
+class Registry:
+	r"""
+	Data Module and Structure Registry
+
+	preload() imports every module in the @c datamodules and
+	@c structures packages, keeps the class each one defines under the
+	module's name, and compiles the Schema::Schema of each structure for
+	a provider. It should be called when the process starts (index.py
+	does so when it is imported), so that the first request after a
+	deploy does not pay for the imports and schema compiles.
+
+	A module which cannot be imported does not stop the others from
+	loading. Its traceback is written to @c stderr (the Apache error
+	log under mod_python), and getModule() or getStructure() raise an
+	@e ImportError with it if the module is asked for.
+
+	\class Registry
+	"""
+
+	__modules = {}
+	__structures = {}
+	__errors = {}
+	__loaded = False
+	__lock = threading.Lock()
+
+	## The modules of @c datamodules which are not data modules.
+	skipModules = ('DataModule', 'RouterDSLEntries', 'action')
+
+	## The structures which are only used as base classes.
+	skipStructures = ('DynamicStructure', 'FlatFileStructure', 'Search',
+	                  'Structure')
+
+	## The number of seconds the last preload() took.
+	preloadTime = 0.0
+
+	def preload(cls, provider=None):
+		r"""
+		Import all of the data modules and structures.
+
+		Calling this again only compiles the schemas for @a provider.
+
+		@param provider The provider string of the env used to compile
+		                the schemas, or @c None not to compile them.
+		"""
+		start = time.time()
+
+		cls.__lock.acquire()
+		try:
+			if not cls.__loaded:
+				import structures.Structure
+				cls.__load('structures', cls.skipStructures,
+				           structures.Structure.Structure,
+				           cls.__structures)
+				cls.__load('datamodules', cls.skipModules, None,
+				           cls.__modules)
+				cls.__loaded = True
+		finally:
+			cls.__lock.release()
+
+		if provider != None:
+			# Compiling the schemas only needs the configuration of
+			# the provider, so the database need not be reachable.
+			import env
+			e = env.env(None, provider, connect=False)
+			try:
+				for name in cls.__structures.keys():
+					cls.__structures[name].getSchema(e)
+			finally:
+				e.close()
+
+		cls.preloadTime = time.time() - start
+	preload = classmethod(preload)
+
+	def getModule(cls, name):
+		r"""
+		Look up a data module.
+
+		@param name The name of the data module, such as
+		            @c CustomerRecord.
+
+		@return The data module class, or @c None if there is none
+		        named @a name.
+
+		@exception ImportError An @e ImportError will be thrown if the
+		                       module of @a name could not be imported.
+		"""
+		return cls.__get(cls.__modules, 'datamodules', name)
+	getModule = classmethod(getModule)
+
+	def getStructure(cls, name):
+		r"""
+		Look up a structure.
+
+		@param name The name of the structure, such as @c Web.
+
+		@return The Structure::Structure subclass, or @c None if there
+		        is none named @a name.
+
+		@exception ImportError An @e ImportError will be thrown if the
+		                       module of @a name could not be imported.
+		"""
+		return cls.__get(cls.__structures, 'structures', name)
+	getStructure = classmethod(getStructure)
+
+	def getStructures(cls):
+		r"""
+		Get all of the structures.
+
+		@return A list of the Structure::Structure subclasses, sorted
+		        by name.
+		"""
+		if not cls.__loaded:
+			cls.preload()
+
+		names = cls.__structures.keys()
+		names.sort()
+		return [cls.__structures[x] for x in names]
+	getStructures = classmethod(getStructures)
+
+	def getStats(cls):
+		r"""
+		Get the registry statistics.
+
+		@return A dictionary with the number of @c modules,
+		        @c structures and import @c errors, and the
+		        @c preloadTime in seconds.
+		"""
+		return {'modules': len(cls.__modules),
+		        'structures': len(cls.__structures),
+		        'errors': len(cls.__errors),
+		        'preloadTime': cls.preloadTime}
+	getStats = classmethod(getStats)
+
+	## protected:
+	def __get(cls, classes, package, name):
+		r"""
+		Look up a class by name.
+
+		@param classes The dictionary to look in.
+		@param package The name of the package.
+		@param name    The name of the class.
+
+		@return The class, or @c None.
+		"""
+		if not cls.__loaded:
+			cls.preload()
+
+		try:
+			return classes[name]
+		except KeyError:
+			pass
+
+		key = package + '.' + name
+		if cls.__errors.has_key(key):
+			raise ImportError, 'Could not import ' + key + ':\n' + \
+			                   cls.__errors[key]
+		return None
+	__get = classmethod(__get)
+
+	def __load(cls, package, skip, baseClass, classes):
+		r"""
+		Import the modules of a package.
+
+		@param package   The name of the package.
+		@param skip      The names of the modules not to import.
+		@param baseClass The class the classes must be subclasses of,
+		                 or @c None.
+		@param classes   The dictionary to add the classes to, keyed
+		                 on their names.
+		"""
+		path = os.path.dirname(__import__(package).__file__)
+		names = {}
+		for filename in os.listdir(path):
+			(name, extension) = os.path.splitext(filename)
+			if extension in ('.py', '.pyc', '.pyo') and \
+			   name != '__init__' and name not in skip:
+				names[name] = True
+
+		for name in names.keys():
+			key = package + '.' + name
+			try:
+				__import__(key)
+			except:
+				cls.__errors[key] = ''.join(traceback.format_exception(
+				                            *sys.exc_info()))
+				sys.stderr.write('Skime could not import ' + key +
+				                 ':\n' + cls.__errors[key])
+				continue
+
+			module = sys.modules[key]
+			if not module.__dict__.has_key(name):
+				continue
+			moduleClass = module.__dict__[name]
+			if not isinstance(moduleClass, (type, types.ClassType)):
+				continue
+			if baseClass == None or issubclass(moduleClass, baseClass):
+				classes[name] = moduleClass
+	__load = classmethod(__load)
+	## public:
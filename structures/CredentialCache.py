@@ -0,0 +1,167 @@
+import random
+import sha
+import threading
+import time
+
+from structures.InternalUser import InternalUser
+from structures.LookupCache import LookupCache
+
+class CredentialCache:
+	r"""
+	Authentication Credential Cache
+
+	Every request authenticates its HTTP Basic credentials by looking up
+	the InternalUser::InternalUser with that username and password. This
+	cache remembers the credentials which were verified, so that later
+	requests with the same credentials are authenticated without a
+	database query.
+
+	The password is not kept. Each entry holds a random salt and the SHA
+	hash of the salt and the password, along with the @c Name of the
+	user. Entries are keyed on the provider string and the username
+	(ignoring case, like the database does).
+
+	An entry expires @c ttl seconds after it is stored. All of the
+	entries are discarded whenever an InternalUser::InternalUser is
+	saved or deleted (which includes changing a password or clearing
+	@c Active), using the generation LookupCache::LookupCache keeps for
+	each structure. Changes made by other processes are only seen once
+	the entry expires.
+
+	@remarks When the cache holds more than @c maxSize entries, the
+	         least recently used quarter of them is discarded.
+
+	The cache is safe to use from several threads at once.
+
+	\class CredentialCache
+	"""
+
+	__entries = {}
+	__lock = threading.Lock()
+
+	# The number of lookups so far, used to order the entries by when
+	# they were last used.
+	__clock = 0
+
+	## The maximum number of entries to keep.
+	maxSize = 500
+
+	## The number of seconds an entry is kept.
+	ttl = 60
+
+	## The number of lookups which found a matching entry.
+	hits = 0
+	## The number of lookups which did not.
+	misses = 0
+
+	def get(cls, provider, username, password):
+		r"""
+		Look up verified credentials.
+
+		@param provider The provider string.
+		@param username The username.
+		@param password The password.
+
+		@return The @c Name of the user, or @c None if the credentials
+		        have not been verified, or have changed or expired
+		        since.
+		"""
+		key = (provider, username.lower())
+		cls.__lock.acquire()
+		try:
+			try:
+				entry = cls.__entries[key]
+			except KeyError:
+				cls.misses += 1
+				return None
+
+			(expires, generation, salt, hash, name, used) = entry
+			if expires < time.time() or \
+			   generation != LookupCache.getGeneration(InternalUser):
+				del cls.__entries[key]
+				cls.misses += 1
+				return None
+
+			if sha.new(salt + password).digest() != hash:
+				cls.misses += 1
+				return None
+
+			cls.__clock += 1
+			cls.__entries[key] = (expires, generation, salt, hash, name,
+			                      cls.__clock)
+			cls.hits += 1
+			return name
+		finally:
+			cls.__lock.release()
+	get = classmethod(get)
+
+	def put(cls, provider, username, password, name):
+		r"""
+		Remember credentials which have been verified.
+
+		@param provider The provider string.
+		@param username The username.
+		@param password The password.
+		@param name     The @c Name of the user.
+		"""
+		salt = ''.join([chr(random.randrange(256)) for i in range(8)])
+		hash = sha.new(salt + password).digest()
+
+		cls.__lock.acquire()
+		try:
+			if len(cls.__entries) >= cls.maxSize:
+				cls.__evict()
+			cls.__clock += 1
+			cls.__entries[(provider, username.lower())] = (
+			  time.time() + cls.ttl,
+			  LookupCache.getGeneration(InternalUser), salt, hash, name,
+			  cls.__clock)
+		finally:
+			cls.__lock.release()
+	put = classmethod(put)
+
+	def getStats(cls):
+		r"""
+		Get the cache statistics.
+
+		@return A dictionary with the @c hits, @c misses, @c size and
+		        @c hitRate (the fraction of lookups which were hits)
+		        of the cache.
+		"""
+		lookups = cls.hits + cls.misses
+		if lookups > 0:
+			hitRate = float(cls.hits) / lookups
+		else:
+			hitRate = 0.0
+		return {'hits': cls.hits,
+		        'misses': cls.misses,
+		        'size': len(cls.__entries),
+		        'hitRate': hitRate}
+	getStats = classmethod(getStats)
+
+	def flush(cls):
+		r"""
+		Discard all entries and reset the counters.
+		"""
+		cls.__lock.acquire()
+		try:
+			cls.__entries.clear()
+			cls.hits = 0
+			cls.misses = 0
+		finally:
+			cls.__lock.release()
+	flush = classmethod(flush)
+
+	## protected:
+	def __evict(cls):
+		r"""
+		Discard the least recently used quarter of the entries.
+
+		@pre The caller must hold the cache's lock.
+		"""
+		order = [(entry[5], key) for (key, entry) in cls.__entries.items()]
+		order.sort()
+		for (used, key) in order[:max(1, len(order) / 4)]:
+			del cls.__entries[key]
+	__evict = classmethod(__evict)
+	## public:
@@ -284,7 +284,7 @@ class DSLAccount(Structure):
 			                             arrangement, index)
 
 		for field in self.fieldOrder:
-			self.allFields[field].customFormView = False
+			self.setCustomFormView(field, False)
 
 		out = []
 
@@ -359,7 +359,7 @@ class DSLAccount(Structure):
 		for field in self.fieldOrder:
 			if self.allFields[
 			     field].arrangements.count('form') > 0 \
-			   and not self.allFields[field].customFormView:
+			   and not self.hasCustomFormView(field):
 				out.append(self.getSingleItemRow(field, env,
 				  editable, arrangement, index,
 				  autoSetCustomProperty=0))
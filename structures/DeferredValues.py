@@ -0,0 +1,56 @@
+class DeferredValues(dict):
+	r"""
+	Record Values with Deferred Fields
+
+	This class stores the values of a record loaded from the database
+	without some of its fields, typically large @c text, @c ntext and
+	@c image columns. The deferred fields are reported as present, but
+	their values are only fetched the first time one of them is read.
+	The @c loader is shared by the records loaded together, so a single
+	query fetches the deferred fields of all of them.
+
+	Reading a value which is not deferred costs one extra attribute
+	test. Once the deferred fields are loaded, @c loader is @c None.
+
+	copy() returns only the values which have been loaded. This is what
+	Structure::Structure::dbMarkSaved() and
+	Structure::Structure::dbGetChangedFields() need, since a deferred
+	field which has not been read cannot have been changed.
+	"""
+
+	__slots__ = ('deferred', 'loader')
+
+	def __init__(self, deferred, loader=None):
+		r"""
+		@param deferred A dictionary whose keys are the names of the
+		                deferred fields.
+		@param loader   A function, taking no arguments, which loads
+		                the deferred fields, or @c None.
+		"""
+		dict.__init__(self)
+		self.deferred = deferred
+		self.loader = loader
+
+	def __getitem__(self, key):
+		if self.loader != None and self.deferred.has_key(key) and \
+		   not dict.has_key(self, key):
+			self.loader()
+		return dict.__getitem__(self, key)
+
+	def has_key(self, key):
+		if self.loader != None and self.deferred.has_key(key):
+			return True
+		return dict.has_key(self, key)
+
+	__contains__ = has_key
+
+	def get(self, key, default=None):
+		if self.has_key(key):
+			return self[key]
+		return default
+
+	def copy(self):
+		r"""
+		@return The loaded values as a new dictionary.
+		"""
+		return dict(self)
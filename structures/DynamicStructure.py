@@ -1,3 +1,5 @@
+import time
+
 from Structure import *
 
 class DynamicStructure(Structure):
@@ -22,7 +24,8 @@ class DynamicStructure(Structure):
 		     groupTitle,
 	             defaultFieldArrangement='list',
 		     dbLinkedServerName=None,
-     		     dbPropertyTable=None):
+     		     dbPropertyTable=None,
+		     dbWideTable=None):
 		r"""
 		DynamicStructure Constructor
 
@@ -52,6 +55,12 @@ class DynamicStructure(Structure):
 		                               is equivalent to setting it to
 		                               the value of @a dbTable with
 		                               @c Properties appended.
+		@param dbWideTable             The title of the database table
+		                               which holds a materialized copy
+		                               of the dynamic columns, one
+		                               column per property, or @c None
+		                               if there is none. See
+		                               dbHasWideTable().
 
 		@pre @a dbTable must not be @c None or the empty string.
 		@pre @a formPrefix must not be @c None or the empty string.
@@ -95,12 +104,83 @@ class DynamicStructure(Structure):
 		else:
 			self.dbPropertyTable = str(self.dbTable) + 'Properties'
 		
+		self.dbWideTable = dbWideTable
+
 		self.propertyNameColumn  = 'PropertyName'
 		self.propertyValueColumn = 'PropertyValue'
 	## public:
 
+	# How dbLoad() gathers the dynamic properties of each record:
+	#  - 'join' joins the property table once per dynamic property.
+	#  - 'pivot' reads the property table once, turning the property
+	#    rows of each record into columns with conditional aggregation.
+	#    Its cost grows much more slowly with the number of properties.
+	# Subclasses set this as a class variable, since the statements are
+	# cached per structure. A structure whose wide table exists reads
+	# from it instead. (See dbHasWideTable().)
+	dbLoadStrategy = 'join'
+
+	# The number of seconds dbHasWideTable() trusts the answer of the
+	# database, so a wide table created or dropped later is noticed.
+	dbWideTableTTL = 300
+
+	## protected:
+	# Whether the wide table of each structure exists and when the
+	# database was asked, keyed on the schema key.
+	__wideTables = {}
+	## public:
+
+	def dbTriggers(self, env):
+		r"""
+		Generate database triggers.
+
+		If the structure has a @c dbWideTable, this method generates a
+		trigger on the property table which refreshes the wide table
+		rows of the records whose property rows are inserted, updated
+		or deleted. (See dbHasWideTable().)
+
+		@param env An instance of the @em env class which keeps track
+		                   of the current operational environment.
+		"""
+		out = []
+
+		if self.dbWideTable:
+			PK = [self.allFields[x].dbName for x in self.findPK()]
+			# The property rows of the records which changed.
+			changed = ' OR '.join(['EXISTS(SELECT * FROM [%s] WHERE %s)' %
+			  (x, ' AND '.join(['[%s].[%s] = "%s"."%s"' %
+			                    (x, y, self.dbPropertyTable, y)
+			                    for y in PK]))
+			  for x in ('INSERTED', 'DELETED')])
+
+			out.append("""
+CREATE TRIGGER [tri_iud_%(dbWideTable)s]
+ON [%(dbPropertyTable)s]
+FOR INSERT, UPDATE, DELETE
+AS
+
+DELETE [%(dbWideTable)s]
+  FROM [%(dbWideTable)s]
+ WHERE EXISTS(SELECT * FROM [INSERTED] WHERE %(insertedPK)s)
+    OR EXISTS(SELECT * FROM [DELETED] WHERE %(deletedPK)s)
+
+%(insert)s
+
+GO
+""" % { \
+	'dbWideTable': self.dbWideTable, \
+	'dbPropertyTable': self.dbPropertyTable, \
+	'insertedPK': ' AND '.join(['[INSERTED].[%s] = [%s].[%s]' %
+	                            (x, self.dbWideTable, x) for x in PK]), \
+	'deletedPK': ' AND '.join(['[DELETED].[%s] = [%s].[%s]' %
+	                           (x, self.dbWideTable, x) for x in PK]), \
+	'insert': self.dbGenerateWideTableInsert(env, changed)})
+
+		return ''.join(out)
+
 	def dbLoad(cls, env, con, query=None, where=None,
-	           orderBy=None, reverseSort=False, max=None):
+	           orderBy=None, reverseSort=False, max=None, lean=False,
+	           arraysize=None):
 		r"""
 		Generate records from @a con based on @a query dictionary
 		and/or @a where condition.
@@ -127,11 +207,17 @@ class DynamicStructure(Structure):
 		                   other words, it will be in descending order.
 		                   This is accomplished by using @c DESC in the
 		                   SQL query.
-		@param max         The maximum number of records to match. This
-		                   value will only be honored if using a DB-API
-		                   driver supports the @c rowcount attribute.
-		                   DB-API 1.0 drivers do not support the
-		                   @c rowcount attribute.
+		@param max         The maximum number of records to match. Only
+		                   @a max + 1 rows are requested from the
+		                   database, which is enough to tell if there
+		                   are more than @a max.
+		@param lean        If @c True, the records' values are kept in
+		                   a compact, tuple-backed LeanValues::LeanValues
+		                   instead of a dictionary. This saves memory on
+		                   large result sets.
+		@param arraysize   The number of rows to fetch from the driver
+		                   at a time. If @a arraysize is @c None, the
+		                   structure's @c dbFetchSize is used.
 
 		@return Generates instances of the class on which this method
 		        was called. Each instance will contain the data from
@@ -143,8 +229,7 @@ class DynamicStructure(Structure):
 		     zero.
 
 		@exception RuntimeError A @e RuntimeError will be thrown if
-		                        the number of records matched is known
-		                        and is greater than @a max.
+		                        more than @a max records are matched.
 
 		@todo Decide if @a con should be eliminated in favor of using
 		      @c con from @a env. If so, implement this functionality.
@@ -155,45 +240,498 @@ class DynamicStructure(Structure):
 		except ValueError:
 			assert 0, 'max must be None or convertable to an int.'
 
-		instance = cls(env)
+		schema = cls.getSchema(env)
+		queryKeys = cls.dbGetQueryKeys(env, query)
 
-		assert instance.findPK() != [], \
-		  'A primary key is required for DynamicStructures.'
+		if orderBy != None:
+			orderBy = tuple(orderBy)
+
+		if max != None:
+			max = int(max)
+			top = max + 1
+		else:
+			top = None
+
+		# The strategy is worked out once, on con, so the statement is
+		# generated for the strategy of its cache key.
+		strategy = cls.dbGetLoadStrategy(env, con)
+
+		key = ('load', schema.key, env.dbDialect, where, queryKeys,
+		       orderBy, bool(reverseSort), top, strategy)
+		statement = StatementCache.get(key)
+		if statement == None:
+			statement = StatementCache.put(key,
+			  cls.dbGenerateLoadQuery(env, queryKeys, where, orderBy,
+			                          reverseSort, top,
+			                          strategy=strategy))
+		(sql, plan) = statement
+
+		cur = con.cursor()
+		cls.dbExecute(env, cur, sql, [query[x] for x in plan])
+
+		for rec in cls.dbFetch(env, cur, max, arraysize, lean):
+			yield rec
+
+	dbLoad = classmethod(dbLoad)
+
+	def dbLoadPage(cls, env, con, query=None, where=None,
+	               orderBy=None, reverseSort=False, pageSize=None,
+	               pageToken=None, lean=False, fields=None,
+	               deferred=None):
+		r"""
+		Load one page of records from @a con.
+
+		This is Structure::Structure::dbLoadPage() over the query of
+		dbLoad(). Sort fields which are dynamic properties are sought
+		past by their converted values, as they are sorted.
+
+		@param env         An instance of the @em env class which keeps
+		                   track of the current operational
+		                   environment.
+		@param con         A DB-API connection to use to execute the
+		                   SQL query.
+		@param query       See dbLoad().
+		@param where       See dbLoad().
+		@param orderBy     See dbLoad().
+		@param reverseSort See dbLoad().
+		@param pageSize    See Structure::Structure::dbLoadPage().
+		@param pageToken   See Structure::Structure::dbLoadPage().
+		@param lean        See dbLoad().
+		@param fields      Ignored. All fields are loaded.
+		@param deferred    Ignored. No fields are deferred.
+
+		@return See Structure::Structure::dbLoadPage().
+
+		@pre @a pageSize must be either @c None or an integer greater
+		     than zero.
+
+		@exception ValueError A @e ValueError will be thrown if
+		                      @a pageToken is not a valid page token.
+
+		@remarks Rows whose sort fields are @c NULL cannot be sought
+		         past. The sort fields should not allow @c NULL, which
+		         rules out dynamic properties a record may not have.
+		"""
+		if pageSize == None:
+			pageSize = cls.dbPageSize
+		try:
+			assert int(pageSize) > 0, \
+			       'pageSize must be greater than zero.'
+		except ValueError:
+			assert 0, 'pageSize must be None or convertable to an int.'
+		pageSize = int(pageSize)
+
+		schema = cls.getSchema(env)
+		instance = schema.recordClass(env)
+
+		queryKeys = cls.dbGetQueryKeys(env, query)
+
+		sortKeys = []
+		if orderBy != None:
+			sortKeys.extend(orderBy)
+		sortKeys.extend([x for x in instance.findPK()
+		                 if x not in sortKeys])
+		sortKeys = tuple(sortKeys)
+
+		seekValues = None
+		if pageToken != None:
+			seekValues = cls.dbDecodePageToken(pageToken)
+			if len(seekValues) != len(sortKeys):
+				raise ValueError, \
+				      'The page token does not match the sort order.'
+
+		strategy = cls.dbGetLoadStrategy(env, con)
+
+		key = ('page', schema.key, env.dbDialect, where, queryKeys,
+		       sortKeys, bool(reverseSort), pageSize + 1,
+		       seekValues != None, strategy)
+		statement = StatementCache.get(key)
+		if statement == None:
+			statement = StatementCache.put(key,
+			  cls.dbGenerateLoadQuery(env, queryKeys, where, sortKeys,
+			                          reverseSort, pageSize + 1,
+			                          seekValues != None, strategy))
+		(sql, plan) = statement
+
+		args = []
+		for x in plan:
+			if type(x) == type(0):
+				args.append(seekValues[x])
+			else:
+				args.append(query[x])
+
+		cur = con.cursor()
+		cls.dbExecute(env, cur, sql, args)
+		records = list(cls.dbFetch(env, cur, None, pageSize + 1, lean))
+
+		nextPageToken = None
+		if len(records) > pageSize:
+			del records[pageSize:]
+			nextPageToken = cls.dbEncodePageToken(
+			  [records[-1].values[x] for x in sortKeys])
+
+		return (records, nextPageToken)
+	dbLoadPage = classmethod(dbLoadPage)
+
+	def dbHasWideTable(cls, env, con=None):
+		r"""
+		Check if the structure's wide table exists.
+
+		A wide table holds the dynamic properties of the records of a
+		structure with a @c dbWideTable, converted to their fields'
+		@c dbType, in a column per property. It is created by
+		install.py and kept up to date by the triggers of dbTriggers().
+		dbLoad() reads the properties from it when it exists, so that
+		they are neither reassembled from the property rows nor
+		converted, and can be matched with the wide table's indexes.
+
+		The answer of the database is kept for @c dbWideTableTTL
+		seconds per structure and provider configuration.
+
+		@param env An instance of the @em env class which keeps track
+		           of the current operational environment.
+		@param con A DB-API connection to use to ask the database. If
+		           @a con is @c None, @c con from @a env is used.
+
+		@return @c True if the structure has a wide table and it
+		        exists. Otherwise, @c False.
+		"""
+		schema = cls.getSchema(env)
+		try:
+			(exists, checked) = cls.__wideTables[schema.key]
+			if time.time() - checked < cls.dbWideTableTTL:
+				return exists
+		except KeyError:
+			pass
+
+		instance = cls.newRecord(env)
+		exists = False
+		if instance.dbWideTable:
+			if con == None:
+				con = env.con
+			sql = SQLDialect.get(env.dbDialect).generateTableExists()
+			cur = con.cursor()
+			cls.dbExecute(env, cur, sql, [instance.dbWideTable])
+			row = cur.fetchone()
+			cur.close()
+			exists = row != None and row[0] != None
+
+		cls.__wideTables[schema.key] = (exists, time.time())
+		return exists
+	dbHasWideTable = classmethod(dbHasWideTable)
+
+	def dbSaveMany(cls, env, records, batchSize=None):
+		r"""
+		Save many records to the database in one transaction.
+
+		The changed fields of the structure's table of existing records
+		are saved as by Structure::Structure::dbSaveMany(). Their
+		property rows are then written with a statement per operation
+		(see dbGetPropertyChanges()), each executed for up to
+		@a batchSize rows at a time through the driver's
+		@c executemany(): the removed rows are deleted, the changed
+		rows updated and the added rows inserted. The rows of an
+		existing record which was not loaded from the database are
+		replaced.
+
+		New records are saved with their own dbGenerateSaveQuery() in
+		the same transaction, since the primary key of their property
+		rows is not known until their row is inserted.
+
+		If any statement fails, the transaction is rolled back and the
+		exception is raised again.
+
+		@param env       An instance of the @em env class which keeps
+		                 track of the current operational environment.
+		@param records   An iterable of records to save.
+		@param batchSize The number of rows to save per statement. If
+		                 @a batchSize is @c None, the structure's
+		                 @c dbSaveBatchSize is used.
+
+		@pre @a batchSize must be either @c None or an integer greater
+		     than zero.
+		"""
+		if batchSize == None:
+			batchSize = cls.dbSaveBatchSize
+		try:
+			assert int(batchSize) > 0, \
+			       'batchSize must be greater than zero.'
+		except ValueError:
+			assert 0, 'batchSize must be None or convertable to an int.'
+		batchSize = int(batchSize)
+
+		# The statements and the arguments of each of their rows, keyed
+		# on the statement cache key.
+		groups = {}
+		# The keys of the statements which save the rows of the table,
+		# then those which reset, remove, update and add property rows.
+		phases = ([], [], [], [], [])
+		inserts = []
+		saved = []
+
+		def getGroup(phase, key, generate):
+			if not groups.has_key(key):
+				statement = StatementCache.get(key)
+				if statement == None:
+					statement = StatementCache.put(key, generate())
+				groups[key] = (statement[0], [])
+				phases[phase].append(key)
+			return groups[key][1]
+
+		for record in records:
+			if not record.dbIsModified():
+				continue
+			saved.append(record)
+
+			(key, columns, PK) = record.dbGetSaveShape(env)
+			if len(PK) == 0:
+				inserts.append(record)
+				continue
+
+			if len(columns) > 0:
+				(sql, plan) = record.dbGetSaveTemplate(env, key, columns,
+				                                       PK)
+				getGroup(0, key, lambda: (sql, plan)).append(
+				  record.dbGetSaveArgs(columns, plan))
+
+			whereArgs = [record.dbGetKeyValue(x) for (x, isNull) in PK
+			             if not isNull]
+			(removed, updated, added) = record.dbGetPropertyChanges()
+
+			if record.loadedValues == None:
+				operations = [(1, 'reset', None)]
+			else:
+				operations = [(2, 'remove', x) for x in removed + added]
+			operations.extend([(3, 'update', x) for x in updated])
+			operations.extend([(4, 'add', x) for x in added])
+
+			for (phase, operation, field) in operations:
+				args = []
+				if operation in ('update', 'add'):
+					args.extend(record.dbGetSaveArgs([field], []))
+				if operation == 'add':
+					args.extend(record.dbGetPropertyKeyArgs())
+					key = ('property', record.getSchema(env).key,
+					       operation)
+				else:
+					args.extend(whereArgs)
+					key = ('property', record.getSchema(env).key,
+					       operation, PK)
+				if operation != 'reset':
+					args.append(record.allFields[field].dbName)
+
+				getGroup(phase, key,
+				  lambda: (record.dbGeneratePropertyTemplate(operation,
+				                                             PK),
+				           None)).append(args)
+
+		cur = env.con.cursor()
+		try:
+			for record in inserts:
+				(sql, args) = record.dbGenerateSaveQuery(env)
+				util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
+
+			for keys in phases:
+				for key in keys:
+					(sql, rows) = groups[key]
+					for i in xrange(0, len(rows), batchSize):
+						util.CursorWrapper.CursorWrapper.executemany(
+						  cur, sql, rows[i:i + batchSize])
+		except:
+			if hasattr(env.con, 'rollback'):
+				env.con.rollback()
+			cur.close()
+			raise
+
+		cur.close()
+		env.con.commit()
+
+		classes = {}
+		for record in saved:
+			record.dbMarkSaved()
+			classes[record.__class__] = True
+
+		for x in classes:
+			LookupCache.invalidate(x)
+	dbSaveMany = classmethod(dbSaveMany)
+
+	## protected:
+	def dbGetLoadStrategy(cls, env, con=None):
+		r"""
+		Get how dbLoad() gathers the dynamic properties.
+
+		@param env An instance of the @em env class which keeps track
+		           of the current operational environment.
+		@param con See dbHasWideTable().
+
+		@return @c 'wide' if the structure's wide table exists.
+		        Otherwise, the @c dbLoadStrategy.
+		"""
+		if cls.dbHasWideTable(env, con):
+			return 'wide'
+		return cls.dbLoadStrategy
+	dbGetLoadStrategy = classmethod(dbGetLoadStrategy)
+
+	def dbLoadRecord(self, row):
+		r"""
+		Load fields from a database row.
+
+		This method takes a database @a row and loads the fields into
+		the @c values variable.
+
+		@param row The database row as a tuple of fields.
+		"""
+		for x, y in zip(self.fields, row):
+
+			# Strip Strings
+			if type(y) == type(''):
+				y = y.strip()
+
+				# Truncate Strings w/ a maxlength Property
+				if self.allFields[x].maxlength:
+					y = y[:self.allFields[x].maxlength]
+
+			# Store the Value
+			self.values[x] = y
+
+		self.dbMarkSaved()
+
+	def dbGenerateWhere(cls, env, queryKeys=None, where=None,
+	                    strategy=None):
+		r"""
+		Generate the conditions of a @c WHERE clause.
+
+		Dynamic properties are matched against the value column of
+		their joined property row, or against their column of the
+		pivoted property rows or of the wide table. (See
+		dbGetLoadStrategy().)
+
+		@param env       An instance of the @em env class which keeps
+		                 track of the current operational environment.
+		@param queryKeys A sequence of the fields to match for
+		                 equality, or @c None.
+		@param where     A @c WHERE clause to apply first, or @c None.
+		@param strategy  The strategy from dbGetLoadStrategy() to
+		                 generate the conditions for, or @c None to
+		                 ask dbGetLoadStrategy() with @c con from
+		                 @a env.
+
+		@return See Structure::Structure::dbGenerateWhere().
+		"""
+		instance = cls.newRecord(env)
 
 		properties = [x for x in instance.fields if instance.allFields[x].dbDynamicProperty == True]
+		if strategy == None:
+			strategy = cls.dbGetLoadStrategy(env)
 
 		if where == None:
 			where = []
 		else:
-			where = [where]
-
-		args  = []
-		if query != None:
-			for key in query:
-				if instance.allFields.has_key(key) and \
-				   instance.allFields[key].present:
-					if where != []:
-						where.append(' AND ')
-					where.append('"')
-					if instance.allFields[key].dbDynamicProperty == False:
-						where.append(instance.allFields[key].dbName)
-					else:
-						where.append('p')
-						where.append(str(properties.index(key) + 1))
-						where.append('"."')
-						where.append(instance.propertyValueColumn)
-					where.append('"=?')
-					args.append(query[key])
-			assert len(args) > 0, \
-			       'No valid fields were present in query.' + \
-			       str(query) + ' ' + str(instance.allFields.has_key(key)) + ' ' + \
-			       str(instance.allFields)
+			where = ['(', where, ')']
+
+		plan = []
+		if queryKeys != None:
+			for key in queryKeys:
+				if where != []:
+					where.append(' AND ')
+				where.append('"')
+				if instance.allFields[key].dbDynamicProperty == False:
+					where.append(instance.dbTable)
+					where.append('"."')
+					where.append(instance.allFields[key].dbName)
+				elif strategy != 'join':
+					where.append('p"."')
+					where.append(instance.allFields[key].dbName)
+				else:
+					where.append('p')
+					where.append(str(properties.index(key) + 1))
+					where.append('"."')
+					where.append(instance.propertyValueColumn)
+				where.append('"=?')
+				plan.append(key)
+
+		return (where, plan)
+	dbGenerateWhere = classmethod(dbGenerateWhere)
+
+	def dbGenerateLoadQuery(cls, env, queryKeys=None, where=None,
+	                        orderBy=None, reverseSort=False, top=None,
+	                        seek=False, strategy=None):
+		r"""
+		Generate the @c SELECT statement template used by dbLoad().
+
+		Each dynamic property is joined in from the property table, or
+		taken from the pivoted property rows (see dbGeneratePivotQuery()),
+		and converted to its field's @c dbType, or taken from the wide
+		table. (See dbGetLoadStrategy().)
+
+		The @c 'join' strategy only matches records with at least one
+		property row. The others also match records without any, whose
+		dynamic properties are then @c NULL.
+
+		@param env         An instance of the @em env class which keeps
+		                   track of the current operational
+		                   environment.
+		@param queryKeys   A sequence of the fields to match, or
+		                   @c None.
+		@param where       A @c WHERE clause to apply to the query.
+		@param orderBy     A sequence of fields to sort by.
+		@param reverseSort If @c True, the sort will be in descending
+		                   order.
+		@param top         The maximum number of rows to return, or
+		                   @c None.
+		@param seek        If @c True, only rows which sort after a
+		                   given row are matched. The values of the
+		                   given row's @a orderBy fields are arguments.
+		@param strategy    See dbGenerateWhere().
+
+		@return See Structure::Structure::dbGenerateLoadQuery().
+		"""
+		instance = cls.newRecord(env)
+
+		assert instance.findPK() != [], \
+		  'A primary key is required for DynamicStructures.'
+
+		properties = [x for x in instance.fields if instance.allFields[x].dbDynamicProperty == True]
+
+		if strategy == None:
+			strategy = cls.dbGetLoadStrategy(env)
+
+		(where, plan) = cls.dbGenerateWhere(env, queryKeys, where,
+		                                    strategy)
+
+		(topSql, limitSql) = cls.dbGenerateLimit(env, top)
+
+		pivot = strategy != 'join' and len(properties) > 0
+
+		if seek:
+			# The sort fields as they are selected.
+			columns = []
+			for x in orderBy:
+				field = instance.allFields[x]
+				if field.dbDynamicProperty == False:
+					columns.append('"' + instance.dbTable + '"."' +
+					               field.dbName + '"')
+					continue
+				if pivot:
+					column = '"p"."' + field.dbName + '"'
+				else:
+					column = '"p' + str(properties.index(x) + 1) + \
+					         '"."' + instance.propertyValueColumn + '"'
+				if strategy != 'wide':
+					column = cls.dbGenerateConvert(env, field, column)
+				columns.append(column)
+
+			if where != []:
+				where.append(' AND ')
+			where.append(cls.dbGenerateSeek(reverseSort, columns))
+			plan.extend(cls.dbGenerateSeekPlan(len(orderBy)))
 
 		sql = []
 
 		sql.append('SELECT ')
-		if len(properties) > 0:
+		if len(properties) > 0 and not pivot:
 			sql.append('DISTINCT ')
+		sql.append(topSql)
 		sql.append('"')
 		sql.append(instance.dbTable)
 		sql.append('"."')
@@ -202,20 +740,19 @@ class DynamicStructure(Structure):
 
 		index = 1
 		for property in properties:
-			sql.append(', CONVERT(')
-			sql.append(instance.allFields[property].dbType)
-			if instance.allFields[property].dbType == 'char' or \
-			   instance.allFields[property].dbType == 'nchar' or \
-			   instance.allFields[property].dbType == 'varchar' or \
-			   instance.allFields[property].dbType == 'nvarchar':
-				sql.append('(')
-				sql.append(str(instance.allFields[property].maxlength))
-				sql.append(')')
-			sql.append(', "p')
-			sql.append(str(index))
-			sql.append('"."')
-			sql.append(instance.propertyValueColumn)
-			sql.append('") AS "')
+			if pivot:
+				column = '"p"."' + instance.allFields[property].dbName + \
+				         '"'
+			else:
+				column = '"p' + str(index) + '"."' + \
+				         instance.propertyValueColumn + '"'
+			sql.append(', ')
+			if strategy == 'wide':
+				sql.append(column)
+			else:
+				sql.append(cls.dbGenerateConvert(env,
+				           instance.allFields[property], column))
+			sql.append(' AS "')
 			sql.append(instance.allFields[property].dbName)
 			sql.append('"')
 			index += 1
@@ -224,7 +761,21 @@ class DynamicStructure(Structure):
 		sql.append(instance.dbTable)
 		sql.append('"')
 
-		if len(properties) > 0:
+		if pivot:
+			if strategy == 'wide':
+				sql.append(' LEFT JOIN "')
+				sql.append(instance.dbWideTable)
+				sql.append('" "p" ON ')
+			else:
+				sql.append(' LEFT JOIN (')
+				sql.append(cls.dbGeneratePivotQuery(env))
+				sql.append(') "p" ON ')
+			sql.append(' AND '.join(['"' + instance.dbTable + '"."' +
+			  instance.allFields[x].dbName + '" = "p"."' +
+			  instance.allFields[x].dbName + '"'
+			  for x in instance.findPK()]))
+
+		if len(properties) > 0 and not pivot:
 			sql.append(',"')
 			sql.append(instance.dbPropertyTable)
 			sql.append('" "p0"')
@@ -281,12 +832,10 @@ class DynamicStructure(Structure):
 				sql.append(' AND (')
 				sql.extend(where)
 				sql.append(')')
-				where = None
 		else:
 			if len(where) > 0:
 				sql.append(' WHERE ')
 				sql.extend(where)
-				where = None
 
 		if orderBy != None and len(orderBy) > 0:
 			sql.append(' ORDER BY ')
@@ -300,63 +849,150 @@ class DynamicStructure(Structure):
 					sql.append('"."')
 				sql.append(instance.allFields[x].dbName)
 				sql.append('"')
+				if reverseSort:
+					sql.append(' DESC')
 				orderByIndex += 1
-			if reverseSort:
-				sql.append(' DESC')
 
-		cur = con.cursor()
-		util.CursorWrapper.CursorWrapper.execute(cur, ''.join(sql), args)
-		sql = None
-		args = None
+		sql.append(limitSql)
 
-		# XXX: This is a work-around for DBAPI 1.0 compatibility.
-		try:
-			rowcount = cur.rowcount
-			if (max != None and rowcount > max):
-				raise RuntimeError, 'A maximum ' + str(max) + \
-				      ' rows were requested but ' + \
-				      str(rowcount) + ' were found.'
-		except AttributeError:
-			pass
+		return (''.join(sql), plan)
+	dbGenerateLoadQuery = classmethod(dbGenerateLoadQuery)
 
-		while 1:
-			try:
-				row = cur.fetchone()
-			except:
-				break
-			if row != None:
-				rec = cls(env)
-				rec.dbLoadRecord(row)
-				yield rec
-			else:
-				break
+	def dbGeneratePivotQuery(cls, env, where=None):
+		r"""
+		Generate the query which turns the property rows into columns.
 
-		cur.close()
+		The rows of the structure's properties are read from the
+		property table once and grouped by the primary key. Each
+		dynamic property becomes a column, named after its field's
+		@c dbName, of the unconverted value of its property row, using
+		@c MAX(CASE ...) to pick that row out of the group.
 
-	dbLoad = classmethod(dbLoad)
+		@param env   An instance of the @em env class which keeps track
+		             of the current operational environment.
+		@param where A condition the property rows must also meet, or
+		             @c None.
 
-	## protected:
-	def dbLoadRecord(self, row):
+		@return The SQL query. It has no arguments.
+		"""
+		instance = cls.newRecord(env)
+
+		PK = [instance.allFields[x].dbName for x in instance.findPK()]
+		properties = [instance.allFields[x].dbName for x in instance.fields
+		              if instance.allFields[x].dbDynamicProperty == True]
+
+		sql = []
+		sql.append('SELECT "')
+		sql.append('","'.join(PK))
+		sql.append('"')
+		for name in properties:
+			sql.append(', MAX(CASE WHEN "')
+			sql.append(instance.propertyNameColumn)
+			sql.append('" = \'')
+			sql.append(name)
+			sql.append('\' THEN "')
+			sql.append(instance.propertyValueColumn)
+			sql.append('" END) AS "')
+			sql.append(name)
+			sql.append('"')
+		sql.append(' FROM "')
+		sql.append(instance.dbPropertyTable)
+		sql.append('" WHERE "')
+		sql.append(instance.propertyNameColumn)
+		sql.append('" IN (\'')
+		sql.append('\',\''.join(properties))
+		sql.append('\')')
+		if where != None:
+			sql.append(' AND (')
+			sql.append(where)
+			sql.append(')')
+		sql.append(' GROUP BY "')
+		sql.append('","'.join(PK))
+		sql.append('"')
+
+		return ''.join(sql)
+	dbGeneratePivotQuery = classmethod(dbGeneratePivotQuery)
+
+	def dbGenerateWideTableInsert(cls, env, where=None):
 		r"""
-		Load fields from a database row.
+		Generate the statement which fills the wide table.
 
-		This method takes a database @a row and loads the fields into
-		the @c values variable.
+		The property rows are pivoted with dbGeneratePivotQuery() and
+		converted to their fields' @c dbType. A record without any
+		property rows gets no row in the wide table.
 
-		@param row The database row as a tuple of fields.
+		@param env   An instance of the @em env class which keeps track
+		             of the current operational environment.
+		@param where A condition the property rows of the records to
+		             insert must meet, or @c None to insert every
+		             record.
+
+		@return The SQL statement. It has no arguments.
+
+		@pre The structure must have a @c dbWideTable.
 		"""
-		for x, y in zip(self.fields, row):
+		instance = cls.newRecord(env)
 
-			# Strip Strings
-			if type(y) == type(''):
-				y = y.strip()
+		PK = [instance.allFields[x].dbName for x in instance.findPK()]
+		properties = [instance.allFields[x] for x in instance.fields
+		              if instance.allFields[x].dbDynamicProperty == True]
 
-				# Truncate Strings w/ a maxlength Property
-				if self.allFields[x].maxlength:
-					y = y[:self.allFields[x].maxlength]
+		sql = []
+		sql.append('INSERT INTO "')
+		sql.append(instance.dbWideTable)
+		sql.append('" ("')
+		sql.append('","'.join(PK + [x.dbName for x in properties]))
+		sql.append('") SELECT "p"."')
+		sql.append('","p"."'.join(PK))
+		sql.append('"')
+		for field in properties:
+			sql.append(', ')
+			sql.append(cls.dbGenerateConvert(env, field,
+			           '"p"."' + field.dbName + '"'))
+		sql.append(' FROM (')
+		sql.append(cls.dbGeneratePivotQuery(env, where))
+		sql.append(') "p"')
+
+		return ''.join(sql)
+	dbGenerateWideTableInsert = classmethod(dbGenerateWideTableInsert)
+
+	def dbGenerateConvert(env, field, expression):
+		r"""
+		Generate the SQL which converts a property value to the type
+		of its field.
 
-			# Store the Value
-			self.values[x] = y
+		SQL Server uses @c CONVERT. Other databases may differ. (See
+		util::SQLDialect::SQLDialect.)
+
+		@param env        An instance of the @em env class which keeps
+		                  track of the current operational environment.
+		@param field      The fp::fp of the field.
+		@param expression The SQL expression of the property value.
+
+		@return The SQL expression of the converted value.
+		"""
+		dbType = field.dbType
+		if dbType in ('char', 'nchar', 'varchar', 'nvarchar'):
+			dbType = dbType + '(' + str(field.maxlength) + ')'
+
+		return SQLDialect.get(env.dbDialect).generateConvert(dbType,
+		                                                     expression)
+	dbGenerateConvert = staticmethod(dbGenerateConvert)
+
+	def dbGenerateCountQuery(cls, env, queryKeys=None, where=None,
+	                         exists=False):
+		r"""
+		Generate the statement template used by dbCount() and
+		dbExists().
+
+		The rows of the dbLoad() query are counted, since a record is
+		made of a row of the table and its joined property rows.
+
+		@return See Structure::Structure::dbGenerateCountQuery().
+		"""
+		return cls.dbGenerateCountOf(env,
+		  cls.dbGenerateLoadQuery(env, queryKeys, where), exists)
+	dbGenerateCountQuery = classmethod(dbGenerateCountQuery)
 
 	def dbGenerateSaveQuery(self, env):
 		r"""
@@ -367,6 +1003,12 @@ class DynamicStructure(Structure):
 		an @c UPDATE query should be generated. Otherwise, an
 		@c INSERT query is generated.
 
+		If the record was loaded from the database, the @c UPDATE only
+		sets the changed fields of the structure's table and only
+		writes the property rows which differ from the loaded values
+		(see dbGetPropertyChanges()). Otherwise, the property rows are
+		replaced.
+
 		@param env An instance of the @em env class which keeps track
 		           of the current operational environment.
 
@@ -388,8 +1030,7 @@ class DynamicStructure(Structure):
 		where = []
 		whereArgs = []
 
-		PK = self.findPK()
-		PK2 = list(PK)
+		PK2 = self.findPK()
 
 		dbIdentityFound = False
 		for key in PK2:
@@ -398,19 +1039,7 @@ class DynamicStructure(Structure):
 				  'Only one IDENTITY column per table is allowed.'
 				dbIdentityFound = True
 
-			if (not self.values.has_key(key)) or \
-		           (self.allFields[key].dbIdentity and \
-		            self.values[key] == None \
-		           ) or \
-		           (self.values[key] != None and \
-			    (self.allFields[key].dbType == 'datetime' or \
-		             self.allFields[key].dbType == 'image' or \
-		             self.allFields[key].dbType == 'ntext' or \
-		             self.allFields[key].dbType == 'text' \
-		            ) \
-		           ):
-				PK.remove(key)
-			
+		PK = self.dbFindComparablePK()
 
 		if len(PK) > 0:
 			mode = 'update'
@@ -428,46 +1057,93 @@ class DynamicStructure(Structure):
 					where.append('=?')
 					whereArgs.append(self.values[key])
 
+		# Only the changed fields of a record loaded from the database
+		# are written. Otherwise, every field with a value is.
+		if mode == 'update' and self.loadedValues != None:
+			changed = self.dbGetChangedFields()
+		else:
+			changed = [x for x in self.fields if self.values.has_key(x)]
+		columns = [x for x in changed
+		           if not (self.allFields[x].dbIdentity or
+		                   self.allFields[x].dbDynamicProperty)]
+		(removed, updated, added) = self.dbGetPropertyChanges()
+
 		sql = []
+		args = []
 
 		sql.append('BEGIN TRANSACTION; ')
 
 		if mode == 'update':
-			sql.append('DELETE FROM "')
-			sql.append(self.dbPropertyTable)
-			sql.append('" WHERE ')
-			sql.extend(where)
-			sql.append('; UPDATE "')
-			sql.append(self.dbTable)
-			sql.append('" SET "')
-			sql.append('"=?,"'.join([self.allFields[x].dbName \
-			      for x in self.fields \
-			      if (not self.allFields[x].dbIdentity) \
-			         and self.values.has_key(x) \
-				 and (not self.allFields[x].dbDynamicProperty)]))
-			sql.append('"=? WHERE ')
-			sql.extend(where)
-			sql.append('; ')
+			if self.loadedValues == None:
+				sql.append('DELETE FROM "')
+				sql.append(self.dbPropertyTable)
+				sql.append('" WHERE ')
+				sql.extend(where)
+				sql.append('; ')
+				args.extend(whereArgs)
+			elif len(removed) + len(added) > 0:
+				sql.append('DELETE FROM "')
+				sql.append(self.dbPropertyTable)
+				sql.append('" WHERE ')
+				sql.extend(where)
+				sql.append(' AND "')
+				sql.append(self.propertyNameColumn)
+				sql.append('" IN (')
+				sql.append(','.join(['?' for x in removed + added]))
+				sql.append('); ')
+				args.extend(whereArgs)
+				args.extend([self.allFields[x].dbName
+				             for x in removed + added])
+
+			if len(columns) > 0:
+				sql.append('UPDATE "')
+				sql.append(self.dbTable)
+				sql.append('" SET "')
+				sql.append('"=?,"'.join([self.allFields[x].dbName \
+				      for x in columns]))
+				sql.append('"=? WHERE ')
+				sql.extend(where)
+				sql.append('; ')
+				args.extend(self.dbGetSaveArgs(columns, []))
+				args.extend(whereArgs)
+
+			for field in updated:
+				sql.append('UPDATE "')
+				sql.append(self.dbPropertyTable)
+				sql.append('" SET "')
+				sql.append(self.propertyValueColumn)
+				sql.append('"=? WHERE ')
+				sql.extend(where)
+				sql.append(' AND "')
+				sql.append(self.propertyNameColumn)
+				sql.append('"=?; ')
+				args.extend(self.dbGetSaveArgs([field], []))
+				args.extend(whereArgs)
+				args.append(self.allFields[field].dbName)
 		elif mode == 'insert':
 			sql.append('INSERT INTO "')
 			sql.append(self.dbTable)
 			sql.append('" ("')
 			sql.append('","'.join([self.allFields[x].dbName \
-			      for x in self.fields \
-			      if (not self.allFields[x].dbIdentity) \
-			         and self.values.has_key(x) \
-				 and (not self.allFields[x].dbDynamicProperty)]))
+			      for x in columns]))
 			sql.append('") VALUES (')
-			sql.append(','.join(['?' \
-			      for x in self.fields \
-			      if (not (self.allFields[x].dbIdentity \
-			               or self.allFields[x].dbDynamicProperty)) \
-			         and self.values.has_key(x)]))
+			sql.append(','.join(['?' for x in columns]))
 			sql.append(');')
+			args.extend(self.dbGetSaveArgs(columns, []))
+
+		if len(added) > 0:
+			pkArgs = self.dbGetPropertyKeyArgs()
+
+			values = []
+			for x in PK2:
+				if self.allFields[x].dbIdentity and \
+				   not self.values.has_key(x):
+					values.append('@@identity,')
+				else:
+					values.append('?,')
+			values.append('?,?)')
+			values = '(' + ''.join(values)
 
-		for field in self.fields:
-			if not self.allFields[field].dbDynamicProperty:
-				continue
 			sql.append('INSERT INTO "')
 			sql.append(self.dbPropertyTable)
 			sql.append('" ("')
@@ -476,37 +1152,78 @@ class DynamicStructure(Structure):
 			sql.append(self.propertyNameColumn)
 			sql.append('","')
 			sql.append(self.propertyValueColumn)
-			sql.append('") VALUES (')
-			for x in PK2:
-				if self.allFields[x].dbIdentity and \
-				   not self.values.has_key(x):
-					sql.append('@@identity,')
-				else:
-					sql.append('?,')
-			sql.append('?,?);')
+			sql.append('") VALUES ')
+			sql.append(','.join([values for x in added]))
+			sql.append('; ')
+
+			for field in added:
+				args.extend(pkArgs)
+				args.append(self.allFields[field].dbName)
+				args.extend(self.dbGetSaveArgs([field], []))
 
 		sql.append('COMMIT; ')
 
-		args = []
+		return (''.join(sql), args)
+
+	def dbGetSaveShape(self, env):
+		r"""
+		Get the shape of the statement which saves the record's row of
+		the structure's table.
+
+		The dynamic properties are left out of the fields to save, since
+		they are saved to the property table.
 
-		args.extend(whereArgs)
+		@return See Structure::Structure::dbGetSaveShape().
+		"""
+		(key, columns, PK) = Structure.dbGetSaveShape(self, env)
+		columns = tuple([x for x in columns
+		                 if not self.allFields[x].dbDynamicProperty])
+		return (('save', key[1], key[2], columns, PK), columns, PK)
 
-		for x in self.fields:
-			if (not self.values.has_key(x)) or \
-			   self.allFields[x].dbIdentity or \
-			   self.allFields[x].dbDynamicProperty:
+	def dbGetPropertyChanges(self):
+		r"""
+		Get the dynamic properties whose rows need to be written.
+
+		A property whose value is @c NULL is saved by removing its row.
+		For a record loaded from the database, each changed property is
+		compared with its loaded value: its row is updated if both have
+		a value, and added if only the new value does. For any other
+		record, every property with a value is added.
+
+		A row with a @c NULL value may have been written for an added
+		property before, so the rows of added properties of a record
+		loaded from the database must be removed first.
+
+		@return A three element tuple of lists of the properties whose
+		        rows are removed, whose rows are updated, and whose rows
+		        are added, each in the order of @c fields.
+		"""
+		removed = []
+		updated = []
+		added = []
+		for x in self.dbGetChangedFields():
+			if not self.allFields[x].dbDynamicProperty:
 				continue
-			if self.allFields[x].maxlength and \
-			   type(self.values[x]) == type(''):
-				args.append((self.values[x])[ \
-				  :self.allFields[x].maxlength])
+			if self.values[x] == None:
+				removed.append(x)
+			elif self.loadedValues == None or \
+			     (not self.loadedValues.has_key(x)) or \
+			     self.loadedValues[x] == None:
+				added.append(x)
 			else:
-				args.append(self.values[x])
+				updated.append(x)
+		return (removed, updated, added)
 
-		args.extend(whereArgs)
+	def dbGetPropertyKeyArgs(self):
+		r"""
+		Get the primary key values of the record's property rows.
 
+		@return A list of the values of the primary key fields, in the
+		        order of @c fields. @c IDENTITY fields without a value are
+		        left out.
+		"""
 		pkArgs = []
-		for x in PK2:
+		for x in self.findPK():
 			if self.allFields[x].dbIdentity and \
 			   not self.values.has_key(x):
 				continue
@@ -516,19 +1233,49 @@ class DynamicStructure(Structure):
 				  :self.allFields[x].maxlength])
 			else:
 				pkArgs.append(self.values[x])
+		return pkArgs
 
-		for x in self.fields:
-			if not self.allFields[x].dbDynamicProperty:
-				continue
-			args.extend(pkArgs)
+	def dbGeneratePropertyTemplate(self, operation, PK):
+		r"""
+		Generate a statement template used by dbSaveMany() to write one
+		property row.
+
+		@param operation @c 'reset' to remove all of the rows of a
+		                 record, or @c 'remove', @c 'update' or
+		                 @c 'add' to write the row of one property.
+		@param PK        The primary key fields identifying the record,
+		                 as described in
+		                 Structure::Structure::dbGenerateSaveTemplate().
+		                 An @c 'add' sets all of the primary key fields.
+
+		@return The SQL query. Its arguments are the value of the
+		        property (for an @c 'update' or @c 'add'), then the
+		        values of the primary key fields (see
+		        dbGetPropertyKeyArgs() for an @c 'add'), then the
+		        @c dbName of the property (except for a @c 'reset').
+		"""
+		if operation == 'add':
+			return 'INSERT INTO "' + self.dbPropertyTable + '" ("' + \
+			       self.propertyValueColumn + '","' + \
+			       '","'.join([self.allFields[x].dbName
+			                   for x in self.findPK()]) + '","' + \
+			       self.propertyNameColumn + '") VALUES (?,' + \
+			       ','.join(['?' for x in self.findPK()]) + ',?)'
 
-			args.append(self.allFields[x].dbName)
-			if self.allFields[x].maxlength and \
-			   type(self.values[x]) == type(''):
-				args.append((self.values[x])[ \
-				  :self.allFields[x].maxlength])
+		where = []
+		for (key, isNull) in PK:
+			if isNull:
+				where.append('"' + self.allFields[key].dbName +
+				             '" IS NULL')
 			else:
-				args.append(self.values[x])
+				where.append('"' + self.allFields[key].dbName + '"=?')
+		if operation != 'reset':
+			where.append('"' + self.propertyNameColumn + '"=?')
 
-		return (''.join(sql), args)
-	## public:
\ No newline at end of file
+		if operation == 'update':
+			sql = 'UPDATE "' + self.dbPropertyTable + '" SET "' + \
+			      self.propertyValueColumn + '"=?'
+		else:
+			sql = 'DELETE FROM "' + self.dbPropertyTable + '"'
+		return sql + ' WHERE ' + ' AND '.join(where)
+	## public:
@@ -0,0 +1,297 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+class FlatFileIndex:
+	r"""
+	Flat File Key Index
+
+	An index of one field of a flat file, kept in a sidecar file next to
+	it. It maps each value of the field to the offsets of the records
+	with that value, so that FlatFileStructure::FlatFileStructure::dbLoad()
+	can seek to the matching records instead of reading the whole file.
+
+	The sidecar file starts with a header describing the flat file as it
+	was when it was indexed: its size, its modification time, the layout
+	of its records and a CRC of the last record indexed. The header is
+	followed by one fixed-width entry per whole record: the value of the
+	field, padded with NUL bytes to the field's length, followed by the
+	offset of the record as a big-endian 64-bit integer. The entries are
+	sorted, so lookup() finds a value with a binary search of the
+	memory-mapped sidecar file.
+
+	Before each lookup, the header is compared with the flat file. If
+	the flat file has grown, and the last record indexed is unchanged,
+	only the appended records are read and merged into the entries.
+	Otherwise, if the flat file has changed at all, the index is
+	rebuilt. The sidecar file is written to a temporary file which is
+	then renamed over it, so other processes never read half of one.
+
+	@remarks A record which is only partly written at the end of the
+	         flat file is not indexed. A change which leaves both the
+	         size and the modification time of the flat file as they
+	         were is not noticed.
+
+	An index is safe to use from several threads at once.
+
+	\class FlatFileIndex
+	"""
+
+	## protected:
+	magic = 'SKIMEIX1'
+
+	# The magic number, the size and modification time of the flat file,
+	# its header length, its record length, the offset and length of the
+	# field, and the CRC of the last record indexed.
+	headerFormat = '>8sQdLLLLl'
+	headerLength = struct.calcsize(headerFormat)
+
+	offsetFormat = '>Q'
+	offsetLength = struct.calcsize(offsetFormat)
+	## public:
+
+	def __init__(self, filename, fileHeader, recordLength, keyOffset,
+	             keyLength, indexFilename):
+		r"""
+		@param filename      The filename of the flat file.
+		@param fileHeader    The length of the flat file header.
+		@param recordLength  The length of a record.
+		@param keyOffset     The offset of the field in a record.
+		@param keyLength     The length of the field.
+		@param indexFilename The filename of the sidecar file.
+		"""
+		self.filename = filename
+		self.fileHeader = fileHeader
+		self.recordLength = recordLength
+		self.keyOffset = keyOffset
+		self.keyLength = keyLength
+		self.indexFilename = indexFilename
+		self.entryLength = keyLength + self.offsetLength
+
+		self.__lock = threading.Lock()
+
+		## The number of times the index was rebuilt.
+		self.builds = 0
+		## The number of times appended records were merged in.
+		self.merges = 0
+
+	def lookup(self, value):
+		r"""
+		Look up the records with a value of the field.
+
+		The index is brought up to date with the flat file first.
+
+		@param value The value of the field, as dbLoad() compares it:
+		             with whitespace stripped from both ends.
+
+		@return A two element tuple, or @c None if the index could not
+		        be read or written. The first element is a list of the
+		        offsets of the records whose field has @a value, in
+		        increasing order. The second element is the offset of
+		        the end of the last record indexed. Records after it
+		        were not looked up.
+		"""
+		try:
+			self.update()
+			index = file(self.indexFilename, 'rb')
+		except (IOError, OSError):
+			return None
+
+		try:
+			header = index.read(self.headerLength)
+			if len(header) != self.headerLength:
+				return None
+			header = struct.unpack(self.headerFormat, header)
+			end = self.fileHeader + \
+			      max(header[1] - self.fileHeader, 0) / \
+			      self.recordLength * self.recordLength
+
+			size = os.fstat(index.fileno()).st_size
+			value = str(value)
+			if size <= self.headerLength or len(value) > self.keyLength:
+				return ([], end)
+			value = value + '\0' * (self.keyLength - len(value))
+
+			data = mmap.mmap(index.fileno(), size,
+			                 access=mmap.ACCESS_READ)
+			try:
+				entryLength = self.entryLength
+				keyLength = self.keyLength
+				start = self.headerLength
+
+				# Find the first entry which is not less than value.
+				low = 0
+				high = (size - start) / entryLength
+				while low < high:
+					middle = (low + high) / 2
+					position = start + middle * entryLength
+					if data[position:position + keyLength] < value:
+						low = middle + 1
+					else:
+						high = middle
+
+				offsets = []
+				position = start + low * entryLength
+				while position < size and \
+				      data[position:position + keyLength] == value:
+					offsets.append(struct.unpack(self.offsetFormat,
+					  data[position + keyLength:
+					       position + entryLength])[0])
+					position += entryLength
+				return (offsets, end)
+			finally:
+				data.close()
+		finally:
+			index.close()
+
+	def update(self):
+		r"""
+		Bring the index up to date with the flat file.
+
+		@exception IOError An @e IOError (or @e OSError) will be thrown
+		                   if the flat file cannot be read or the
+		                   sidecar file cannot be written.
+		"""
+		self.__lock.acquire()
+		try:
+			stat = os.stat(self.filename)
+			header = self.__readHeader()
+
+			if header != None and \
+			   header[1:3] == (stat.st_size, stat.st_mtime):
+				return
+
+			if header != None and header[1] < stat.st_size and \
+			   header[3:7] == (self.fileHeader, self.recordLength,
+			                   self.keyOffset, self.keyLength):
+				indexed = (header[1] - self.fileHeader) / \
+				          self.recordLength
+				if indexed > 0 and \
+				   self.__checksum(indexed - 1) == header[7]:
+					self.__build(indexed, stat)
+					self.merges += 1
+					return
+
+			self.__build(0, stat)
+			self.builds += 1
+		finally:
+			self.__lock.release()
+
+	## protected:
+	def __readHeader(self):
+		r"""
+		Read the header of the sidecar file.
+
+		@return The tuple of the values of the header, or @c None if
+		        there is no valid sidecar file.
+		"""
+		try:
+			index = file(self.indexFilename, 'rb')
+		except IOError:
+			return None
+
+		try:
+			header = index.read(self.headerLength)
+		finally:
+			index.close()
+
+		if len(header) != self.headerLength:
+			return None
+		header = struct.unpack(self.headerFormat, header)
+		if header[0] != self.magic:
+			return None
+		return header
+
+	def __checksum(self, record):
+		r"""
+		Compute the CRC of a record of the flat file.
+
+		@param record The number of the record.
+
+		@return The CRC, or @c None if the record is not whole.
+		"""
+		db = file(self.filename, 'rb')
+		try:
+			db.seek(self.fileHeader + record * self.recordLength)
+			row = db.read(self.recordLength)
+		finally:
+			db.close()
+
+		if len(row) != self.recordLength:
+			return None
+		return zlib.crc32(row)
+
+	def __build(self, indexed, stat):
+		r"""
+		Write the sidecar file.
+
+		@param indexed The number of records whose entries are kept
+		               from the current sidecar file. The records after
+		               them are read from the flat file.
+		@param stat    The result of @c os.stat() of the flat file.
+		"""
+		entries = []
+		entryLength = self.entryLength
+
+		if indexed > 0:
+			index = file(self.indexFilename, 'rb')
+			try:
+				index.seek(self.headerLength)
+				data = index.read(indexed * entryLength)
+			finally:
+				index.close()
+			entries = [data[x:x + entryLength]
+			           for x in xrange(0, len(data), entryLength)]
+			del data
+
+		# Only whole records are indexed.
+		records = (stat.st_size - self.fileHeader) / self.recordLength
+		crc = 0
+		if records > indexed:
+			db = file(self.filename, 'rb')
+			try:
+				size = self.fileHeader + records * self.recordLength
+				data = mmap.mmap(db.fileno(), size,
+				                 access=mmap.ACCESS_READ)
+				try:
+					keyLength = self.keyLength
+					keyOffset = self.keyOffset
+					for position in xrange(
+					  self.fileHeader + indexed * self.recordLength,
+					  size, self.recordLength):
+						key = data[position + keyOffset:
+						           position + keyOffset + keyLength].strip()
+						entries.append(key +
+						  '\0' * (keyLength - len(key)) +
+						  struct.pack(self.offsetFormat, position))
+					crc = zlib.crc32(data[size - self.recordLength:size])
+				finally:
+					data.close()
+			finally:
+				db.close()
+		elif records > 0:
+			crc = self.__checksum(records - 1)
+
+		# The offset follows the value in each entry, so sorting the
+		# entries sorts them by value, then by offset.
+		entries.sort()
+
+		(directory, name) = os.path.split(self.indexFilename)
+		(handle, temporary) = tempfile.mkstemp('.tmp', name + '.',
+		                                       directory or '.')
+		try:
+			index = os.fdopen(handle, 'wb')
+			try:
+				index.write(struct.pack(self.headerFormat, self.magic,
+				  stat.st_size, stat.st_mtime, self.fileHeader, self.recordLength,
+				  self.keyOffset, self.keyLength, crc))
+				index.write(''.join(entries))
+			finally:
+				index.close()
+			os.rename(temporary, self.indexFilename)
+		except:
+			os.remove(temporary)
+			raise
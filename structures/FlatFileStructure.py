@@ -1,4 +1,9 @@
+import mmap
+import os
+import struct
+
 from Structure import *
+from FlatFileIndex import FlatFileIndex
 
 class FlatFileStructure(Structure):
 	r"""
@@ -13,6 +18,16 @@ class FlatFileStructure(Structure):
 	         files.
 	"""
 
+	## protected:
+	# The read plans of each structure, keyed on the schema key and the
+	# fields to read.
+	__plans = {}
+
+	# The indexes of each structure, keyed on the schema key and the
+	# field.
+	__indexes = {}
+	## public:
+
 	def __init__(self,
 	             filename,
 		     formPrefix,
@@ -118,12 +133,21 @@ class FlatFileStructure(Structure):
 
 
 	def dbLoad(cls, env, con, query=None, where=None,
-	           orderBy=None, reverseSort=False, max=None):
+	           orderBy=None, reverseSort=False, max=None, fields=None):
 		r"""
 		Generate records from @a con based on @a query dictionary.
 
 		This method is used to retrieve data from the flat file.
 
+		A record matches if every field in @a query has its value. If
+		any of the fields in @a query is indexed (see dbGetIndex()),
+		the offsets of the records which might match are looked up in
+		the indexes, and only those records are read. Otherwise, the
+		file is memory-mapped and walked one record offset at a time.
+		Only the fields to match are copied out of a record until it
+		matches. The fields of a matching record are then extracted
+		with the plan from dbGetReadPlan().
+
 		@param env         An instance of the @em env class which keeps
 		                   track of the current operational
 		                   environment.
@@ -144,10 +168,13 @@ class FlatFileStructure(Structure):
 		@param max         A dummy variable for rough compatibility
 		                   with database structures. This variable
 		                   must be @c None.
+		@param fields      A sequence of the fields to load. Other
+		                   fields have no value in the records. If
+		                   @a fields is @c None, all fields are loaded.
 
 		@return Generates instances of the class on which this method
-		        was called. Each instance will contain the data from
-		        one row in the database.
+		        was called, in the order of the records in the file.
+		        Each instance will contain the data from one record.
 
 		@pre @a query must contain at least one field that is valid in
 		     the current configuration.
@@ -169,29 +196,210 @@ class FlatFileStructure(Structure):
 		assert max == None, \
 		  'A record cap is not supported by the flat file engine.'
 
-		instance = cls(env)
-
-		db = file(instance.dbTable)
-		db.seek(instance.fileHeader)
-
-		while True:
-			row = db.read(instance.recordLength)
-			if len(row) == 0: break
-
-			if query != None and len(query) != 0:
-				for field in query:
-					if query[field] == instance.__getField(row, field):
-						rec = cls(env)
-						rec.dbLoadRecord(row)
-						yield rec
+		recordClass = cls.getSchema(env).recordClass
+		instance = recordClass(env)
+		if fields != None:
+			fields = tuple(fields)
+		(read, names, bounds) = cls.dbGetReadPlan(env, fields)
+
+		# The values to match, with the bounds of their fields.
+		match = []
+		# The offsets of the records which might match, according to
+		# the indexes, and the offset of the end of the records the
+		# indexes cover.
+		candidates = None
+		indexed = None
+		if query != None:
+			for field in query:
+				(offset, length) = (instance.allFields[field].ffOffset,
+				                    instance.allFields[field].maxlength)
+				match.append((query[field], offset, offset + length))
+
+				index = cls.dbGetIndex(env, field)
+				if index == None:
+					continue
+				result = index.lookup(query[field])
+				if result == None:
+					continue
+				(offsets, end) = result
+				if candidates == None:
+					candidates = offsets
+					indexed = end
+				else:
+					found = {}
+					for x in offsets:
+						found[x] = True
+					candidates = [x for x in candidates if found.has_key(x)]
+					indexed = min(indexed, end)
+
+		db = file(instance.dbTable, 'rb')
+		size = os.fstat(db.fileno()).st_size
+		if size <= instance.fileHeader:
+			db.close()
+			return
+		data = mmap.mmap(db.fileno(), size, access=mmap.ACCESS_READ)
+
+		recordLength = instance.recordLength
+		if candidates == None:
+			positions = xrange(instance.fileHeader, size, recordLength)
+		else:
+			# The records the indexes do not cover yet are read, too.
+			positions = [x for x in candidates if x < indexed]
+			positions.extend(xrange(indexed, size, recordLength))
+
+		for position in positions:
+			if position >= size:
+				break
+
+			# The candidates from the indexes are verified, too, in
+			# case the file changed since they were looked up.
+			matches = True
+			for (value, start, end) in match:
+				if value != data[position + start:
+				                 position + end].strip():
+					matches = False
+					break
+			if not matches:
+				continue
+
+			# A partial record at the end of the file is read with
+			# slices, which stop at the end of the file.
+			if position + recordLength > size:
+				row = [data[position + x:position + y]
+				       for (x, y) in bounds]
 			else:
-				rec = cls(env)
-				rec.dbLoadRecord(row)
-				yield rec
+				row = read(data, position)
+
+			rec = recordClass(env)
+			values = rec.values
+			for x, y in zip(names, row):
+				values[x] = y.strip()
+			yield rec
 
+		data.close()
 		db.close()
 	dbLoad = classmethod(dbLoad)
 
+	def dbGetIndex(cls, env, field):
+		r"""
+		Get the index of a @a field.
+
+		A field is indexed if its @c dbIndexed property is set. Its
+		index is kept in a sidecar file named after the flat file and
+		the field, e.g. @c ledger.dat.Account.idx for the @c Account
+		field of @c ledger.dat. It is built by the first lookup and
+		kept up to date by FlatFileIndex::FlatFileIndex.
+
+		@param env   An instance of the @em env class which keeps track
+		             of the current operational environment.
+		@param field The name of the field.
+
+		@return An instance of FlatFileIndex::FlatFileIndex, or
+		        @c None if @a field is not indexed.
+		"""
+		schema = cls.getSchema(env)
+		key = (schema.key, field)
+		try:
+			return cls.__indexes[key]
+		except KeyError:
+			pass
+
+		instance = schema.recordClass(env)
+		properties = instance.allFields[field]
+		if properties.dbIndexed and properties.maxlength != None:
+			index = FlatFileIndex(instance.dbTable, instance.fileHeader,
+			                      instance.recordLength,
+			                      properties.ffOffset,
+			                      properties.maxlength,
+			                      '%s.%s.idx' % (instance.dbTable, field))
+		else:
+			index = None
+
+		cls.__indexes[key] = index
+		return index
+	dbGetIndex = classmethod(dbGetIndex)
+
+	def dbGetReadPlan(cls, env, fields=None):
+		r"""
+		Get the plan used by dbLoad() to extract fields from a record.
+
+		The plan is compiled once per structure, provider configuration
+		and set of @a fields. If the fields do not overlap, they are
+		extracted by a single @c struct format, which skips the bytes
+		of the other fields. Where @c struct.Struct is available
+		(Python 2.5 and later), the fields are unpacked straight out of
+		the file's memory map without copying the record first.
+
+		@param env    An instance of the @em env class which keeps
+		              track of the current operational environment.
+		@param fields A tuple of the fields to extract, or @c None to
+		              extract all of them.
+
+		@return A three element tuple. The first element is a function
+		        which, given the file's data and the offset of a whole
+		        record, returns a sequence of the unstripped values of
+		        the fields. The second element is a tuple of the names
+		        of the fields, in the same order. The third element is
+		        a tuple of the (@e start, @e end) bounds of each field
+		        in a record, in the same order.
+		"""
+		schema = cls.getSchema(env)
+		key = (schema.key, fields)
+		try:
+			return cls.__plans[key]
+		except KeyError:
+			pass
+
+		instance = schema.recordClass(env)
+		recordLength = instance.recordLength
+
+		slices = []
+		for field in instance.fileFieldOrder:
+			if fields != None and field not in fields:
+				continue
+			start = instance.allFields[field].ffOffset
+			if instance.allFields[field].maxlength == None:
+				end = recordLength
+			else:
+				end = start + instance.allFields[field].maxlength
+			slices.append((start, min(end, recordLength), field))
+		slices.sort()
+
+		names = tuple([x[2] for x in slices])
+		bounds = tuple([(x[0], x[1]) for x in slices])
+
+		format = []
+		position = 0
+		for (start, end, field) in slices:
+			if start < position:
+				format = None
+				break
+			if start > position:
+				format.append('%dx' % (start - position))
+			format.append('%ds' % (end - start))
+			position = end
+
+		if format == None:
+			def read(data, position, bounds=bounds):
+				return [data[position + x:position + y]
+				        for (x, y) in bounds]
+		else:
+			if position < recordLength:
+				format.append('%dx' % (recordLength - position))
+			format = ''.join(format)
+			if hasattr(struct, 'Struct'):
+				read = struct.Struct(format).unpack_from
+			else:
+				def read(data, position, format=format,
+				         recordLength=recordLength):
+					return struct.unpack(format,
+					  data[position:position + recordLength])
+
+		plan = (read, names, bounds)
+		cls.__plans[key] = plan
+		return plan
+	dbGetReadPlan = classmethod(dbGetReadPlan)
+
 	def dbLoadRecord(self, row):
 		r"""
 		Load fields from a flat file record.
@@ -2,6 +2,9 @@ from Structure import *
 
 class GreylistTriplet(Structure):
 
+	# These are scanned in large sets.
+	dbFetchSize = 500
+
 	def __init__(self, env):
 		r"""
 		Initialize a GreylistTriplet object.
@@ -0,0 +1,85 @@
+class LeanValues(object):
+	r"""
+	Compact Record Values
+
+	This class stores the values of a record loaded from the database as
+	the row tuple itself. Fields are located through the @c fieldIndex of
+	the record's compiled Schema::Schema instead of being copied into a
+	per-record dictionary. It supports the parts of the dictionary
+	interface which are used on Structure::Structure @c values, so lean
+	records can be displayed, saved, and searched for primary keys like
+	any other record.
+
+	The row is converted to a list the first time a value is changed.
+	Values stored for names which are not fields of the schema are kept
+	in a small overflow dictionary.
+	"""
+
+	__slots__ = ('fieldIndex', 'row', 'extra')
+
+	def __init__(self, fieldIndex, row):
+		r"""
+		@param fieldIndex A dictionary mapping field names to their
+		                  position in @a row.
+		@param row        A tuple with one value per field.
+		"""
+		self.fieldIndex = fieldIndex
+		self.row = row
+		self.extra = None
+
+	def __getitem__(self, key):
+		try:
+			return self.row[self.fieldIndex[key]]
+		except KeyError:
+			if self.extra == None:
+				raise
+			return self.extra[key]
+
+	def __setitem__(self, key, value):
+		try:
+			index = self.fieldIndex[key]
+		except KeyError:
+			if self.extra == None:
+				self.extra = {}
+			self.extra[key] = value
+			return
+
+		if type(self.row) == type(()):
+			self.row = list(self.row)
+		self.row[index] = value
+
+	def has_key(self, key):
+		if self.fieldIndex.has_key(key):
+			return True
+		return self.extra != None and self.extra.has_key(key)
+
+	__contains__ = has_key
+
+	def get(self, key, default=None):
+		if self.has_key(key):
+			return self[key]
+		return default
+
+	def keys(self):
+		out = self.fieldIndex.keys()
+		if self.extra != None:
+			out.extend(self.extra.keys())
+		return out
+
+	def items(self):
+		return [(x, self[x]) for x in self.keys()]
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		out = len(self.fieldIndex)
+		if self.extra != None:
+			out += len(self.extra)
+		return out
+
+	def copy(self):
+		r"""
+		@return The values as a new dictionary.
+		"""
+		return dict(self.items())
@@ -0,0 +1,182 @@
+import time
+
+class LookupCache:
+	r"""
+	Lookup Table Cache
+
+	Fields whose display is a @c dbDropdown or @c dbLookup show values
+	from another structure's table, such as the Groups or Regions of a
+	MasterAccount. Those tables are small and rarely change, but every
+	record rendered would otherwise query them again. This cache keeps
+	the results for the life of the process.
+
+	Keys are tuples which start with the Schema::Schema key of the
+	looked-up structure, followed by whatever else determines the
+	result (the display and data fields, the @c where and @c query of
+	the disp::disp, and so on).
+
+	An entry expires @c ttl seconds after it is stored. All of the
+	entries of a structure are discarded by invalidate(), which
+	Structure::Structure calls whenever records of that structure are
+	saved or deleted. Changes made by other processes are only seen
+	once the entry expires.
+
+	@remarks When the cache holds @c maxSize entries, the expired
+	         entries are discarded, and if there are none, the least
+	         recently used quarter of them.
+
+	\class LookupCache
+	"""
+
+	__entries = {}
+
+	# The number of times each structure class has been invalidated.
+	__generations = {}
+
+	# The number of lookups so far, used to order the entries by when
+	# they were last used.
+	__clock = 0
+
+	## The maximum number of entries to keep.
+	maxSize = 1000
+
+	## The number of seconds an entry is kept.
+	ttl = 300
+
+	## The number of lookups which found an entry.
+	hits = 0
+	## The number of lookups which did not find an entry.
+	misses = 0
+
+	def get(cls, key):
+		r"""
+		Look up an entry.
+
+		@param key The cache key. Its first element must be the
+		           Schema::Schema key of the looked-up structure.
+
+		@return The value stored under @a key, or @c None if there is
+		        none or it has expired or been invalidated.
+		"""
+		try:
+			(expires, generation, value, used) = cls.__entries[key]
+		except KeyError:
+			cls.misses += 1
+			return None
+
+		if expires < time.time() or \
+		   generation != cls.__generations.get(key[0][0], 0):
+			# Another thread may have discarded it already.
+			cls.__entries.pop(key, None)
+			cls.misses += 1
+			return None
+
+		cls.__clock += 1
+		cls.__entries[key] = (expires, generation, value, cls.__clock)
+		cls.hits += 1
+		return value
+	get = classmethod(get)
+
+	def put(cls, key, value):
+		r"""
+		Store an entry.
+
+		@param key   The cache key. (See get().)
+		@param value The value. It must not be @c None.
+
+		@return @a value
+		"""
+		if len(cls.__entries) >= cls.maxSize:
+			cls.__evict()
+		cls.__clock += 1
+		cls.__entries[key] = (time.time() + cls.ttl,
+		                      cls.__generations.get(key[0][0], 0),
+		                      value, cls.__clock)
+		return value
+	put = classmethod(put)
+
+	def invalidate(cls, structureClass):
+		r"""
+		Discard the entries of a structure.
+
+		@param structureClass The Structure::Structure subclass whose
+		                      records have changed. If a schema's
+		                      @c recordClass is passed, the structure
+		                      class it was compiled from is used.
+		"""
+		if structureClass.__dict__.has_key('schema'):
+			structureClass = structureClass.schema.structureClass
+		cls.__generations[structureClass] = \
+		  cls.__generations.get(structureClass, 0) + 1
+	invalidate = classmethod(invalidate)
+
+	def getGeneration(cls, structureClass):
+		r"""
+		Get the number of times a structure has been invalidated.
+
+		Other caches of data derived from a structure can compare this
+		to the value when they stored an entry to learn whether the
+		structure's records have changed since.
+
+		@param structureClass The Structure::Structure subclass. (See
+		                      invalidate().)
+
+		@return The number of times invalidate() has been called for
+		        @a structureClass.
+		"""
+		if structureClass.__dict__.has_key('schema'):
+			structureClass = structureClass.schema.structureClass
+		return cls.__generations.get(structureClass, 0)
+	getGeneration = classmethod(getGeneration)
+
+	def getStats(cls):
+		r"""
+		Get the cache statistics.
+
+		@return A dictionary with the @c hits, @c misses, @c size and
+		        @c hitRate (the fraction of lookups which were hits)
+		        of the cache.
+		"""
+		lookups = cls.hits + cls.misses
+		if lookups > 0:
+			hitRate = float(cls.hits) / lookups
+		else:
+			hitRate = 0.0
+		return {'hits': cls.hits,
+		        'misses': cls.misses,
+		        'size': len(cls.__entries),
+		        'hitRate': hitRate}
+	getStats = classmethod(getStats)
+
+	def flush(cls):
+		r"""
+		Discard all entries and reset the counters.
+		"""
+		cls.__entries.clear()
+		cls.hits = 0
+		cls.misses = 0
+	flush = classmethod(flush)
+
+	## protected:
+	def __evict(cls):
+		r"""
+		Discard the expired or invalidated entries, or if there are
+		none, the least recently used quarter of the entries.
+		"""
+		now = time.time()
+		order = []
+		expired = False
+		for (key, entry) in cls.__entries.items():
+			if entry[0] < now or \
+			   entry[1] != cls.__generations.get(key[0][0], 0):
+				cls.__entries.pop(key, None)
+				expired = True
+			else:
+				order.append((entry[3], key))
+
+		if not expired:
+			order.sort()
+			for (used, key) in order[:max(1, len(order) / 4)]:
+				cls.__entries.pop(key, None)
+	__evict = classmethod(__evict)
+	## public:
@@ -3,6 +3,9 @@ from structures.SubAccount import SubAccount
 
 class MailEvent(Structure):
 
+	# These are scanned in large sets.
+	dbFetchSize = 500
+
 	def __init__(self, env):
 		r"""
 		Initialize a MailEvent object.
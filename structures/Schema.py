@@ -0,0 +1,222 @@
+import new
+
+from structures.LeanValues import LeanValues
+
+class Schema:
+	r"""
+	Compiled Structure Schema
+
+	A schema holds everything about a data structure which does not vary
+	from one record to the next: the field properties in @c allFields,
+	the present @c fields, the database table, the titles and prefixes,
+	and so on. It is compiled once per structure class and provider
+	configuration by running the structure's constructor (and thus the
+	@em env @c configXxx hook and buildFields()) a single time.
+
+	Records are created from the schema's @c recordClass, a subclass of
+	the structure class which carries the compiled attributes as class
+	variables. The per-record state of such a record is only its
+	@c values dictionary.
+
+	@remarks The compiled attributes are shared by every record of the
+	         structure. Consumers must not modify them. A record which
+	         needs to change the properties of a field must use
+	         Structure::Structure::privateField() to get its own copy.
+
+	\class Schema
+	"""
+
+	__schemas = {}
+
+	## protected:
+	# Attributes which are per-record state and are therefore not
+	# compiled into the schema.
+	recordAttributes = ('values', 'loadedValues', 'env')
+	## public:
+
+	def __init__(self, structureClass, env):
+		r"""
+		Compile the schema of @a structureClass.
+
+		@param structureClass The Structure::Structure subclass to
+		                      compile.
+		@param env            An instance of the @em env class which
+		                      keeps track of the current operational
+		                      environment.
+		"""
+		template = structureClass(env)
+
+		self.structureClass = structureClass
+		self.key = Schema.getKey(structureClass, env)
+
+		attributes = {}
+		for name in template.__dict__:
+			if name not in Schema.recordAttributes:
+				attributes[name] = template.__dict__[name]
+
+		self.allFields = template.allFields
+		self.fields = template.fields
+		self.dbTable = template.dbTable
+
+		self.fieldIndex = {}
+		for i in range(len(self.fields)):
+			self.fieldIndex[self.fields[i]] = i
+		self.maxlengths = tuple([self.allFields[x].maxlength
+		                         for x in self.fields])
+
+		# The fieldIndex and maxlengths of each subset of the fields
+		# which has been loaded, keyed on the subset.
+		self.projections = {}
+
+		# Search structures keep a reference to the env they were
+		# built with. That env must not be held by the schema.
+		self.keepsEnv = template.__dict__.has_key('env')
+
+		attributes['schema'] = self
+		attributes['__init__'] = _initRecord
+		attributes['__module__'] = structureClass.__module__
+		attributes['__doc__'] = structureClass.__doc__
+
+		self.recordClass = new.classobj(structureClass.__name__,
+		                                (structureClass,), attributes)
+
+	def newLeanRecord(self, env, row, columns=None):
+		r"""
+		Create a lean record from a database row.
+
+		The values of a lean record are kept in a LeanValues::LeanValues
+		instance which holds the row as a tuple. Strings are stripped and
+		truncated to their field's @c maxlength exactly as
+		Structure::Structure::dbLoadRecord() does.
+
+		@param env An instance of the @em env class which keeps track
+		           of the current operational environment.
+		@param row     The database row as a tuple of fields, in the
+		               order of @c fields.
+		@param columns A sequence of the fields in @a row, if it does
+		               not have all of the fields.
+
+		@return A new record of @c recordClass.
+		"""
+		if columns == None:
+			(fieldIndex, maxlengths) = (self.fieldIndex, self.maxlengths)
+		else:
+			(fieldIndex, maxlengths) = self.getProjection(columns)
+
+		values = []
+		for y, maxlength in zip(row, maxlengths):
+			# Strip Strings
+			if type(y) == type(''):
+				y = y.strip()
+
+				# Truncate Strings w/ a maxlength Property
+				if maxlength:
+					y = y[:maxlength]
+
+			values.append(y)
+
+		# The loaded values share the row, which LeanValues copies
+		# before the first change.
+		values = tuple(values)
+		rec = new.instance(self.recordClass, {
+		        'values': LeanValues(fieldIndex, values),
+		        'loadedValues': LeanValues(fieldIndex, values)})
+		if self.keepsEnv:
+			rec.env = env
+		return rec
+
+	def getProjection(self, columns):
+		r"""
+		Get the @c fieldIndex and @c maxlengths of a subset of the
+		fields.
+
+		@param columns A tuple of field names.
+
+		@return A two element tuple of a dictionary mapping the fields
+		        in @a columns to their position and a tuple of their
+		        @c maxlength properties.
+		"""
+		try:
+			return self.projections[columns]
+		except KeyError:
+			pass
+
+		fieldIndex = {}
+		for i in range(len(columns)):
+			fieldIndex[columns[i]] = i
+		projection = (fieldIndex,
+		              tuple([self.allFields[x].maxlength for x in columns]))
+		self.projections[columns] = projection
+		return projection
+
+	def getKey(structureClass, env):
+		r"""
+		Get the cache key for @a structureClass under @a env.
+
+		@param structureClass The Structure::Structure subclass.
+		@param env            An instance of the @em env class which
+		                      keeps track of the current operational
+		                      environment, or @c None.
+
+		@return A tuple of the structure class and the provider
+		        configuration of @a env.
+		"""
+		if env == None:
+			return (structureClass, None)
+		return (structureClass, env.providerString)
+	getKey = staticmethod(getKey)
+
+	def get(cls, structureClass, env):
+		r"""
+		Get the compiled schema of @a structureClass.
+
+		The schema is compiled on first use and cached for the life of
+		the process.
+
+		@param structureClass The Structure::Structure subclass. If a
+		                      schema's @c recordClass is passed, the
+		                      structure class it was compiled from is
+		                      used.
+		@param env            An instance of the @em env class which
+		                      keeps track of the current operational
+		                      environment.
+
+		@return The Schema instance for @a structureClass and the
+		        provider configuration of @a env.
+		"""
+		if structureClass.__dict__.has_key('schema'):
+			structureClass = structureClass.schema.structureClass
+
+		key = cls.getKey(structureClass, env)
+		try:
+			return cls.__schemas[key]
+		except KeyError:
+			schema = cls(structureClass, env)
+			cls.__schemas[key] = schema
+			return schema
+	get = classmethod(get)
+
+	def flush(cls):
+		r"""
+		Discard all compiled schemas.
+
+		Records created before the flush keep the schema they were
+		created with.
+		"""
+		cls.__schemas.clear()
+	flush = classmethod(flush)
+
+def _initRecord(self, env):
+	r"""
+	Record Constructor
+
+	This is the constructor of every schema's @c recordClass. Since the
+	compiled attributes are class variables, only the per-record state
+	is set up here.
+
+	@param env An instance of the @em env class which keeps track of the
+	           current operational environment.
+	"""
+	self.values = {}
+	if self.schema.keepsEnv:
+		self.env = env
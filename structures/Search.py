@@ -14,6 +14,10 @@ from display.html import *
 
 class Search(Structure):
 
+	# Searches do not call Structure.__init__(), which sets this, and
+	# are never on a linked server. (See dbExecute().)
+	dbLinkedServerName = None
+
 	def rowFieldHolder(self, label, guts):
 		# XXX: This is crap
 
@@ -25,7 +29,7 @@ class Search(Structure):
 	# Class Method
 	def buildQuery(cls, env, max=1):
 		"""Returns a query set based on data filled in form"""
-		instance = cls(env)
+		instance = cls.newRecord(env)
 
 		if env.fieldStorage.has_key(instance.formPrefix+".count"):
 			count = int(env.fieldStorage[instance.formPrefix+".count"])
@@ -36,7 +40,7 @@ class Search(Structure):
 		for i in range(count):
 			if i > max: raise RuntimeError, 'Too many form entries were found.'
 
-			for (table, None, field) in instance.fieldSet:
+			for (table, fieldProperties, field) in instance.fieldSet:
 				formFieldTitle = instance.formPrefix+'.'+field+'.'+str(i)
 				if env.fieldStorage.has_key(formFieldTitle) and len(env.fieldStorage[formFieldTitle].strip()) > 0:
 					query[(table, field)] = env.fieldStorage[formFieldTitle]
@@ -45,70 +49,93 @@ class Search(Structure):
 	buildQuery = classmethod(buildQuery)
 
 	# Static
-	def dbLoad(cls, env, con, query=None, where=None, orderBy=None, reverseSort=False, max=None):
-		if where == None: where = ''
-		con = env.con
-		args  = []
-		s = cls(env)
-		(fieldSet, tableNames, joins) = (s.fieldSet, s.tableNames, s.joins)
-
-		sql =	'SELECT "' + '","'.join([table+'"."'+field.dbName for (table, field, name) in fieldSet]) \
-			+ '" FROM "' + '","'.join(tableNames) + '"'
-
-		# XXX: The rest of this could really just come from dbLoad in Structure
-		instance = cls(env)
-		if query != None:
-			for (table, key) in query:
-				if instance.allFields.has_key(key) and instance.allFields[key].present:
-					if where != '':
-						where += ' AND '
-					where += '"' + table + '"."' + instance.allFields[key].dbName + '" LIKE ?'
-					args.append(query[(table, key)])
-			assert len(args) > 0, 'query != None, but no fields in query were present (or query == {})' + str(query)
-
-		sql += ' WHERE ' + ' AND '.join(['"'+x+'"."'+z+'" = "'+y+'"."'+z+'"' for x, y, z in joins])
-
-		if where: sql += ' AND ' + where
+	def dbLoad(cls, env, con, query=None, where=None, orderBy=None, reverseSort=False, max=None, arraysize=None):
+		assert max == None or max > 0, 'max is not greater than zero'
+		queryKeys = cls.dbGetQueryKeys(env, query)
 
-		if orderBy != None and len(orderBy) > 0:
-			sql += ' ORDER BY "' + '","'.join([instance.allFields[x].dbName for x in orderBy]) + '"'
-			if reverseSort:
-				sql += ' DESC'
+		if max != None:
+			max = int(max)
+			top = max + 1
+		else:
+			top = None
+
+		(sql, plan) = cls.dbGenerateLoadQuery(env, queryKeys, where, orderBy, reverseSort, top)
 
 		cur = con.cursor()
 
-		util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
+		cls.dbExecute(env, cur, sql, [query[x] for x in plan])
 		sql = None
-		args = None
-
-		# XXX: This is a work-around for DBAPI 1.0 compatibility.
-		try:
-			assert max == None or max > 0, 'max is not greater than zero'
-			rowcount = cur.rowcount
-			if (max != None and rowcount > max):
-				raise RuntimeError, "A maximum " + str(max) + " rows were requested but " + str(rowcount) + " were found."
-		except AttributeError:
-			pass
-
-		while 1:
-			try:
-				row = cur.fetchone()
-			except:
-				break
-			if row != None:
-				rec = cls(env)
-				rec.dbLoadRecord(row)
-				yield rec
-			else:
-				break
 
-		cur.close()
+		for rec in cls.dbFetch(env, cur, max, arraysize):
+			yield rec
 	dbLoad = classmethod(dbLoad)
 
 	def dbLoadRecord(self, row):
 		for x, y in zip([name for (table, field, name) in self.fieldSet], row):
 			self.values[x] = y
 
+	def dbGetQueryKeys(cls, env, query):
+		"""Returns the sorted (table, field) keys of query which can be matched"""
+		if query == None:
+			return None
+
+		instance = cls.newRecord(env)
+		queryKeys = [(table, key) for (table, key) in query if instance.allFields.has_key(key) and instance.allFields[key].present]
+		queryKeys.sort()
+		assert len(queryKeys) > 0, 'query != None, but no fields in query were present (or query == {})' + str(query)
+		return tuple(queryKeys)
+	dbGetQueryKeys = classmethod(dbGetQueryKeys)
+
+	def dbGenerateWhere(cls, env, queryKeys=None, where=None):
+		"""Returns the conditions joining the tables and matching queryKeys with LIKE"""
+		instance = cls.newRecord(env)
+
+		conditions = ['"'+x+'"."'+z+'" = "'+y+'"."'+z+'"' for x, y, z in instance.joins]
+		if where:
+			conditions.append('(' + where + ')')
+
+		plan = []
+		if queryKeys != None:
+			for (table, key) in queryKeys:
+				conditions.append('"' + table + '"."' + instance.allFields[key].dbName + '" LIKE ?')
+				plan.append((table, key))
+
+		if len(conditions) == 0:
+			return ([], plan)
+		return ([' AND '.join(conditions)], plan)
+	dbGenerateWhere = classmethod(dbGenerateWhere)
+
+	def dbGenerateLoadQuery(cls, env, queryKeys=None, where=None, orderBy=None, reverseSort=False, top=None, seek=False):
+		"""Returns the SELECT statement template used by dbLoad"""
+		assert not seek, 'Paging is not implemented for searches.'
+
+		instance = cls.newRecord(env)
+		(where, plan) = cls.dbGenerateWhere(env, queryKeys, where)
+		(topSql, limitSql) = cls.dbGenerateLimit(env, top)
+
+		sql =	'SELECT ' + topSql + '"' + '","'.join([table+'"."'+field.dbName for (table, field, name) in instance.fieldSet]) \
+			+ '" FROM "' + '","'.join(instance.tableNames) + '"'
+
+		if where:
+			sql += ' WHERE ' + ''.join(where)
+
+		if orderBy != None and len(orderBy) > 0:
+			if reverseSort:
+				direction = '" DESC'
+			else:
+				direction = '"'
+			sql += ' ORDER BY ' + ','.join(['"' + instance.allFields[x].dbName + direction for x in orderBy])
+
+		sql += limitSql
+
+		return (sql, plan)
+	dbGenerateLoadQuery = classmethod(dbGenerateLoadQuery)
+
+	def dbGenerateCountQuery(cls, env, queryKeys=None, where=None, exists=False):
+		"""Returns the statement template used by dbCount and dbExists"""
+		return cls.dbGenerateCountOf(env, cls.dbGenerateLoadQuery(env, queryKeys, where), exists)
+	dbGenerateCountQuery = classmethod(dbGenerateCountQuery)
+
 	def getFieldsAndTables(self, fields, joiner=None, PKs=None):
 		fieldSet = []
 		tableNames = []
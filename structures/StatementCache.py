@@ -0,0 +1,91 @@
+class StatementCache:
+	r"""
+	SQL Statement Template Cache
+
+	Structure::Structure builds its SQL statements from the compiled
+	schema, the shape of the query (which fields are matched, the sort
+	order, and so on) and the operation being performed. None of these
+	depend on the values being loaded or saved, so the statement only
+	needs to be built once per shape.
+
+	A template is a two element tuple of the SQL string (in the
+	@c qmark parameter style) and an argument-extraction plan. The plan
+	is whatever the caller needs to pull the arguments out of its
+	values in the order of the placeholders; typically a sequence of
+	field names.
+
+	Keys are tuples which start with the operation and the Schema::Schema
+	key (the structure class and provider configuration), followed by
+	whatever else determines the shape of the statement.
+
+	@remarks Statements which embed caller-provided @c WHERE strings can
+	         make the number of keys grow without bound. The cache is
+	         therefore emptied whenever it reaches @c maxSize entries.
+
+	\class StatementCache
+	"""
+
+	__statements = {}
+
+	## The maximum number of templates to keep.
+	maxSize = 1000
+
+	## The number of lookups which found a template.
+	hits = 0
+	## The number of lookups which did not find a template.
+	misses = 0
+
+	def get(cls, key):
+		r"""
+		Look up a statement template.
+
+		@param key The cache key.
+
+		@return The template stored under @a key, or @c None if there
+		        is none.
+		"""
+		try:
+			template = cls.__statements[key]
+		except KeyError:
+			cls.misses += 1
+			return None
+		cls.hits += 1
+		return template
+	get = classmethod(get)
+
+	def put(cls, key, template):
+		r"""
+		Store a statement template.
+
+		@param key      The cache key.
+		@param template A tuple of the SQL string and the
+		                argument-extraction plan.
+
+		@return @a template
+		"""
+		if len(cls.__statements) >= cls.maxSize:
+			cls.__statements.clear()
+		cls.__statements[key] = template
+		return template
+	put = classmethod(put)
+
+	def getStats(cls):
+		r"""
+		Get the cache statistics.
+
+		@return A dictionary with the @c hits, @c misses and @c size
+		        of the cache.
+		"""
+		return {'hits': cls.hits,
+		        'misses': cls.misses,
+		        'size': len(cls.__statements)}
+	getStats = classmethod(getStats)
+
+	def flush(cls):
+		r"""
+		Discard all statement templates and reset the counters.
+		"""
+		cls.__statements.clear()
+		cls.hits = 0
+		cls.misses = 0
+	flush = classmethod(flush)
@@ -1,10 +1,17 @@
+import copy
 import math
 
 from display.html import *
 from structures.fp import fp
 from structures.disp import disp
+from structures.DeferredValues import DeferredValues
+from structures.LeanValues import LeanValues
+from structures.LookupCache import LookupCache
+from structures.Schema import Schema
+from structures.StatementCache import StatementCache
 
 import util.CursorWrapper
+from util.SQLDialect import SQLDialect
 
 class Structure:
 	r"""
@@ -94,6 +101,31 @@ class Structure:
 		self.dbMiscellaneous = ''
 	## public:
 
+	# The default number of rows dbLoad() fetches from the driver at a
+	# time. Subclasses which are typically loaded in large sets may
+	# raise it.
+	dbFetchSize = 100
+
+	# The default number of records dbSaveMany() saves per statement.
+	dbSaveBatchSize = 100
+
+	# The default number of records on a page from dbLoadPage().
+	dbPageSize = 50
+
+	# Fields of these database types are left out of the queries of
+	# dbLoad() and dbLoadPage() and loaded the first time they are read.
+	# No fields are deferred by default. Subclasses whose large fields
+	# are seldom read may opt in, e.g. with ('text', 'ntext', 'image').
+	dbDeferredTypes = ()
+
+	# The values of the record as last loaded from or saved to the
+	# database, or None if it has not been.
+	loadedValues = None
+
+	# The titles dbLoadLookups() found for the record, keyed on the
+	# lookup key (see getLookupKey()) and then on the value, or None.
+	lookupTitles = None
+
 	# START Utilty Methods Section
 
 	## protected:
@@ -113,6 +145,56 @@ class Structure:
 		assert len(self.fields) > 0, 'Zero fields were present.'
 	## public:
 
+	def getSchema(cls, env):
+		r"""
+		Get the compiled schema of this structure.
+
+		@param env An instance of the @em env class which keeps track
+		           of the current operational environment.
+
+		@return The Schema::Schema for this class and the provider
+		        configuration of @a env.
+		"""
+		return Schema.get(cls, env)
+	getSchema = classmethod(getSchema)
+
+	def newRecord(cls, env):
+		r"""
+		Create an empty record of this structure.
+
+		The record shares the compiled schema of its class instead of
+		building its own field properties. This is much cheaper than
+		calling the constructor and should be used whenever many
+		records are created.
+
+		@param env An instance of the @em env class which keeps track
+		           of the current operational environment.
+
+		@return A new record with no values.
+		"""
+		return Schema.get(cls, env).recordClass(env)
+	newRecord = classmethod(newRecord)
+
+	def privateField(self, fieldName):
+		r"""
+		Get a private copy of the properties of a field.
+
+		Records created by newRecord() share their field properties
+		with all other records of the same structure. This method
+		gives the record its own copy of @c allFields and of the
+		properties of @a fieldName so they may be modified without
+		affecting any other record.
+
+		@param fieldName The name of the field.
+
+		@return The record's own @em fp instance for @a fieldName.
+		"""
+		if not self.__dict__.has_key('allFields'):
+			self.allFields = self.allFields.copy()
+		field = copy.copy(self.allFields[fieldName])
+		self.allFields[fieldName] = field
+		return field
+
 	# END Utility Methods Section
 
 	# START Database Classes Section
@@ -152,62 +234,31 @@ class Structure:
 			 should be no surprise that they can't be.
 
 		@todo This needs support for linked servers.
-		@todo This needs to be broken up into dbDelete() and
-		      dbGenerateDeleteQuery().
 		"""
 
-		sql = 'DELETE FROM "' + self.dbTable + '" WHERE '
-		where = ''
-		args = []
-
-		PK = self.findPK()
-		for key in PK:
-			if (not self.values.has_key(key)) or \
-		           (self.allFields.dbIdentity and \
-		            self.values[key] == None \
-		           ) or \
-		           (self.values[key] != None and \
-			    (self.allFields[key].dbType == 'datetime' or \
-		             self.allFields[key].dbType == 'image' or \
-		             self.allFields[key].dbType == 'ntext' or \
-		             self.allFields[key].dbType == 'text' \
-		            ) \
-		           ):
-				PK.remove(key)
-
-		if len(PK) > 0:
-			fields = PK
-		else:
-			fields = self.fields
-
-		for key in fields:
-			if not self.values.has_key(key):
-				continue
-
-			if where != '':
-				where += ' AND '
-			where += '"' + self.allFields[key].dbName + '"'
-			if self.values[key] == None:
-				where += ' IS NULL'
-			else:
-				where += '=?'
-				args.append(self.values[key])
-
-		sql += where
+		(sql, args) = self.dbGenerateDeleteQuery()
 
 		util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
 		# XXX: This is a work-around for DBAPI 1.0 compatibility.
 		if hasattr(cur, 'commit'):
 			cur.commit()
 
+		LookupCache.invalidate(self.__class__)
+
 	def dbLoad(cls, env, con, query=None, where=None,
-	           orderBy=None, reverseSort=False, max=None):
+	           orderBy=None, reverseSort=False, max=None, lean=False,
+	           arraysize=None, fields=None, deferred=None):
 		r"""
 		Generate records from @a con based on @a query dictionary
 		and/or @a where condition.
 
 		This method is used to retrieve data from the database.
 
+		Deferred fields are not selected. Instead, the first time the
+		value of a deferred field of a record is read, the deferred
+		fields of that record and of the other records fetched in the
+		same batch of @a arraysize rows are loaded with one query.
+
 		@param env         An instance of the @em env class which keeps
 		                   track of the current operational
 		                   environment.
@@ -228,11 +279,27 @@ class Structure:
 		                   other words, it will be in descending order.
 		                   This is accomplished by using @c DESC in the
 		                   SQL query.
-		@param max         The maximum number of records to match. This
-		                   value will only be honored if using a DB-API
-		                   driver supports the @c rowcount attribute.
-		                   DB-API 1.0 drivers do not support the
-		                   @c rowcount attribute.
+		@param max         The maximum number of records to match. Only
+		                   @a max + 1 rows are requested from the
+		                   database, which is enough to tell if there
+		                   are more than @a max.
+		@param lean        If @c True, the records' values are kept in
+		                   a compact, tuple-backed LeanValues::LeanValues
+		                   instead of a dictionary. This saves memory on
+		                   large result sets.
+		@param arraysize   The number of rows to fetch from the driver
+		                   at a time. If @a arraysize is @c None, the
+		                   structure's @c dbFetchSize is used.
+		@param fields      A sequence of the fields to load. The
+		                   primary key fields are always loaded. Other
+		                   fields have no value in the records. If
+		                   @a fields is @c None, all fields are loaded.
+		@param deferred    A sequence of the fields to defer. If
+		                   @a deferred is @c None, the fields whose
+		                   @c dbType is in the structure's
+		                   @c dbDeferredTypes are deferred, unless
+		                   @a lean is @c True. By default, that is
+		                   none of them.
 
 		@return Generates instances of the class on which this method
 		        was called. Each instance will contain the data from
@@ -242,13 +309,12 @@ class Structure:
 		     the current configuration.
 		@pre @a max must be either @c None or an integer greater than
 		     zero.
+		@pre Fields can only be deferred if the structure has a
+		     primary key and @a lean is @c False.
 
 		@exception RuntimeError A @e RuntimeError will be thrown if
-		                        the number of records matched is known
-		                        and is greater than @a max.
+		                        more than @a max records are matched.
 
-		@todo Decide if @a con should be eliminated in favor of using
-		      @c con from @a env. If so, implement this functionality.
 		"""
 		try:
 			assert (max == None or int(max) > 0), \
@@ -256,35 +322,455 @@ class Structure:
 		except ValueError:
 			assert 0, 'max must be None or convertable to an int.'
 
-		instance = cls(env)
+		schema = cls.getSchema(env)
+
+		queryKeys = cls.dbGetQueryKeys(env, query)
+		(columns, deferred) = cls.dbGetLoadColumns(env, fields, deferred,
+		                                           lean)
+
+		if orderBy != None:
+			orderBy = tuple(orderBy)
+
+		top = None
+		if max != None:
+			max = int(max)
+			top = max + 1
+
+		key = ('load', schema.key, env.dbDialect, where, queryKeys,
+		       orderBy, bool(reverseSort), top, columns)
+		statement = StatementCache.get(key)
+		if statement == None:
+			statement = StatementCache.put(key,
+			  cls.dbGenerateLoadQuery(env, queryKeys, where, orderBy,
+			                          reverseSort, top, False,
+			                          columns))
+		(sql, plan) = statement
+		args = [query[x] for x in plan]
+
+		cur = con.cursor()
+		cls.dbExecute(env, cur, sql, args)
+		del sql
+		del args
+
+		for rec in cls.dbFetch(env, cur, max, arraysize, lean, columns,
+		                       deferred):
+			yield rec
 
-		if where == None:
-			where = []
+	dbLoad = classmethod(dbLoad)
+
+	def dbLoadPage(cls, env, con, query=None, where=None,
+	               orderBy=None, reverseSort=False, pageSize=None,
+	               pageToken=None, lean=False, fields=None,
+	               deferred=None):
+		r"""
+		Load one page of records from @a con.
+
+		The records are sorted by the @a orderBy fields followed by the
+		primary key fields, which makes the order unique. A page is
+		loaded with @c TOP and a seek predicate on those fields, so
+		only the rows of the page are read, no matter how deep into
+		the result set the page is.
+
+		@param env         An instance of the @em env class which keeps
+		                   track of the current operational
+		                   environment.
+		@param con         A DB-API connection to use to execute the
+		                   SQL query.
+		@param query       See dbLoad().
+		@param where       See dbLoad().
+		@param orderBy     See dbLoad().
+		@param reverseSort See dbLoad().
+		@param pageSize    The maximum number of records on the page.
+		                   If @a pageSize is @c None, the structure's
+		                   @c dbPageSize is used.
+		@param pageToken   The token of the page to load, as returned
+		                   by a previous call with the same @a query,
+		                   @a where, @a orderBy and @a reverseSort. If
+		                   @a pageToken is @c None, the first page is
+		                   loaded.
+		@param lean        See dbLoad().
+		@param fields      See dbLoad(). The sort fields are always
+		                   loaded.
+		@param deferred    See dbLoad(). The sort fields are never
+		                   deferred. The deferred fields of the page
+		                   are loaded with one query.
+
+		@return A two element tuple of a list of the records on the
+		        page and the token of the next page. The token is
+		        @c None if this is the last page.
+
+		@pre The structure must have a primary key or @a orderBy must
+		     not be empty.
+		@pre @a pageSize must be either @c None or an integer greater
+		     than zero.
+
+		@exception ValueError A @e ValueError will be thrown if
+		                      @a pageToken is not a valid page token.
+
+		@remarks Rows whose sort fields are @c NULL cannot be sought
+		         past. The sort fields should not allow @c NULL.
+		"""
+		if pageSize == None:
+			pageSize = cls.dbPageSize
+		try:
+			assert int(pageSize) > 0, \
+			       'pageSize must be greater than zero.'
+		except ValueError:
+			assert 0, 'pageSize must be None or convertable to an int.'
+		pageSize = int(pageSize)
+
+		schema = cls.getSchema(env)
+		instance = schema.recordClass(env)
+
+		queryKeys = cls.dbGetQueryKeys(env, query)
+
+		sortKeys = []
+		if orderBy != None:
+			sortKeys.extend(orderBy)
+		sortKeys.extend([x for x in instance.findPK()
+		                 if x not in sortKeys])
+		sortKeys = tuple(sortKeys)
+		assert len(sortKeys) > 0, \
+		       'A primary key or orderBy is required for paging.'
+
+		(columns, deferred) = cls.dbGetLoadColumns(env, fields, deferred,
+		                                           lean, sortKeys)
+
+		seekValues = None
+		if pageToken != None:
+			seekValues = cls.dbDecodePageToken(pageToken)
+			if len(seekValues) != len(sortKeys):
+				raise ValueError, \
+				      'The page token does not match the sort order.'
+
+		key = ('page', schema.key, env.dbDialect, where, queryKeys,
+		       sortKeys, bool(reverseSort), pageSize + 1,
+		       seekValues != None, columns)
+		statement = StatementCache.get(key)
+		if statement == None:
+			statement = StatementCache.put(key,
+			  cls.dbGenerateLoadQuery(env, queryKeys, where, sortKeys,
+			                          reverseSort, pageSize + 1,
+			                          seekValues != None, columns))
+		(sql, plan) = statement
+
+		args = []
+		for x in plan:
+			if type(x) == type(0):
+				args.append(seekValues[x])
+			else:
+				args.append(query[x])
+
+		cur = con.cursor()
+		cls.dbExecute(env, cur, sql, args)
+		records = list(cls.dbFetch(env, cur, None, pageSize + 1, lean,
+		                           columns, deferred))
+
+		nextPageToken = None
+		if len(records) > pageSize:
+			del records[pageSize:]
+			nextPageToken = cls.dbEncodePageToken(
+			  [records[-1].values[x] for x in sortKeys])
+
+		return (records, nextPageToken)
+	dbLoadPage = classmethod(dbLoadPage)
+
+	def dbLoadMatching(cls, env, con, fields, keys, lean=False,
+	                   arraysize=None):
+		r"""
+		Generate the records from @a con whose @a fields match any of
+		@a keys.
+
+		This loads the records related to many other records, such as
+		the children of a set of parent records, with one query per
+		2000 values instead of one query per key.
+
+		@param env       An instance of the @em env class which keeps
+		                 track of the current operational environment.
+		@param con       A DB-API connection to use to execute the SQL
+		                 query.
+		@param fields    A sequence of the fields to match.
+		@param keys      A sequence of tuples of values, one value per
+		                 field of @a fields.
+		@param lean      See dbLoad().
+		@param arraysize See dbLoad().
+
+		@return Generates instances of the class on which this method
+		        was called, in no particular order.
+
+		@pre The fields of @a fields must be present in the current
+		     configuration.
+		"""
+		schema = cls.getSchema(env)
+		fields = tuple(fields)
+		(columns, deferred) = cls.dbGetLoadColumns(env, None, None, lean)
+
+		# SQL Server accepts at most 2100 parameters per statement.
+		size = 2000 / len(fields)
+		for start in xrange(0, len(keys), size):
+			chunk = keys[start:start + size]
+
+			key = ('match', schema.key, env.dbDialect, fields,
+			       len(chunk), columns)
+			statement = StatementCache.get(key)
+			if statement == None:
+				if len(fields) == 1:
+					where = '[' + \
+					  schema.allFields[fields[0]].dbName + \
+					  '] IN (' + ','.join(['?'] * len(chunk)) + ')'
+				else:
+					where = '(' + ' AND '.join(['[' +
+					  schema.allFields[x].dbName + ']=?'
+					  for x in fields]) + ')'
+					where = ' OR '.join([where] * len(chunk))
+				statement = StatementCache.put(key,
+				  cls.dbGenerateLoadQuery(env, None, where, None,
+				                          False, None, False,
+				                          columns))
+			(sql, plan) = statement
+
+			args = []
+			for values in chunk:
+				args.extend(values)
+
+			cur = con.cursor()
+			cls.dbExecute(env, cur, sql, args)
+
+			for rec in cls.dbFetch(env, cur, None, arraysize, lean,
+			                       columns, deferred):
+				yield rec
+	dbLoadMatching = classmethod(dbLoadMatching)
+
+	def dbCount(cls, env, query=None, where=None):
+		r"""
+		Count the records matching @a query and/or @a where.
+
+		The records are counted by the database with @c COUNT(*), so
+		none of them are loaded.
+
+		@param env   An instance of the @em env class which keeps track
+		             of the current operational environment.
+		@param query See dbLoad().
+		@param where See dbLoad().
+
+		@return The number of records dbLoad() would generate for the
+		        same @a query and @a where.
+		"""
+		cur = cls.dbExecuteCount(env, query, where, False)
+		row = cur.fetchone()
+		cur.close()
+		return int(row[0])
+	dbCount = classmethod(dbCount)
+
+	def dbExists(cls, env, query=None, where=None):
+		r"""
+		Check if any record matches @a query and/or @a where.
+
+		This asks the database for at most one row, so it is cheaper
+		than dbCount() when the number of records does not matter.
+
+		@param env   An instance of the @em env class which keeps track
+		             of the current operational environment.
+		@param query See dbLoad().
+		@param where See dbLoad().
+
+		@return @c True if dbLoad() would generate at least one record
+		        for the same @a query and @a where.
+		"""
+		cur = cls.dbExecuteCount(env, query, where, True)
+		row = cur.fetchone()
+		cur.close()
+		return row != None
+	dbExists = classmethod(dbExists)
+
+	def dbEncodePageToken(values):
+		r"""
+		Encode the values of the sort fields of a row as a page token.
+
+		The token only contains characters which are safe in URLs and
+		form fields.
+
+		@param values A sequence of values.
+
+		@return The page token.
+		"""
+		import urllib
+
+		out = []
+		for x in values:
+			if x == None:
+				out.append('n')
+			elif isinstance(x, (int, long)):
+				out.append('i' + str(int(x)))
+			elif isinstance(x, float):
+				out.append('f' + repr(x))
+			elif isinstance(x, unicode):
+				out.append('u' + urllib.quote(x.encode('utf-8'), ''))
+			else:
+				out.append('s' + urllib.quote(str(x), ''))
+		return ','.join(out)
+	dbEncodePageToken = staticmethod(dbEncodePageToken)
+
+	def dbDecodePageToken(pageToken):
+		r"""
+		Decode a page token made by dbEncodePageToken().
+
+		@param pageToken The page token.
+
+		@return A list of values.
+
+		@exception ValueError A @e ValueError will be thrown if
+		                      @a pageToken is not a valid page token.
+		"""
+		import urllib
+
+		out = []
+		for x in str(pageToken).split(','):
+			if x == 'n':
+				out.append(None)
+			elif x[:1] == 'i':
+				out.append(int(x[1:]))
+			elif x[:1] == 'f':
+				out.append(float(x[1:]))
+			elif x[:1] == 'u':
+				out.append(unicode(urllib.unquote(x[1:]), 'utf-8'))
+			elif x[:1] == 's':
+				out.append(urllib.unquote(x[1:]))
+			else:
+				raise ValueError, 'Invalid page token.'
+		return out
+	dbDecodePageToken = staticmethod(dbDecodePageToken)
+
+	## protected:
+	def dbGetQueryKeys(cls, env, query):
+		r"""
+		Get the fields of @a query which can be matched.
+
+		@param env   An instance of the @em env class which keeps track
+		             of the current operational environment.
+		@param query A dictionary with fields as the keys, or @c None.
+
+		@return A sorted tuple of the fields of @a query which are
+		        present in the current configuration, or @c None if
+		        @a query is @c None.
+
+		@pre If @a query is not @c None, it must contain at least one
+		     field that is valid in the current configuration.
+		"""
+		if query == None:
+			return None
+
+		instance = cls.getSchema(env)
+		queryKeys = [x for x in query
+		             if instance.allFields.has_key(x) and
+		                instance.allFields[x].present]
+		queryKeys.sort()
+		assert len(queryKeys) > 0, \
+		       'No valid fields were present in query.' + \
+		       str(query) + ' ' + str(instance.allFields)
+		return tuple(queryKeys)
+	dbGetQueryKeys = classmethod(dbGetQueryKeys)
+
+	def dbExecute(cls, env, cur, sql, args):
+		r"""
+		Execute a query generated for this structure.
+
+		For structures stored on a linked server, the query is sent
+		through @c OPENQUERY with the arguments included in it.
+
+		@param env  An instance of the @em env class which keeps track
+		            of the current operational environment.
+		@param cur  The DB-API cursor to use to execute the query.
+		@param sql  The SQL query, in the @c qmark parameter style.
+		@param args The arguments to the SQL query.
+		"""
+		instance = cls.getSchema(env).recordClass
+
+		if instance.dbLinkedServerName != None:
+			sql = util.CursorWrapper.CursorWrapper.convert(sql, args)
+			sql2 = []
+			sql2.append('SELECT * FROM OPENQUERY("')
+			sql2.append(str(instance.dbLinkedServerName))
+			sql2.append('", \'')
+			sql2.append(sql.replace("'", "''"))
+			sql2.append('\')')
+			cur.execute(''.join(sql2))
 		else:
-			where = [where]
+			util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
+	dbExecute = classmethod(dbExecute)
 
-		args  = []
-		if query != None:
-			for key in query:
-				if instance.allFields.has_key(key) and \
-				   instance.allFields[key].present:
-					if where != []:
-						where.append(' AND ')
-					where.append('[')
-					where.append(instance.allFields[key].dbName)
-					where.append(']')
-					where.append('=?')
-					args.append(query[key])
-			assert len(args) > 0, \
-			       'No valid fields were present in query.' + \
-			       str(query) + ' ' + str(instance.allFields.has_key(key)) + ' ' + \
-			       str(instance.allFields)
+	def dbGenerateLimit(env, count):
+		r"""
+		Generate the SQL which limits a @c SELECT to @a count rows.
+
+		SQL Server uses @c TOP after @c SELECT. Other databases may
+		differ. (See util::SQLDialect::SQLDialect.)
+
+		@param env   An instance of the @em env class which keeps track
+		             of the current operational environment.
+		@param count The maximum number of rows, or @c None.
+
+		@return A two element tuple of the SQL to put after @c SELECT
+		        (and @c DISTINCT) and the SQL to put at the end of the
+		        query.
+		"""
+		return SQLDialect.get(env.dbDialect).generateLimit(count)
+	dbGenerateLimit = staticmethod(dbGenerateLimit)
+
+	def dbGenerateLoadQuery(cls, env, queryKeys=None, where=None,
+	                        orderBy=None, reverseSort=False, top=None,
+	                        seek=False, columns=None):
+		r"""
+		Generate the @c SELECT statement template used by dbLoad() and
+		dbLoadPage().
+
+		@param env         An instance of the @em env class which keeps
+		                   track of the current operational
+		                   environment.
+		@param queryKeys   A sequence of the fields to match, or
+		                   @c None.
+		@param where       A @c WHERE clause to apply to the query.
+		@param orderBy     A sequence of fields to sort by.
+		@param reverseSort If @c True, the sort will be in descending
+		                   order.
+		@param top         The maximum number of rows to return, or
+		                   @c None.
+		@param seek        If @c True, only rows which sort after a
+		                   given row are matched. The values of the
+		                   given row's @a orderBy fields are arguments.
+		@param columns     A sequence of the fields to select, or
+		                   @c None to select all fields.
+
+		@return A two element tuple of the SQL query and the
+		        argument-extraction plan: a list of the fields whose
+		        values are the arguments, in placeholder order. For a
+		        @a seek, the plan also holds integers, which are the
+		        indexes in @a orderBy of the given row's values.
+		"""
+		instance = cls.getSchema(env)
+
+		(where, plan) = cls.dbGenerateWhere(env, queryKeys, where)
+
+		if seek:
+			if where != []:
+				where.append(' AND ')
+			where.append(cls.dbGenerateSeek(reverseSort,
+			  ['[' + instance.allFields[x].dbName + ']'
+			   for x in orderBy]))
+			plan.extend(cls.dbGenerateSeekPlan(len(orderBy)))
+
+		(topSql, limitSql) = cls.dbGenerateLimit(env, top)
+
+		if columns == None:
+			columns = instance.fields
 
 		sql = []
-		sql.append('SELECT [')
+		sql.append('SELECT ')
+		sql.append(topSql)
+		sql.append('[')
 		sql.append('],['.join( \
 		       [instance.allFields[x].dbName \
-			for x in instance.fields]))
+			for x in columns]))
 		sql.append(']')
 
 		sql.append(' FROM [')
@@ -294,118 +780,768 @@ class Structure:
 		if len(where) > 0:
 			sql.append(' WHERE ')
 			sql.extend(where)
-			where = None
 
 		if orderBy != None and len(orderBy) > 0:
-			sql.append(' ORDER BY [')
-			sql.append('],['.join( \
-			       [instance.allFields[x].dbName \
-				for x in orderBy]))
-			sql.append(']')
 			if reverseSort:
-				sql.append(' DESC')
+				direction = '] DESC'
+			else:
+				direction = ']'
+			sql.append(' ORDER BY ')
+			sql.append(','.join(['[' + instance.allFields[x].dbName +
+			                     direction for x in orderBy]))
+
+		sql.append(limitSql)
+
+		return (''.join(sql), plan)
+	dbGenerateLoadQuery = classmethod(dbGenerateLoadQuery)
+
+	def dbGenerateSeek(reverseSort, columns):
+		r"""
+		Generate the condition which matches the rows sorting after a
+		given row, for keyset paging.
+
+		@param reverseSort If @c True, the rows are sorted in
+		                   descending order.
+		@param columns     A sequence of the SQL expressions of the
+		                   sort fields, in sort order.
+
+		@return The condition. Its arguments are given by
+		        dbGenerateSeekPlan().
+		"""
+		if reverseSort:
+			operator = '<?'
+		else:
+			operator = '>?'
+
+		# (a > ?) OR (a = ? AND b > ?) OR ...
+		seekWhere = []
+		for i in xrange(len(columns)):
+			conditions = []
+			for j in xrange(i):
+				conditions.append(columns[j] + '=?')
+			conditions.append(columns[i] + operator)
+			seekWhere.append('(' + ' AND '.join(conditions) + ')')
+
+		return '(' + ' OR '.join(seekWhere) + ')'
+	dbGenerateSeek = staticmethod(dbGenerateSeek)
+
+	def dbGenerateSeekPlan(count):
+		r"""
+		Get the argument-extraction plan of dbGenerateSeek().
+
+		@param count The number of sort fields.
+
+		@return A list of the indexes of the sort fields whose values
+		        are the arguments, in placeholder order.
+		"""
+		plan = []
+		for i in xrange(count):
+			plan.extend(range(i + 1))
+		return plan
+	dbGenerateSeekPlan = staticmethod(dbGenerateSeekPlan)
+
+	def dbGetLoadColumns(cls, env, fields=None, deferred=None,
+	                     lean=False, required=()):
+		r"""
+		Get the fields to select and the fields to defer for dbLoad()
+		and dbLoadPage().
+
+		@param env      An instance of the @em env class which keeps
+		                track of the current operational environment.
+		@param fields   See dbLoad().
+		@param deferred See dbLoad().
+		@param lean     See dbLoad().
+		@param required A sequence of fields which must be selected,
+		                such as the sort fields of a page.
+
+		@return A two element tuple. The first element is a tuple of
+		        the fields to select, in the order of @c fields, or
+		        @c None if all of the fields are selected. The second
+		        element is a tuple of the fields to defer.
+		"""
+		schema = cls.getSchema(env)
+		allFields = schema.allFields
+
+		required = list(required)
+		required.extend([x for x in schema.fields
+		                 if allFields[x].dbPrimaryKey])
+
+		if deferred == None:
+			if lean or len(required) == 0:
+				deferred = ()
+			else:
+				deferred = [x for x in schema.fields
+				            if allFields[x].dbType in cls.dbDeferredTypes]
+		elif len(deferred) > 0:
+			assert not lean, 'Fields cannot be deferred for lean records.'
+			assert len(required) > 0, \
+			       'A primary key is required to defer fields.'
+
+		deferred = tuple([x for x in schema.fields
+		                  if x in deferred and x not in required and
+		                     (fields == None or x in fields)])
+		columns = tuple([x for x in schema.fields
+		                 if (fields == None or x in fields or
+		                     x in required) and x not in deferred])
+
+		if len(columns) == len(schema.fields):
+			columns = None
+		return (columns, deferred)
+	dbGetLoadColumns = classmethod(dbGetLoadColumns)
+
+	def dbGetDeferredLoader(cls, env, records, deferred):
+		r"""
+		Get the function which loads the deferred fields of a batch of
+		records.
+
+		@param env      An instance of the @em env class which keeps
+		                track of the current operational environment.
+		@param records  The list of records of the batch. Records may
+		                be appended to it until the function is called.
+		@param deferred A sequence of the deferred fields.
+
+		@return A function, taking no arguments, which calls
+		        dbLoadDeferred().
+		"""
+		return lambda: cls.dbLoadDeferred(env, records, deferred)
+	dbGetDeferredLoader = classmethod(dbGetDeferredLoader)
+
+	def dbLoadDeferred(cls, env, records, deferred):
+		r"""
+		Load the deferred fields of a batch of records.
+
+		The records whose deferred fields have not been loaded are
+		matched by their primary key, @c IN a list when the key is a
+		single field. A value which was set on a record before its
+		deferred fields were loaded is kept, but the loaded value is
+		remembered as the value in the database.
+
+		@param env      An instance of the @em env class which keeps
+		                track of the current operational environment.
+		@param records  The records, whose @c values must be
+		                DeferredValues::DeferredValues.
+		@param deferred A sequence of the deferred fields.
+		"""
+		schema = cls.getSchema(env)
+		PK = tuple([x for x in schema.fields
+		            if schema.allFields[x].dbPrimaryKey])
+
+		pending = {}
+		for rec in records:
+			if rec.values.loader != None:
+				pending[tuple([rec.values[x] for x in PK])] = rec
+
+		# SQL Server accepts at most 2100 parameters per statement.
+		size = 2000 / len(PK)
+		keys = pending.keys()
+		for start in xrange(0, len(keys), size):
+			chunk = keys[start:start + size]
+
+			key = ('deferred', schema.key, env.dbDialect, deferred,
+			       len(chunk))
+			statement = StatementCache.get(key)
+			if statement == None:
+				statement = StatementCache.put(key,
+				  cls.dbGenerateDeferredQuery(env, deferred,
+				                              len(chunk)))
+			(sql, plan) = statement
+
+			args = []
+			for values in chunk:
+				args.extend(values)
+
+			cur = env.con.cursor()
+			cls.dbExecute(env, cur, sql, args)
+			for row in util.CursorWrapper.CursorWrapper.fetch(cur,
+			                                                  len(chunk)):
+				values = []
+				for x, y in zip(PK + deferred, row):
+					# Strip Strings
+					if type(y) == type(''):
+						y = y.strip()
+
+						# Truncate Strings w/ a maxlength Property
+						if schema.allFields[x].maxlength:
+							y = y[:schema.allFields[x].maxlength]
+
+					values.append(y)
+
+				rec = pending.get(tuple(values[:len(PK)]))
+				if rec == None:
+					continue
+
+				for x, y in zip(deferred, values[len(PK):]):
+					if not dict.has_key(rec.values, x):
+						dict.__setitem__(rec.values, x, y)
+					if rec.loadedValues != None and \
+					   not rec.loadedValues.has_key(x):
+						rec.loadedValues[x] = y
+			cur.close()
+
+		# Rows which have been deleted since are left without values.
+		for rec in pending.values():
+			rec.values.loader = None
+	dbLoadDeferred = classmethod(dbLoadDeferred)
+
+	def dbGenerateDeferredQuery(cls, env, deferred, count):
+		r"""
+		Generate the statement template used by dbLoadDeferred().
+
+		@param env      An instance of the @em env class which keeps
+		                track of the current operational environment.
+		@param deferred A sequence of the deferred fields.
+		@param count    The number of records to match.
+
+		@return A two element tuple of the SQL query, which selects
+		        the primary key fields followed by the @a deferred
+		        fields, and the argument-extraction plan, which is
+		        @c None. The arguments are the primary key values of
+		        each record in turn.
+		"""
+		instance = cls.getSchema(env)
+		PK = [instance.allFields[x].dbName for x in instance.fields
+		      if instance.allFields[x].dbPrimaryKey]
+
+		sql = []
+		sql.append('SELECT [')
+		sql.append('],['.join(PK +
+		           [instance.allFields[x].dbName for x in deferred]))
+		sql.append('] FROM [')
+		sql.append(instance.dbTable)
+		sql.append('] WHERE ')
+
+		if len(PK) == 1:
+			sql.append('[')
+			sql.append(PK[0])
+			sql.append('] IN (')
+			sql.append(','.join(['?'] * count))
+			sql.append(')')
+		else:
+			condition = '(' + ' AND '.join(['[' + x + ']=?'
+			                                for x in PK]) + ')'
+			sql.append(' OR '.join([condition] * count))
+
+		return (''.join(sql), None)
+	dbGenerateDeferredQuery = classmethod(dbGenerateDeferredQuery)
+
+	def dbExecuteCount(cls, env, query, where, exists):
+		r"""
+		Execute the query used by dbCount() or dbExists().
+
+		@param env    An instance of the @em env class which keeps
+		              track of the current operational environment.
+		@param query  See dbLoad().
+		@param where  See dbLoad().
+		@param exists If @c True, the query for dbExists() is executed.
+
+		@return The DB-API cursor which executed the query.
+		"""
+		schema = cls.getSchema(env)
+		queryKeys = cls.dbGetQueryKeys(env, query)
+
+		if exists:
+			operation = 'exists'
+		else:
+			operation = 'count'
+
+		key = (operation, schema.key, env.dbDialect, where, queryKeys)
+		statement = StatementCache.get(key)
+		if statement == None:
+			statement = StatementCache.put(key,
+			  cls.dbGenerateCountQuery(env, queryKeys, where, exists))
+		(sql, plan) = statement
 
 		cur = env.con.cursor()
-		if instance.dbLinkedServerName != None:
-			sql = util.CursorWrapper.CursorWrapper.convert(''.join(sql), args)
-			del args
-			sql2 = []
-			sql2.append('SELECT * FROM OPENQUERY("')
-			sql2.append(str(instance.dbLinkedServerName))
-			sql2.append('", \'')
-			sql2.append(sql.replace("'", "''"))
-			sql2.append('\')')
-			sql = ''.join(sql2)
-			del sql2
-			cur.execute(sql)
-			del sql
+		cls.dbExecute(env, cur, sql, [query[x] for x in plan])
+		return cur
+	dbExecuteCount = classmethod(dbExecuteCount)
+
+	def dbGenerateCountQuery(cls, env, queryKeys=None, where=None,
+	                         exists=False):
+		r"""
+		Generate the statement template used by dbCount() and
+		dbExists().
+
+		The conditions are generated by dbGenerateWhere(), exactly as
+		for dbLoad().
+
+		@param env       An instance of the @em env class which keeps
+		                 track of the current operational environment.
+		@param queryKeys A sequence of the fields to match, or @c None.
+		@param where     A @c WHERE clause to apply to the query.
+		@param exists    If @c True, the query selects @c 1 for at
+		                 most one matching row. Otherwise, it selects
+		                 the number of matching rows.
+
+		@return A two element tuple of the SQL query and the
+		        argument-extraction plan, as from
+		        dbGenerateLoadQuery().
+		"""
+		instance = cls.getSchema(env)
+
+		(where, plan) = cls.dbGenerateWhere(env, queryKeys, where)
+
+		sql = []
+		if exists:
+			(topSql, limitSql) = cls.dbGenerateLimit(env, 1)
+			sql.append('SELECT ')
+			sql.append(topSql)
+			sql.append('1')
 		else:
-			util.CursorWrapper.CursorWrapper.execute(cur, ''.join(sql), args)
-			del sql
-			del args
+			limitSql = ''
+			sql.append('SELECT COUNT(*)')
+
+		sql.append(' FROM [')
+		sql.append(instance.dbTable)
+		sql.append(']')
+
+		if len(where) > 0:
+			sql.append(' WHERE ')
+			sql.extend(where)
+
+		sql.append(limitSql)
+
+		return (''.join(sql), plan)
+	dbGenerateCountQuery = classmethod(dbGenerateCountQuery)
+
+	def dbGenerateCountOf(env, statement, exists=False):
+		r"""
+		Generate a dbGenerateCountQuery() statement template which
+		counts the rows of a @c SELECT statement.
+
+		Structures whose dbLoad() query is more than a single table use
+		this so that dbCount() and dbExists() match exactly the rows
+		dbLoad() would.
+
+		@param env       An instance of the @em env class which keeps
+		                 track of the current operational environment.
+		@param statement The statement template of the @c SELECT, as
+		                 from dbGenerateLoadQuery(). It must not have an
+		                 @c ORDER BY clause.
+		@param exists    See dbGenerateCountQuery().
+
+		@return A two element tuple of the SQL query and the
+		        argument-extraction plan.
+		"""
+		(sql, plan) = statement
+
+		if exists:
+			(topSql, limitSql) = Structure.dbGenerateLimit(env, 1)
+			sql = 'SELECT ' + topSql + '1 FROM (' + sql + ') AS "c"' + \
+			      limitSql
+		else:
+			sql = 'SELECT COUNT(*) FROM (' + sql + ') AS "c"'
+
+		return (sql, plan)
+	dbGenerateCountOf = staticmethod(dbGenerateCountOf)
+
+	def dbGenerateWhere(cls, env, queryKeys=None, where=None):
+		r"""
+		Generate the conditions of a @c WHERE clause.
+
+		@param env       An instance of the @em env class which keeps
+		                 track of the current operational environment.
+		@param queryKeys A sequence of the fields to match for
+		                 equality, or @c None.
+		@param where     A @c WHERE clause to apply first, or @c None.
+
+		@return A two element tuple of a list of strings making up the
+		        conditions (empty if there are none) and a list of the
+		        fields whose values are the arguments, in placeholder
+		        order.
+		"""
+		instance = cls.getSchema(env)
+
+		if where == None:
+			where = []
+		else:
+			where = ['(', where, ')']
+
+		plan = []
+		if queryKeys != None:
+			for key in queryKeys:
+				if where != []:
+					where.append(' AND ')
+				where.append('[')
+				where.append(instance.allFields[key].dbName)
+				where.append(']')
+				where.append('=?')
+				plan.append(key)
+
+		return (where, plan)
+	dbGenerateWhere = classmethod(dbGenerateWhere)
+
+	def dbFetch(cls, env, cur, max=None, arraysize=None, lean=False,
+	            columns=None, deferred=()):
+		r"""
+		Generate records from the result set of an executed query.
+
+		This is the fetch engine shared by all of the loaders. Rows are
+		fetched in batches by util::CursorWrapper::CursorWrapper::fetch()
+		and turned into records as they are generated, so memory use is
+		bounded by the batch size rather than the size of the result
+		set. The cursor is closed once the result set is exhausted.
+
+		@param env       An instance of the @em env class which keeps
+		                 track of the current operational environment.
+		@param cur       The DB-API cursor which executed the query.
+		                 The columns of the result set must be in the
+		                 order expected by dbLoadRecord().
+		@param max       The maximum number of records to match. The
+		                 query should return at most @a max + 1 rows.
+		@param arraysize The number of rows to fetch at a time. If
+		                 @a arraysize is @c None, the structure's
+		                 @c dbFetchSize is used.
+		@param lean      If @c True, lean records are generated. (See
+		                 dbLoad().)
+		@param columns   A sequence of the fields in the result set,
+		                 or @c None if it has all of the fields.
+		@param deferred  A sequence of the fields to load the first
+		                 time one is read. (See dbLoad().) They are
+		                 loaded for @a arraysize records at a time.
+
+		@return Generates instances of the class on which this method
+		        was called.
+
+		@exception RuntimeError A @e RuntimeError will be thrown if
+		                        more than @a max records are matched.
+		                        If the driver reports the number of
+		                        rows, it is thrown before any record is
+		                        generated.
+		"""
+		if arraysize == None:
+			arraysize = cls.dbFetchSize
+		if max != None:
+			arraysize = min(int(arraysize), max + 1)
+
+		schema = cls.getSchema(env)
+		recordClass = schema.recordClass
 
 		# XXX: This is a work-around for DBAPI 1.0 compatibility.
 		try:
 			rowcount = cur.rowcount
 			if (max != None and rowcount > max):
+				cur.close()
 				raise RuntimeError, 'A maximum ' + str(max) + \
 				      ' rows were requested but ' + \
 				      str(rowcount) + ' were found.'
 		except AttributeError:
 			pass
 
-		while 1:
-			try:
-				row = cur.fetchone()
-			except:
-				break
-			if row != None:
-				rec = cls(env)
-				rec.dbLoadRecord(row)
-				yield rec
+		if len(deferred) > 0:
+			deferredIndex = {}
+			for x in deferred:
+				deferredIndex[x] = True
+			batch = None
+
+		count = 0
+		for row in util.CursorWrapper.CursorWrapper.fetch(cur, arraysize):
+			count += 1
+			if max != None and count > max:
+				cur.close()
+				raise RuntimeError, 'A maximum ' + str(max) + \
+				      ' rows were requested but more were found.'
+
+			if lean:
+				rec = schema.newLeanRecord(env, row, columns)
 			else:
-				break
+				rec = recordClass(env)
+				if len(deferred) > 0:
+					if batch == None or len(batch) >= arraysize:
+						batch = []
+						loader = cls.dbGetDeferredLoader(env, batch,
+						                                 deferred)
+					rec.values = DeferredValues(deferredIndex, loader)
+					batch.append(rec)
+				if columns == None:
+					rec.dbLoadRecord(row)
+				else:
+					rec.dbLoadRecord(row, columns)
+			yield rec
 
 		cur.close()
+	dbFetch = classmethod(dbFetch)
 
-	dbLoad = classmethod(dbLoad)
-
-	## protected:
-	def dbLoadRecord(self, row):
+	def dbLoadRecord(self, row, columns=None):
 		r"""
 		Load fields from a database row.
 
 		This method takes a database @a row and loads the fields into
 		the @c values variable.
 
-		@param row The database row as a tuple of fields.
-		"""
-		for x, y in zip(self.fields, row):
+		@param row     The database row as a tuple of fields.
+		@param columns A sequence of the fields in @a row, or @c None
+		               if it has all of the fields.
+		"""
+		if columns == None:
+			columns = self.fields
+
+		for x, y in zip(columns, row):
+
+			# Strip Strings
+			if type(y) == type(''):
+				y = y.strip()
+
+				# Truncate Strings w/ a maxlength Property
+				if self.allFields[x].maxlength:
+					y = y[:self.allFields[x].maxlength]
+
+			# Store the Value
+			self.values[x] = y
+
+		self.dbMarkSaved()
+
+	def dbMarkSaved(self):
+		r"""
+		Remember the current values as the values in the database.
+
+		Afterwards, only fields whose values change are saved. See
+		dbGetChangedFields().
+		"""
+		# Records created from a schema usually have a value for every
+		# field, which can be kept more compactly as a tuple.
+		schema = getattr(self, 'schema', None)
+		if schema != None and len(self.values) == len(schema.fields):
+			try:
+				self.loadedValues = LeanValues(schema.fieldIndex,
+				  tuple([self.values[x] for x in schema.fields]))
+				return
+			except KeyError:
+				pass
+		self.loadedValues = self.values.copy()
+
+	def dbGetChangedFields(self):
+		r"""
+		Get the fields whose values need to be saved.
+
+		For a record loaded from the database, these are the fields
+		whose values differ from the loaded values. For any other
+		record, these are all of the fields which have a value.
+
+		@return A list of field names in the order of @c fields.
+		"""
+		# Deferred fields which have not been loaded are unchanged.
+		values = self.values
+		if isinstance(values, DeferredValues):
+			values = values.copy()
+
+		if self.loadedValues == None:
+			return [x for x in self.fields if values.has_key(x)]
+
+		return [x for x in self.fields
+		        if values.has_key(x) and
+		           ((not self.loadedValues.has_key(x)) or
+		            self.loadedValues[x] != values[x])]
+
+	def dbIsModified(self):
+		r"""
+		Check if saving the record would change the database.
+
+		@return @c False if the record was loaded from the database
+		        and none of the fields it saves have changed since.
+		        Otherwise, @c True.
+		"""
+		if self.loadedValues == None:
+			return True
+
+		for x in self.dbGetChangedFields():
+			if not self.allFields[x].dbIdentity:
+				return True
+		return False
+	## public:
+
+	def dbSave(self, env):
+		r"""
+		Save the record to the database.
+
+		If the record has values for one or more primary key fields, it
+		is assumed that the record already exists in the database and
+		an @c UPDATE should be performed. Otherwise, an @c INSERT is
+		performed.
+
+		If the record was loaded from the database, only the fields
+		which have changed are saved. If none have, nothing is done.
+
+		The record is saved by dbSaveMany(), so it is committed, and an
+		inserted record gets its @c IDENTITY value, the same way.
+
+		@param env An instance of the @em env class which keeps track
+		           of the current operational environment.
+		"""
+		assert self.dbGenerateSaveQuery(env) != None, \
+		  'If dbGenerateSaveQuery() is overridden to return None, dbSave() must be overridden as well.'
+		self.__class__.dbSaveMany(env, [self])
+
+	def dbSaveMany(cls, env, records, batchSize=None):
+		r"""
+		Save many records to the database in one transaction.
+
+		The records are grouped by operation and the fields they save,
+		as dbSave() would save them. Records which are not modified
+		(see dbIsModified()) are skipped. Each group of new records is
+		inserted with multi-row @c INSERT statements of up to
+		@a batchSize records. Each group of existing records is
+		updated with set-based @c UPDATE statements of up to
+		@a batchSize records, which join the table to the new values
+		on the primary key. (See dbGenerateSaveTemplate().) Either way,
+		a batch is one round trip to the database. The groups are saved
+		in the order their first record appears in @a records.
+
+		The @c INSERT of a structure with an @c IDENTITY field returns
+		the values given to the new rows. Once the transaction is
+		committed, they are stored in the records, so that saving them
+		again updates the rows instead of inserting new ones.
+
+		Records whose class overrides dbGenerateSaveQuery() are saved
+		with their own query in the same transaction, or with their
+		dbSave() if that query is @c None.
+
+		If any statement fails, the transaction is rolled back and the
+		exception is raised again.
+
+		@param env       An instance of the @em env class which keeps
+		                 track of the current operational environment.
+		@param records   An iterable of records to save.
+		@param batchSize The number of records to save per statement.
+		                 If @a batchSize is @c None, the structure's
+		                 @c dbSaveBatchSize is used. A multi-row
+		                 @c INSERT is further limited to 1000 rows,
+		                 and any statement to 2100 parameters, as SQL
+		                 Server requires.
+
+		@pre @a batchSize must be either @c None or an integer greater
+		     than zero.
+
+		@exception RuntimeError A @e RuntimeError will be thrown, and
+		                        the transaction rolled back, if an
+		                        @c UPDATE matches fewer rows than it
+		                        saves records, as when a record's row
+		                        was deleted. This is only checked if
+		                        the driver reports the number of rows.
+		"""
+		if batchSize == None:
+			batchSize = cls.dbSaveBatchSize
+		try:
+			assert int(batchSize) > 0, \
+			       'batchSize must be greater than zero.'
+		except ValueError:
+			assert 0, 'batchSize must be None or convertable to an int.'
+		batchSize = int(batchSize)
+
+		groups = {}
+		order = []
+		others = []
+		saved = []
+		identities = []
+		for record in records:
+			if not record.dbIsModified():
+				continue
+			saved.append(record)
+
+			if record.__class__.dbGenerateSaveQuery.im_func is not \
+			   Structure.dbGenerateSaveQuery.im_func:
+				others.append(record)
+				continue
+
+			(key, columns, PK) = record.dbGetSaveShape(env)
+			if groups.has_key(key):
+				groups[key][2].append(record)
+			else:
+				groups[key] = (columns, PK, [record])
+				order.append(key)
+
+		cur = env.con.cursor()
+		try:
+			for key in order:
+				(columns, PK, group) = groups[key]
+
+				# The arguments of each record: its values and
+				# the values of its non-NULL primary key fields.
+				width = len(columns) + \
+				        len([x for x in PK if not x[1]])
+				if len(PK) == 0:
+					rows = min(batchSize, 1000,
+					           2100 / max(width, 1))
+				else:
+					rows = min(batchSize, 2100 / max(width, 1))
+
+				for i in xrange(0, len(group), rows):
+					batch = group[i:i + rows]
+					(sql, plan) = batch[0].dbGetSaveTemplate(env,
+					  key, columns, PK, len(batch))
+					args = []
+					for x in batch:
+						args.extend(x.dbGetSaveArgs(columns, plan))
+					util.CursorWrapper.CursorWrapper.execute(
+					  cur, sql, args)
+					if len(PK) == 0:
+						identities.extend(
+						  cls.dbFetchIdentities(cur, batch))
+					elif getattr(cur, 'rowcount', -1) not in \
+					     (-1, None) and cur.rowcount < len(batch):
+						raise RuntimeError, 'An UPDATE of ' + \
+						  str(len(batch)) + ' records of ' + \
+						  batch[0].dbTable + ' matched ' + \
+						  str(cur.rowcount) + ' rows.'
+
+			for record in others:
+				queryComponents = record.dbGenerateSaveQuery(env)
+				if queryComponents == None:
+					record.dbSave(env)
+				else:
+					(sql, args) = queryComponents
+					util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
+		except:
+			if hasattr(env.con, 'rollback'):
+				env.con.rollback()
+			cur.close()
+			raise
+
+		cur.close()
+		env.con.commit()
 
-			# Strip Strings
-			if type(y) == type(''):
-				y = y.strip()
+		for (record, identity, value) in identities:
+			record.values[identity] = value
 
-				# Truncate Strings w/ a maxlength Property
-				if self.allFields[x].maxlength:
-					y = y[:self.allFields[x].maxlength]
+		classes = {}
+		for record in saved:
+			record.dbMarkSaved()
+			classes[record.__class__] = True
 
-			# Store the Value
-			self.values[x] = y
-	## public:
+		for x in classes:
+			LookupCache.invalidate(x)
+	dbSaveMany = classmethod(dbSaveMany)
 
-	def dbSave(self, env):
+	## protected:
+	def dbFetchIdentities(cls, cur, records):
 		r"""
-		Save the record to the database.
-
-		If the record has values for one or more primary key fields, it
-		is assumed that the record already exists in the database and
-		an @c UPDATE should be performed. Otherwise, an @c INSERT is
-		performed.
-
-		@param env An instance of the @em env class which keeps track
-		           of the current operational environment.
-		"""
+		Fetch the @c IDENTITY values returned by an @c INSERT from
+		dbGenerateSaveTemplate().
 
-		queryComponents = self.dbGenerateSaveQuery(env)
-		assert queryComponents != None, \
-		  'If dbGenerateSaveQuery() is overridden to return None, dbSave() must be overridden as well.'
-		(sql, args) = queryComponents
+		One @c INSERT gives its rows increasing @c IDENTITY values in
+		the order of their @c VALUES, but the database need not return
+		them in that order, so they are sorted first.
 
-		# TEMP: Debugging Code
-		debug = 'SQL String is: ' + sql + ', ' + str(args)
-		if env.req:
-			env.req.write(debug)
-		else:
-			print debug
+		@param cur     The cursor which executed the @c INSERT.
+		@param records The records inserted, in the order of their
+		               @c VALUES.
 
-		#cur = env.con.cursor()
-		#util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
-		# XXX: This is a work-around for DBAPI 1.0 compatibility.
-		#if hasattr(cur, 'commit'):
-		#	cur.commit()
+		@return A list of three element tuples of a record, its
+		        @c IDENTITY field and the field's new value. It is
+		        empty if the structure has no @c IDENTITY field.
+		"""
+		identity = records[0].dbFindIdentity()
+		if identity == None:
+			return []
+
+		values = [x[0] for x in cur.fetchall()]
+		assert len(values) == len(records), \
+		  'The INSERT returned %d IDENTITY values for %d records.' % \
+		  (len(values), len(records))
+		values.sort()
+		return [(x, identity, y) for x, y in zip(records, values)]
+	dbFetchIdentities = classmethod(dbFetchIdentities)
 
-	## protected:
 	def dbGenerateSaveQuery(self, env):
 		r"""
 		Generates a query used to save a record to the database.
@@ -426,72 +1562,201 @@ class Structure:
 		        not use SQL. In such a case, the dbSave() method must
 		        be called directly.
 
+		@pre The record must have a value to save. For a record loaded
+		     from the database, dbIsModified() must be @c True.
+
 		@todo This needs support for linked servers.
 		@todo Extend this method so that inserts can be done when
 		      a value exist for a primary key. This will allow
 		      @c INSERTs to be done for tables with primary keys that
 		      are not @c IDENTITY columns.
 		"""
-		mode = 'insert'
+		(key, columns, PK) = self.dbGetSaveShape(env)
+		assert len(columns) > 0, \
+		  'There is nothing to save. Check dbIsModified() first.'
+		(sql, plan) = self.dbGetSaveTemplate(env, key, columns, PK)
+		return (sql, self.dbGetSaveArgs(columns, plan))
 
+	def dbGetSaveShape(self, env):
+		r"""
+		Get the shape of the statement which saves the record.
+
+		Records with the same shape are saved by the same statement
+		template.
+
+		@param env An instance of the @em env class which keeps track
+		           of the current operational environment.
+
+		@return A three element tuple of the statement cache key, the
+		        fields to save, and the primary key fields identifying
+		        the record as described in dbGenerateSaveTemplate().
+		"""
+		# The primary key fields which identify the record, and
+		# whether each of them is NULL.
+		PK = tuple([(key, self.dbGetKeyValue(key) == None)
+		            for key in self.dbFindComparablePK()])
+
+		# An UPDATE only sets the fields which have changed.
+		if len(PK) > 0:
+			columns = self.dbGetChangedFields()
+		else:
+			columns = [x for x in self.fields
+			           if self.values.has_key(x)]
+		columns = tuple([x for x in columns
+		                 if not self.allFields[x].dbIdentity])
+
+		return (('save', self.getSchema(env).key, env.dbDialect,
+		         columns, PK), columns, PK)
+
+	def dbGetSaveTemplate(self, env, key, columns, PK, rows=1):
+		r"""
+		Get a statement template from the StatementCache, generating
+		it with dbGenerateSaveTemplate() if needed.
+
+		@param env     An instance of the @em env class which keeps
+		               track of the current operational environment.
+		@param key     The statement cache key from dbGetSaveShape().
+		@param columns The fields to save.
+		@param PK      The primary key fields identifying the record.
+		@param rows    The number of records to insert or update.
+
+		@return A two element tuple of the SQL query and the
+		        argument-extraction plan.
+		"""
+		if rows != 1:
+			key = key + (rows,)
+		statement = StatementCache.get(key)
+		if statement == None:
+			statement = StatementCache.put(key,
+			  self.dbGenerateSaveTemplate(env, columns, PK, rows))
+		return statement
+
+	def dbGetSaveArgs(self, columns, plan):
+		r"""
+		Get the arguments of the statement which saves the record.
+
+		@param columns The fields to save.
+		@param plan    The primary key fields whose values follow the
+		               values of @a columns. (See dbGetKeyValue().)
+
+		@return A list of arguments.
+		"""
 		args = []
-		for x in self.fields:
-			if (not self.values.has_key(x)) or \
-			   self.allFields[x].dbIdentity:
-				continue
+		for x in columns:
 			if self.allFields[x].maxlength and \
 			   type(self.values[x]) == type(''):
 				args.append((self.values[x])[ \
 				  :self.allFields[x].maxlength])
 			else:
 				args.append(self.values[x])
+		for x in plan:
+			args.append(self.dbGetKeyValue(x))
+		return args
 
-		where = []
+	def dbGetKeyValue(self, key):
+		r"""
+		Get the value of a primary key field which identifies the
+		record's row.
 
-		PK = self.findPK()
+		If the field has changed since the record was loaded, the row
+		still has the loaded value, so that is the one used.
 
-		# We use list(PK) here because deleting keys from a list while
-		# looping over it causes incorrect results.
-		for key in list(PK):
-			if (not self.values.has_key(key)) or \
-		           (self.allFields[key].dbIdentity and \
-		            self.values[key] == None \
-		           ) or \
-		           (self.values[key] != None and \
-			    (self.allFields[key].dbType == 'datetime' or \
-		             self.allFields[key].dbType == 'image' or \
-		             self.allFields[key].dbType == 'ntext' or \
-		             self.allFields[key].dbType == 'text' \
-		            ) \
-		           ):
-				PK.remove(key)
-			
+		@param key The name of the primary key field.
+
+		@return The value.
+		"""
+		if self.loadedValues != None and self.loadedValues.has_key(key):
+			return self.loadedValues[key]
+		return self.values[key]
 
+	def dbGenerateSaveTemplate(self, env, columns, PK, rows=1):
+		r"""
+		Generate the statement template used by dbGenerateSaveQuery().
+
+		An @c INSERT returns the @c IDENTITY value of each row, if the
+		structure has an @c IDENTITY field. (See dbFetchIdentities().)
+
+		@param env     An instance of the @em env class which keeps
+		               track of the current operational environment.
+		@param columns The fields to save.
+		@param PK      A sequence of two element tuples of a primary
+		               key field identifying the record and whether
+		               its value is @c NULL. If it is empty, an
+		               @c INSERT is generated.
+		@param rows    The number of records the statement saves.
+		               The placeholders for each record's values
+		               follow those of the previous record. An
+		               @c UPDATE of more than one record selects the
+		               new values of each record, one @c SELECT per
+		               record joined by <tt>UNION ALL</tt>, and
+		               updates the rows whose primary key matches
+		               one of them. SQL Server and SQLite (3.33 and
+		               later) both accept this <tt>UPDATE ... FROM</tt>
+		               form.
+
+		@return A two element tuple of the SQL query and a list of the
+		        primary key fields whose values are the arguments
+		        following the values of @a columns.
+		"""
 		if len(PK) > 0:
 			mode = 'update'
+		else:
+			mode = 'insert'
 
-			for key in PK:
-				if where != []:
-					where.append(' AND ')
-				where.append('"')
-				where.append(self.allFields[key].dbName)
-				where.append('"')
+		where = []
+		plan = []
+		for (key, isNull) in PK:
+			if where != []:
+				where.append(' AND ')
+			where.append('"')
+			where.append(self.allFields[key].dbName)
+			where.append('"')
+
+			if isNull:
+				where.append(' IS NULL')
+			else:
+				where.append('=?')
+				plan.append(key)
 
-				if self.values[key] == None:
-					where.append(' IS NULL')
+		sql = []
+		if mode == 'update' and rows > 1:
+			# The new values are named by position, as a primary
+			# key field may be among the fields saved.
+			names = ['"c%d"' % i for i in xrange(len(columns))] + \
+			        ['"k%d"' % i for i in xrange(len(plan))]
+
+			joins = []
+			for (key, isNull) in PK:
+				if joins != []:
+					joins.append(' AND ')
+				joins.append('"')
+				joins.append(self.dbTable)
+				joins.append('"."')
+				joins.append(self.allFields[key].dbName)
+				if isNull:
+					joins.append('" IS NULL')
 				else:
-					where.append('=?')
-					args.append(self.values[key])
+					joins.append('"="v".')
+					joins.append(names[len(columns) + plan.index(key)])
 
-		sql = []
-		if mode == 'update':
+			sql.append('UPDATE "')
+			sql.append(self.dbTable)
+			sql.append('" SET ')
+			sql.append(','.join(['"' + self.allFields[x].dbName +
+			                     '"="v".' + y
+			                     for x, y in zip(columns, names)]))
+			sql.append(' FROM (SELECT ')
+			sql.append(','.join(['? AS ' + x for x in names]))
+			sql.extend([' UNION ALL SELECT ' +
+			            ','.join(['?' for x in names])] * (rows - 1))
+			sql.append(') "v" WHERE ')
+			sql.extend(joins)
+		elif mode == 'update':
 			sql.append('UPDATE "')
 			sql.append(self.dbTable)
 			sql.append('" SET "')
 			sql.append('"=?,"'.join([self.allFields[x].dbName \
-			      for x in self.fields \
-			      if (not self.allFields[x].dbIdentity) \
-			         and self.values.has_key(x)]))
+			      for x in columns]))
 			sql.append('"=? WHERE ')
 			sql.extend(where)
 		elif mode == 'insert':
@@ -499,19 +1764,118 @@ class Structure:
 			sql.append(self.dbTable)
 			sql.append('" ("')
 			sql.append('","'.join([self.allFields[x].dbName \
-			      for x in self.fields \
-			      if (not self.allFields[x].dbIdentity) \
-			         and self.values.has_key(x)]))
-			sql.append('") VALUES (')
-			sql.append(','.join(['?' \
-			      for x in self.fields \
-			      if (not self.allFields[x].dbIdentity) \
-			         and self.values.has_key(x)]))
-			sql.append(')')
+			      for x in columns]))
+			sql.append('") ')
+
+			identity = self.dbFindIdentity()
+			if identity != None:
+				(outputSql, returningSql) = SQLDialect.get(
+				  env.dbDialect).generateReturning(
+				  self.allFields[identity].dbName)
+			else:
+				(outputSql, returningSql) = ('', '')
+
+			sql.append(outputSql)
+			sql.append('VALUES ')
+			values = '(' + ','.join(['?' for x in columns]) + ')'
+			sql.append(','.join([values for x in xrange(rows)]))
+			sql.append(returningSql)
+
+		return (''.join(sql), plan)
+
+	def dbGenerateDeleteQuery(self):
+		r"""
+		Generates a query used to delete a record from the database.
+
+		The statement template is cached for records created from a
+		compiled Schema::Schema. See dbDelete() for how the record is
+		identified.
+
+		@return A two element tuple consisting of the SQL query and a
+		        list of arguments to the SQL query.
+		"""
+		PK = self.dbFindComparablePK()
+		if len(PK) > 0:
+			fields = PK
+		else:
+			fields = self.fields
+
+		# The fields to compare, and whether each of them is NULL.
+		fields = tuple([(x, self.values[x] == None) for x in fields
+		                if self.values.has_key(x)])
+
+		schema = getattr(self, 'schema', None)
+		statement = None
+		if schema != None:
+			key = ('delete', schema.key, fields)
+			statement = StatementCache.get(key)
+		if statement == None:
+			where = []
+			plan = []
+			for (x, isNull) in fields:
+				if where != []:
+					where.append(' AND ')
+				where.append('"')
+				where.append(self.allFields[x].dbName)
+				where.append('"')
+				if isNull:
+					where.append(' IS NULL')
+				else:
+					where.append('=?')
+					plan.append(x)
+
+			statement = ('DELETE FROM "' + self.dbTable +
+			             '" WHERE ' + ''.join(where), plan)
+			if schema != None:
+				StatementCache.put(key, statement)
+		(sql, plan) = statement
+
+		return (sql, [self.values[x] for x in plan])
+
+	def dbFindComparablePK(self):
+		r"""
+		Find the primary key(s) which can identify the record.
+
+		Primary key fields without a value, @c IDENTITY fields whose
+		value is @c NULL, and fields whose database type cannot be
+		compared (@c datetime, @c image, @c ntext and @c text) are
+		left out.
+
+		@return A list of field names.
+		"""
+		PK = self.findPK()
+
+		# We use list(PK) here because deleting keys from a list while
+		# looping over it causes incorrect results.
+		for key in list(PK):
+			if (not self.values.has_key(key)) or \
+		           (self.allFields[key].dbIdentity and \
+		            self.values[key] == None \
+		           ) or \
+		           (self.values[key] != None and \
+			    (self.allFields[key].dbType == 'datetime' or \
+		             self.allFields[key].dbType == 'image' or \
+		             self.allFields[key].dbType == 'ntext' or \
+		             self.allFields[key].dbType == 'text' \
+		            ) \
+		           ):
+				PK.remove(key)
 
-		return (''.join(sql), args)
+		return PK
 	## public:
 
+	def dbFindIdentity(self):
+		r"""
+		Find the @c IDENTITY field.
+
+		@return The field name, or @c None if no field has
+		        @c dbIdentity set in @c allFields.
+		"""
+		for x in self.fields:
+			if self.allFields[x].dbIdentity:
+				return x
+		return None
+
 	def findPK(self):
 		r"""
 		Find the primary key(s).
@@ -553,7 +1917,7 @@ class Structure:
 		except ValueError:
 			assert 0, 'max must be None or convertable to an int.'
 
-		instance = cls(env)
+		instance = cls.newRecord(env)
 		if env.fieldStorage.has_key(instance.formPrefix+'.count'):
 			count = int(env.fieldStorage[ \
 			        instance.formPrefix+'.count'])
@@ -601,7 +1965,8 @@ class Structure:
 			assert 0, 'max must be None or convertable to an int.'
 
 
-		instance = cls(env)
+		recordClass = cls.getSchema(env).recordClass
+		instance = recordClass(env)
 		if env.fieldStorage.has_key(instance.formPrefix+'.count'):
 			count = int(env.fieldStorage[instance.formPrefix + \
 			                             '.count'])
@@ -614,7 +1979,7 @@ class Structure:
 			      str(count) + ' were found.'
 
 		for i in range(count):
-			rec = cls(env)
+			rec = recordClass(env)
 			rec.formLoadRecord(env.fieldStorage, i, \
 			                   instance.formPrefix)
 			yield rec
@@ -716,7 +2081,7 @@ class Structure:
 
 		if  display.type == 'dbDropdown' or \
 		   (display.type == 'dbLookup' and not (editable and field.editable)):
-			instance = display.table(None)
+			instance = display.table.newRecord(None)
 			return instance.allFields[display.displayField].title
 
 		return field.title
@@ -756,129 +2121,32 @@ class Structure:
 
 		if display.type == 'dbDropdown':
 
-			instance = display.table(env)
-
-			sql = 'SELECT [' + instance.allFields[ \
-			                   display.displayField].dbName + \
-			      '],[' + instance.allFields[ \
-			              display.dataField].dbName + \
-			       '] FROM ' + instance.dbTable
-
-			if not editable and self.values.has_key(fieldName):
-				if display.query != None:
-					display.query[display.dataField] = \
-					  self.values[fieldName]
-				else:
-					display.query = { \
-					  display.dataField: \
-					    self.values[fieldName]}
-
-			where = display.where
-			if where == None:
-				where = ''
-
-			args  = []
-			if display.query != None:
-				for key in display.query:
-					if instance.allFields.has_key(key) \
-					   and instance.allFields[key].present:
-						if where != '':
-							where += ' AND '
-						where += '[' + \
-						  instance.allFields[ \
-						    key].dbName + ']=?'
-						args.append(display.query[key])
-				assert len(args) > 0, \
-				  'No fields were present in display.query.'
-
-			if where != '':
-				sql += ' WHERE ' + where
-
-			sql += ' ORDER BY [' + instance.allFields[ \
-			                       display.displayField].dbName + \
-			       '],[' + instance.allFields[ \
-			               display.dataField].dbName + ']'
-
-			cur = env.con.cursor()
-			util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
-			result = cur.fetchall()
-			cur.close()
+			(options, titles) = self.getLookupOptions(env, display)
 
 			if not editable:
 				if self.values.has_key(fieldName):
-					return [x[0] for x in result \
-					        if x[1] == self.values[ \
-					        fieldName]][0]
+					try:
+						return titles[self.values[fieldName]]
+					except KeyError:
+						return self.values[fieldName]
 				else:
 					return ''
 			else:
 				if self.values.has_key(fieldName):
 					return dropDown(name=formFieldName, \
-					               values=[x[1] \
-					               for x in result], \
-					               titles=[x[0] \
-					               for x in result], \
+					               options=options, \
 						       default=self.values[ \
 					               fieldName])
 				else:
 					return dropDown(name=formFieldName, \
-					               values=[x[1] \
-					               for x in result], \
-					               titles=[x[0] \
-					               for x in result])
+					               options=options)
 		elif display.type == 'dbLookup':
 
-			instance = display.table(env)
-
-			sql = 'SELECT TOP 1 [' + instance.allFields[ \
-			                   display.displayField].dbName + \
-			      '],[' + instance.allFields[ \
-			              display.dataField].dbName + \
-			       '] FROM ' + instance.dbTable
-
 			if (not self.values.has_key(fieldName)) or (editable and self.allFields[fieldName].editable):
 				return None
 
-			if display.query != None:
-				display.query[display.dataField] = \
-				  self.values[fieldName]
-			else:
-				display.query = { \
-				  display.dataField: \
-				    self.values[fieldName]}
-
-			where = display.where
-			if where == None:
-				where = ''
-
-			args  = []
-			if display.query != None:
-				for key in display.query:
-					if instance.allFields.has_key(key) \
-					   and instance.allFields[key].present:
-						if where != '':
-							where += ' AND '
-						where += '[' + \
-						  instance.allFields[ \
-						    key].dbName + ']=?'
-						args.append(display.query[key])
-				assert len(args) > 0, \
-				  'No fields were present in display.query.'
-
-			if where != '':
-				sql += ' WHERE ' + where
-
-			sql += ' ORDER BY [' + instance.allFields[ \
-			                       display.displayField].dbName + \
-			       '],[' + instance.allFields[ \
-			               display.dataField].dbName + ']'
-
-			cur = env.con.cursor()
-			util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
-			result = cur.fetchall()
-			cur.close()
-
-			return result[0][0]
+			return self.getLookupTitle(env, display,
+			                           self.values[fieldName])
 
 		elif display.type == 'staticDropdown':
 			if not editable:
@@ -916,6 +2184,234 @@ class Structure:
 			# assertions are disabled.
 			return ''
 
+	## protected:
+	def getLookupOptions(self, env, display):
+		r"""
+		Get the options of a @c dbDropdown.
+
+		The options are kept in the LookupCache::LookupCache, so the
+		referenced table is only queried once for all of the records
+		rendered.
+
+		@param env     An instance of the @em env class which keeps
+		               track of the current operational environment.
+		@param display The disp::disp of the field.
+
+		@return A two element tuple of the options, from
+		        dropDownOptions(), and a dictionary mapping each value
+		        to its title.
+		"""
+		key = self.getLookupKey(env, display, 'dbDropdown')
+		result = LookupCache.get(key)
+		if result != None:
+			return result
+
+		rows = self.dbLoadLookup(env, display, display.query)
+
+		# The first title of a value is the one which is shown.
+		titles = {}
+		for x in rows:
+			if not titles.has_key(x[1]):
+				titles[x[1]] = x[0]
+
+		return LookupCache.put(key, (dropDownOptions(
+		  values=[x[1] for x in rows], titles=[x[0] for x in rows]),
+		  titles))
+
+	def getLookupTitle(self, env, display, value):
+		r"""
+		Get the title of a value of a @c dbLookup.
+
+		The titles are kept in the LookupCache::LookupCache.
+
+		@param env     An instance of the @em env class which keeps
+		               track of the current operational environment.
+		@param display The disp::disp of the field.
+		@param value   The value to look up.
+
+		@return The title of @a value, or @a value itself if it is not
+		        found.
+		"""
+		key = self.getLookupKey(env, display, 'dbLookup')
+		if self.lookupTitles != None and \
+		   self.lookupTitles.has_key(key) and \
+		   self.lookupTitles[key].has_key(value):
+			return self.lookupTitles[key][value]
+
+		key = key + (value,)
+		result = LookupCache.get(key)
+		if result != None:
+			return result[0]
+
+		if display.query != None:
+			query = display.query.copy()
+		else:
+			query = {}
+		query[display.dataField] = value
+
+		rows = self.dbLoadLookup(env, display, query, 1)
+		if len(rows) > 0:
+			title = rows[0][0]
+		else:
+			title = value
+
+		# The title is wrapped so that a title of None is cached, too.
+		return LookupCache.put(key, (title,))[0]
+
+	def getLookupKey(self, env, display, *args):
+		r"""
+		Get the LookupCache::LookupCache key of a lookup.
+
+		@param env     An instance of the @em env class which keeps
+		               track of the current operational environment.
+		@param display The disp::disp of the field.
+		@param args    Anything else which determines the result.
+
+		@return A tuple of the Schema::Schema key of the looked-up
+		        structure, the properties of @a display which determine
+		        the result, and @a args.
+		"""
+		if display.query != None:
+			query = display.query.items()
+			query.sort()
+			query = tuple(query)
+		else:
+			query = None
+
+		return (display.table.getSchema(env).key, display.displayField,
+		        display.dataField, display.where, query) + args
+
+	def dbLoadLookups(self, env, structures, editable, arrangement):
+		r"""
+		Look up the titles of the @c dbLookup fields of many records.
+
+		Each @c dbLookup field which getDispElement() will look up is
+		resolved for all of @a structures with one query (per 2000
+		values) for the values which are not in the
+		LookupCache::LookupCache. The titles are put in the cache, and
+		all of them are kept in the @c lookupTitles of the records for
+		getLookupTitle() to find, so that they are found even if there
+		are more than the cache keeps.
+
+		@param env         An instance of the @em env class which keeps
+		                   track of the current operational
+		                   environment.
+		@param structures  A sequence of records of this structure.
+		@param editable    See getFormSet().
+		@param arrangement The arrangement of the forms.
+		"""
+		lookupTitles = {}
+		for fieldName in self.getPrintingFields(arrangement):
+			field = self.allFields[fieldName]
+			display = field.display
+			if not display or display.type != 'dbLookup' or \
+			   (editable and field.editable):
+				continue
+
+			key = self.getLookupKey(env, display, 'dbLookup')
+			found = lookupTitles.setdefault(key, {})
+
+			values = {}
+			for structure in structures:
+				if structure.values.has_key(fieldName):
+					value = structure.values[fieldName]
+					if values.has_key(value) or found.has_key(value):
+						continue
+					result = LookupCache.get(key + (value,))
+					if result != None:
+						found[value] = result[0]
+					else:
+						values[value] = True
+			values = values.keys()
+
+			for start in xrange(0, len(values), 2000):
+				chunk = values[start:start + 2000]
+
+				# The first title of a value is the one which is
+				# shown.
+				titles = {}
+				for (title, value) in self.dbLoadLookup(env, display,
+				                        display.query, values=chunk):
+					if type(value) == type(''):
+						value = value.strip()
+					if not titles.has_key(value):
+						titles[value] = title
+
+				for value in chunk:
+					found[value] = LookupCache.put(key + (value,),
+					  (titles.get(value, value),))[0]
+
+		for structure in structures:
+			structure.lookupTitles = lookupTitles
+
+	def dbLoadLookup(self, env, display, query, top=None, values=None):
+		r"""
+		Load the titles and values of a @c dbDropdown or @c dbLookup.
+
+		@param env     An instance of the @em env class which keeps
+		               track of the current operational environment.
+		@param display The disp::disp of the field.
+		@param query   A dictionary with fields of the looked-up
+		               structure as the keys and the values to match,
+		               or @c None.
+		@param top     The maximum number of rows to load, or @c None.
+		@param values  A sequence of the values to match, or @c None.
+
+		@return A list of rows of the title and the value, sorted by
+		        the title and then the value.
+		"""
+		instance = display.table.newRecord(env)
+
+		(topSql, limitSql) = self.dbGenerateLimit(env, top)
+
+		sql = 'SELECT ' + topSql + '[' + instance.allFields[ \
+		                   display.displayField].dbName + \
+		      '],[' + instance.allFields[ \
+		              display.dataField].dbName + \
+		       '] FROM ' + instance.dbTable
+
+		where = display.where
+		if where == None:
+			where = ''
+
+		args  = []
+		if query != None:
+			for key in query:
+				if instance.allFields.has_key(key) \
+				   and instance.allFields[key].present:
+					if where != '':
+						where += ' AND '
+					where += '[' + \
+					  instance.allFields[ \
+					    key].dbName + ']=?'
+					args.append(query[key])
+			assert len(args) > 0, \
+			  'No fields were present in display.query.'
+
+		if values != None:
+			if where != '':
+				where += ' AND '
+			where += '[' + instance.allFields[ \
+			                 display.dataField].dbName + \
+			         '] IN (' + ','.join(['?'] * len(values)) + ')'
+			args.extend(values)
+
+		if where != '':
+			sql += ' WHERE ' + where
+
+		sql += ' ORDER BY [' + instance.allFields[ \
+		                       display.displayField].dbName + \
+		       '],[' + instance.allFields[ \
+		               display.dataField].dbName + ']' + limitSql
+
+		cur = env.con.cursor()
+		util.CursorWrapper.CursorWrapper.execute(cur, sql, args)
+		result = cur.fetchall()
+		cur.close()
+
+		return result
+	## public:
+
 	def isPrintingField(self, fieldName, arrangement):
 		r"""
 		Does @a fieldName print in @a arrangement?
@@ -1070,31 +2566,57 @@ class Structure:
 		        titles, values, etc.
 		"""
 
+		out = []
+		structures[0].writeFormSet(env, structures, out.append, editable,
+		                           arrangement)
+		return ''.join(out)
+	getFormSet = staticmethod(getFormSet)
+
+	def writeFormSet(env, structures, write, editable=False,
+	                 arrangement=None):
+		r"""
+		Write a set of forms.
+
+		This writes the same HTML as getFormSet() returns, passing it to
+		@a write one form at a time.
+
+		@param env         An instance of the @em env class which keeps
+		                   track of the current operational
+		                   environment.
+		@param structures  An iterable variable of structures to write
+		                   a form set for.
+		@param write       A function which is given each piece of the
+		                   form set.
+		@param editable    See getFormSet().
+		@param arrangement See getFormSet().
+		"""
+
 		if not arrangement:
 			arrangement = structures[0].defaultFieldArrangement
 
-		out = []
+		if len(structures) > 1:
+			structures[0].dbLoadLookups(env, structures, editable,
+			                            arrangement)
+
 		count = 0
 
 		for structure in structures:
 			# XXX: This may be considered a kludge.
 			if arrangement == 'form' and count:
-				out.append(row(cell('<hr />')))
+				write(row(cell('<hr />')))
 
-			out.append(structure.getForm(env, editable, \
-			                           arrangement, index=count))
+			write(structure.getForm(env, editable, \
+			                        arrangement, index=count))
 			count = count + 1
 
 		if editable:
 			# XXX: This creates a two column row, which doesn't
 			# XXX: exactly right if we're building a form for the
 			# XXX: 'row' arrangement.
-			out.append(row(cell('') + cell(hiddenInput( \
-			                               structures[0].formPrefix \
-						       +'.count', count))))
-
-		return ''.join(out)
-	getFormSet = staticmethod(getFormSet)
+			write(row(cell('') + cell(hiddenInput( \
+			                          structures[0].formPrefix \
+			                          +'.count', count))))
+	writeFormSet = staticmethod(writeFormSet)
 
 	def getForm(self, env, editable, arrangement, index=None):
 		r"""
@@ -1343,6 +2865,34 @@ class Structure:
 	# START Form View Helper Methods
 
 	## protected:
+	def setCustomFormView(self, fieldName, customFormView):
+		r"""
+		Mark whether custom @c 'form' view code has shown a field.
+
+		The marks are kept by the record, not in the field properties,
+		which are shared with every other record of the structure.
+
+		@param fieldName      The name of the field.
+		@param customFormView A boolean indicating if the field has
+		                      been shown.
+		"""
+		if not self.__dict__.has_key('customFormViews'):
+			self.customFormViews = {}
+		self.customFormViews[fieldName] = customFormView
+
+	def hasCustomFormView(self, fieldName):
+		r"""
+		Check if custom @c 'form' view code has shown a field.
+
+		@param fieldName The name of the field.
+
+		@return The mark set by setCustomFormView(), or @c False if
+		        there is none.
+		"""
+		if not self.__dict__.has_key('customFormViews'):
+			return False
+		return self.customFormViews.get(fieldName, False)
+
 	def getDateAndUserRow(self, dateField, userField, env, editable, \
 	                      arrangement, index, autoSetCustomProperty=True):
 		r"""
@@ -1374,8 +2924,7 @@ class Structure:
 		                             to other forms for the same data
 		                             structure.
 		@param autoSetCustomProperty A boolean value that will be saved
-		                             as the field's @c customFormView
-		                             property. This allows subclasses
+		                             with setCustomFormView(). This allows subclasses
 		                             with custom 'form' views to tell
 		                             which fields have been handled by
 		                             the custom code. Then, they can
@@ -1390,10 +2939,8 @@ class Structure:
 		                             custom code is written.
 		"""
 
-		self.allFields[dateField].customFormView = \
-		  autoSetCustomProperty
-		self.allFields[userField].customFormView = \
-		  autoSetCustomProperty
+		self.setCustomFormView(dateField, autoSetCustomProperty)
+		self.setCustomFormView(userField, autoSetCustomProperty)
 
 		fieldHolderMethod = self.nullFieldHolder
 
@@ -1465,8 +3012,7 @@ class Structure:
 		                             to other forms for the same data
 		                             structure.
 		@param autoSetCustomProperty A boolean value that will be saved
-		                             as the field's @c customFormView
-		                             property. This allows subclasses
+		                             with setCustomFormView(). This allows subclasses
 		                             with custom 'form' views to tell
 		                             which fields have been handled by
 		                             the custom code. Then, they can
@@ -1481,7 +3027,7 @@ class Structure:
 		                             custom code is written.
 		"""
 
-		self.allFields[field].customFormView = autoSetCustomProperty
+		self.setCustomFormView(field, autoSetCustomProperty)
 		if self.isPrintingField(field, arrangement):
 			out = self.getFormFieldGuts(env, editable, field, \
 			                            arrangement, index)
@@ -1521,8 +3067,7 @@ class Structure:
 		                             to other forms for the same data
 		                             structure.
 		@param autoSetCustomProperty A boolean value that will be saved
-		                             as the field's @c customFormView
-		                             property. This allows subclasses
+		                             with setCustomFormView(). This allows subclasses
 		                             with custom 'form' views to tell
 		                             which fields have been handled by
 		                             the custom code. Then, they can
@@ -1540,8 +3085,7 @@ class Structure:
 		fieldHolderMethod = self.nullFieldHolder
 		out = []
 		for field in fields:
-			self.allFields[field].customFormView = \
-			  autoSetCustomProperty
+			self.setCustomFormView(field, autoSetCustomProperty)
 			if self.isPrintingField(field, arrangement):
 				out2 = self.getFormFieldGuts(env, editable, \
 				         field, arrangement, index, \
@@ -1607,8 +3151,7 @@ class Structure:
 		@param multiLine             If true, each item will be have
 		                             its own row in a sub-table.
 		@param autoSetCustomProperty A boolean value that will be saved
-		                             as the field's @c customFormView
-		                             property. This allows subclasses
+		                             with setCustomFormView(). This allows subclasses
 		                             with custom 'form' views to tell
 		                             which fields have been handled by
 		                             the custom code. Then, they can
@@ -1639,8 +3182,7 @@ class Structure:
 			else:
 				assert 0, "Invalid length item tuple."
 
-			self.allFields[field].customFormView = \
-			  autoSetCustomProperty
+			self.setCustomFormView(field, autoSetCustomProperty)
 
 			if itemLabel == None:
 				itemLabel = ''
@@ -1756,8 +3298,7 @@ class Structure:
 		@param columns               The number of columns to be used
 		                             when creating the block.
 		@param autoSetCustomProperty A boolean value that will be saved
-		                             as the field's @c customFormView
-		                             property. This allows subclasses
+		                             with setCustomFormView(). This allows subclasses
 		                             with custom 'form' views to tell
 		                             which fields have been handled by
 		                             the custom code. Then, they can
@@ -1779,8 +3320,7 @@ class Structure:
 		fieldHolderMethod = self.nullFieldHolder
 
 		for item in items:
-			self.allFields[item[0]].customFormView = \
-			  autoSetCustomProperty
+			self.setCustomFormView(item[0], autoSetCustomProperty)
 
 		items = [x for x in items
 		            if self.isPrintingField(x[0], arrangement)]
@@ -188,7 +188,7 @@ GO
 
 		return ''.join(out)
 
-	def dbLoadByDate(cls, env, con, date, max=None):
+	def dbLoadByDate(cls, env, con, date, max=None, arraysize=None):
 		"""
 		Generate records from @a con based on @a date.
 
@@ -204,6 +204,9 @@ GO
 		                   driver supports the @c rowcount attribute.
 		                   DB-API 1.0 drivers do not support the
 		                   @c rowcount attribute.
+		@param arraysize   The number of rows to fetch from the driver
+		                   at a time. If @a arraysize is @c None, the
+		                   structure's @c dbFetchSize is used.
 
 		@return Generates instances of the class on which this method
 		        was called. Each instance will contain the data from
@@ -226,8 +229,8 @@ GO
 			assert 0, 'max must be None or convertable to an int.'
 
 		from structures.TaskDate import TaskDate
-		taskInstance = Task(env)
-		taskDateInstance = TaskDate(env)
+		taskInstance = cls.newRecord(env)
+		taskDateInstance = TaskDate.newRecord(env)
 
 		args = []
 		args.append(date)
@@ -317,7 +320,7 @@ WHERE
 		# Handle Task Exceptions
 		if env.taskException:
 			from structures.TaskException import TaskException
-			taskExceptionInstance = TaskException(env)
+			taskExceptionInstance = TaskException.newRecord(env)
 
 			sql +=  """
 AND NOT EXISTS (
@@ -344,28 +347,7 @@ AND NOT EXISTS (
 		sql = None
 		args = None
 
-		# XXX: This is a work-around for DBAPI 1.0 compatibility.
-		try:
-			rowcount = cur.rowcount
-			if (max != None and rowcount > max):
-				raise RuntimeError, "A maximum " + str(max) + \
-				      " rows were requested but " + \
-				      str(rowcount) + " were found."
-		except AttributeError:
-			pass
-
-		while 1:
-			try:
-				row = cur.fetchone()
-			except:
-				break
-			if row != None:
-				rec = record(env)
-				rec.dbLoadRecord(row)
-				yield rec
-			else:
-				break
-
-		cur.close()
+		for rec in cls.dbFetch(env, cur, max, arraysize):
+			yield rec
 
 	dbLoadByDate = classmethod(dbLoadByDate)
@@ -281,7 +281,7 @@ class WirelessAccount(Structure):
 			                             arrangement, index)
 
 		for field in self.fieldOrder:
-			self.allFields[field].customFormView = False
+			self.setCustomFormView(field, False)
 
 		out = []
 
@@ -364,7 +364,7 @@ class WirelessAccount(Structure):
 		for field in self.fieldOrder:
 			if self.allFields[
 			     field].arrangements.count('form') > 0 \
-			   and not self.allFields[field].customFormView:
+			   and not self.hasCustomFormView(field):
 				out.append(self.getSingleItemRow(field, env,
 				  editable, arrangement, index,
 				  autoSetCustomProperty=0))
@@ -12,14 +12,12 @@ class fp:
 	accessor methods). While no code prevents the modification of these
 	variables or the storage of other variables, consumers of this class
 	are strongly discouraged from modifying any variables of this class.
-	One exception exists, however: The @c customFormView variable exists
-	for use by a subclass reimplementation of
-	Structure::Structure::getFormGuts().
-
-	This variable is intended for use as a temporary variable and consumers
-	of this class must not rely upon the state of this variable being
-	maintained between method calls or even that its state will suitably
-	initialized.
+	The properties are shared by every record of a structure. (A record
+	which needs to change them must use
+	Structure::Structure::privateField().) Subclass reimplementations
+	of Structure::Structure::getFormGuts() which track the fields they
+	have shown use Structure::Structure::setCustomFormView(), which
+	keeps the marks in the record.
 
 	@author Andy Filer \<andyf\@wiktel.com\>
 	@author Richard Laager \<rlaager\@wiktel.com\>
@@ -274,8 +272,6 @@ class fp:
 
 		self.arrangements = arrangements
 
-		self.customFormView = False
-
 		# Database Attributes
 		self.dbConstraint = dbConstraint
 
@@ -0,0 +1,47 @@
+class BufferedWriter(object):
+	r"""
+	Collects small pieces of output and passes them on in larger ones.
+
+	Pages are written out a record at a time as they are rendered, but
+	each write to the client (such as a mod_python @c req.write()) has a
+	cost of its own. A BufferedWriter holds on to the pieces written to
+	it until they add up to @c bufferSize characters, then passes them on
+	with a single write. At most @c bufferSize characters, plus the last
+	piece, are held at once.
+
+	flush() must be called once everything has been written.
+	"""
+
+	def __init__(self, write, bufferSize=16384):
+		r"""
+		@param write      The function to pass the output on to. It is
+		                  given one string.
+		@param bufferSize The number of characters to collect before
+		                  calling @a write.
+		"""
+		self.output = write
+		self.bufferSize = bufferSize
+
+		self.__pieces = []
+		self.__size = 0
+
+	def write(self, string):
+		r"""
+		Write a piece of output.
+
+		@param string The piece.
+		"""
+		self.__pieces.append(string)
+		self.__size += len(string)
+		if self.__size >= self.bufferSize:
+			self.flush()
+
+	def flush(self):
+		r"""
+		Pass on all of the output collected so far.
+		"""
+		if self.__pieces:
+			string = ''.join(self.__pieces)
+			self.__pieces = []
+			self.__size = 0
+			self.output(string)
@@ -0,0 +1,301 @@
+import threading
+import time
+
+class ConnectionPool(object):
+	r"""
+	Keeps database connections open for reuse.
+
+	Opening a connection to the database server takes a full network
+	handshake and login. A pool keeps the connections it has handed out
+	and been given back, so that later requests in the same process can
+	lease one of them instead. There is one pool per provider; see
+	get().
+
+	A connection is leased with acquire() and must be given back with
+	release() (or discard(), if it is broken) when the lease ends. At
+	most @c maxSize connections are leased at once; acquire() waits up
+	to @c timeout seconds for one to be given back. Idle connections
+	are closed after @c maxIdleTime seconds, and are checked with
+	@c healthCheck before being leased if they have been idle for more
+	than @c checkInterval seconds.
+
+	The pool is safe to use from several threads at once.
+	"""
+
+	__pools = {}
+	__poolsLock = threading.Lock()
+
+	## The maximum number of connections leased at once.
+	maxSize = 8
+
+	## The number of seconds acquire() waits for a connection.
+	timeout = 10
+
+	## The number of seconds an idle connection is kept open.
+	maxIdleTime = 300
+
+	## The number of seconds a connection may be idle before it is
+	## checked when leased.
+	checkInterval = 30
+
+	## The SQL query used to check a connection.
+	healthCheck = 'SELECT 1'
+
+	def __init__(self, connect):
+		r"""
+		@param connect A function, taking no arguments, which opens a
+		               new connection, or returns @c None if it
+		               cannot.
+		"""
+		self.connect = connect
+
+		# The condition's lock is reentrant, so the counters can be
+		# updated with __count() whether or not it is held.
+		self.__condition = threading.Condition()
+		# The idle connections as (time given back, connection)
+		# tuples, most recently given back last.
+		self.__idle = []
+		self.__inUse = 0
+
+		self.created = 0
+		self.closed = 0
+		self.checkouts = 0
+		self.failedChecks = 0
+		self.waits = 0
+		self.waitTime = 0.0
+
+	def get(cls, key, connect):
+		r"""
+		Get the pool of a provider.
+
+		@param key     The provider string.
+		@param connect See ConnectionPool(). It is only used if the
+		               pool does not exist yet. It should not hold a
+		               reference to an @em env.
+
+		@return The ConnectionPool for @a key.
+		"""
+		cls.__poolsLock.acquire()
+		try:
+			try:
+				return cls.__pools[key]
+			except KeyError:
+				pool = cls(connect)
+				cls.__pools[key] = pool
+				return pool
+		finally:
+			cls.__poolsLock.release()
+	get = classmethod(get)
+
+	def getAllStats(cls):
+		r"""
+		Get the statistics of every pool.
+
+		@return A dictionary of the getStats() of each pool, keyed on
+		        the provider string.
+		"""
+		out = {}
+		for key in cls.__pools.keys():
+			out[key] = cls.__pools[key].getStats()
+		return out
+	getAllStats = classmethod(getAllStats)
+
+	def acquire(self, timeout=None):
+		r"""
+		Lease a connection.
+
+		@param timeout The number of seconds to wait for a connection
+		               to be given back if @c maxSize are leased, or
+		               @c None to wait for @c timeout seconds.
+
+		@return A DB-API connection, or @c None if @c connect could not
+		        open one.
+
+		@exception RuntimeError A @e RuntimeError will be thrown if
+		                        no connection is given back in time.
+		"""
+		if timeout == None:
+			timeout = self.timeout
+
+		self.__condition.acquire()
+		try:
+			self.__evict()
+
+			start = None
+			while len(self.__idle) == 0 and self.__inUse >= self.maxSize:
+				now = time.time()
+				if start == None:
+					start = now
+					self.waits += 1
+				if now - start >= timeout:
+					self.waitTime += now - start
+					raise RuntimeError, 'No database connection was given back within ' + str(timeout) + ' seconds.'
+				self.__condition.wait(timeout - (now - start))
+
+			if start != None:
+				self.waitTime += time.time() - start
+
+			# The lease is counted now so that other threads do not
+			# open more than maxSize connections while this one is
+			# checking or opening its connection.
+			self.__inUse += 1
+			self.checkouts += 1
+			if len(self.__idle) > 0:
+				(released, con) = self.__idle.pop()
+			else:
+				con = None
+		finally:
+			self.__condition.release()
+
+		try:
+			if con != None and time.time() - released > self.checkInterval and not self.__check(con):
+				self.__count('failedChecks')
+				self.__close(con)
+				con = None
+
+			if con == None:
+				con = self.connect()
+				if con != None:
+					self.__count('created')
+		except:
+			self.__returnLease()
+			raise
+
+		if con == None:
+			self.__returnLease()
+		return con
+
+	def release(self, con):
+		r"""
+		Give back a leased connection.
+
+		Any open transaction is rolled back first. If that fails, the
+		connection is closed instead of being kept.
+
+		@param con The connection from acquire().
+		"""
+		try:
+			if hasattr(con, 'rollback'):
+				con.rollback()
+		except:
+			self.discard(con)
+			return
+
+		self.__condition.acquire()
+		try:
+			self.__inUse -= 1
+			self.__idle.append((time.time(), con))
+			self.__evict()
+			self.__condition.notify()
+		finally:
+			self.__condition.release()
+
+	def discard(self, con):
+		r"""
+		Close a leased connection which is broken instead of giving it
+		back.
+
+		@param con The connection from acquire().
+		"""
+		self.__close(con)
+		self.__returnLease()
+
+	def getStats(self):
+		r"""
+		Get the pool statistics.
+
+		@return A dictionary with the number of connections
+		        @c created, @c closed, @c inUse and @c idle, the number
+		        of @c checkouts, the number of leased connections which
+		        @c failedChecks, and the number of @c waits for a
+		        connection and their total @c waitTime in seconds.
+		"""
+		self.__condition.acquire()
+		try:
+			return {'created': self.created,
+			        'closed': self.closed,
+			        'inUse': self.__inUse,
+			        'idle': len(self.__idle),
+			        'checkouts': self.checkouts,
+			        'failedChecks': self.failedChecks,
+			        'waits': self.waits,
+			        'waitTime': self.waitTime}
+		finally:
+			self.__condition.release()
+
+	def flush(self):
+		r"""
+		Close all of the idle connections.
+		"""
+		self.__condition.acquire()
+		try:
+			idle = self.__idle
+			self.__idle = []
+		finally:
+			self.__condition.release()
+
+		for (released, con) in idle:
+			self.__close(con)
+
+	## protected:
+	def __evict(self):
+		r"""
+		Close the connections which have been idle for too long.
+
+		@pre The caller must hold the pool's lock.
+		"""
+		expired = time.time() - self.maxIdleTime
+		while len(self.__idle) > 0 and self.__idle[0][0] < expired:
+			self.__close(self.__idle.pop(0)[1])
+
+	def __check(self, con):
+		r"""
+		Check that a connection still works.
+
+		@return @c True if @c healthCheck succeeds on @a con.
+		"""
+		try:
+			cur = con.cursor()
+			cur.execute(self.healthCheck)
+			cur.fetchall()
+			cur.close()
+			return True
+		except:
+			return False
+
+	def __close(self, con):
+		r"""
+		Close a connection, ignoring any error.
+		"""
+		self.__count('closed')
+		try:
+			con.close()
+		except:
+			pass
+
+	def __count(self, name):
+		r"""
+		Add one to a counter of getStats().
+
+		The counters are only changed while the pool's lock is held, so
+		that no update is lost when several threads change one at once.
+
+		@param name The name of the counter.
+		"""
+		self.__condition.acquire()
+		try:
+			setattr(self, name, getattr(self, name) + 1)
+		finally:
+			self.__condition.release()
+
+	def __returnLease(self):
+		r"""
+		Give back a lease which has no connection.
+		"""
+		self.__condition.acquire()
+		try:
+			self.__inUse -= 1
+			self.__condition.notify()
+		finally:
+			self.__condition.release()
+	## public:
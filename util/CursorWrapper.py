@@ -1,3 +1,5 @@
+import re
+
 class CursorWrapper(object):
 	r"""
 	Provides methods that convert from one DB-API param style to another
@@ -34,6 +36,78 @@ class CursorWrapper(object):
 		raise NotImplementedError, \
 			'This class contains only static methods.'
 
+	## protected:
+	# The parameter styles detected for each type of cursor.
+	__paramStyles = {}
+
+	# Parsed queries, keyed on the query and its parameter style.
+	__parsed = {}
+	__parsedMaxSize = 1000
+
+	__quotes = {"'": "'", '"': '"', '[': ']'}
+	__namedRe = re.compile(r':([A-Za-z_][A-Za-z0-9_]*)')
+	__numericRe = re.compile(r':([0-9]+)')
+	__pyformatRe = re.compile(r'%\(([^)]+)\)s')
+	## public:
+
+	def getParamStyle(cur):
+		r"""
+		Get the native parameter style of the driver of @a cur.
+
+		The parameter style registered with registerParamStyle() for
+		the type of @a cur is used. Otherwise, the @c paramstyle of the
+		DB-API module which defines the type of @a cur (or of one of the
+		packages containing that module) is used. The result is
+		remembered for each type of cursor.
+
+		@param cur A DB-API cursor.
+
+		@return The parameter style, or @c None if it is not known.
+		"""
+		import sys
+
+		cursorType = getattr(cur, '__class__', type(cur))
+		try:
+			return CursorWrapper.__paramStyles[cursorType]
+		except KeyError:
+			pass
+
+		paramStyle = None
+		name = getattr(cursorType, '__module__', None)
+		while name:
+			module = sys.modules.get(name)
+			if hasattr(module, 'paramstyle'):
+				paramStyle = module.paramstyle
+				break
+			name = '.'.join(name.split('.')[:-1])
+
+		if paramStyle not in ('format', 'named', 'numeric', 'pyformat',
+		                      'qmark'):
+			paramStyle = None
+
+		CursorWrapper.__paramStyles[cursorType] = paramStyle
+		return paramStyle
+	getParamStyle = staticmethod(getParamStyle)
+
+	def registerParamStyle(con, paramStyle):
+		r"""
+		Register the native parameter style of the driver of @a con.
+
+		This is for drivers whose module does not declare its
+		@c paramstyle (such as the DB-API 1.0 @c odbc module) or
+		declares it incorrectly.
+
+		@param con        A DB-API connection.
+		@param paramStyle The parameter style the driver binds
+		                  natively, or @c None to always include the
+		                  parameter values in the SQL query.
+		"""
+		cur = con.cursor()
+		CursorWrapper.__paramStyles[getattr(cur, '__class__',
+		                                    type(cur))] = paramStyle
+		cur.close()
+	registerParamStyle = staticmethod(registerParamStyle)
+
 	def convert(sql,
 		    params=None,
 		    fromParamStyle='qmark',
@@ -72,22 +146,86 @@ class CursorWrapper(object):
 		                          underlying database.
 		@param singleQuoteEscape  The string used to replace single
 		                          quotes in the params when the
-					  @a toParamStyle is 'none'. Examples
+					  @a toParamStyle is @c None. Examples
 					  would be: '' (double-single quotes),
 					  \' (backslash-escaped single quote)
 
+		@return The converted SQL query. Use bind() to get the
+		        parameters in the form @a toParamStyle requires as
+		        well.
+
 		@pre @a fromParamStyle and @a toParamStyle must be valid
 		     parameter styles as defined above.
 
-		@remarks This method currently only supports conversions from
-		         the @c 'qmark' parameter style to the @c None
-		         pseudo-style.
+		@code
+		>>> CursorWrapper.convert('SELECT "a" FROM "t" WHERE "b"=?', ["it's"])
+		'SELECT "a" FROM "t" WHERE "b"=\'it\'\'s\''
 
-		@todo Implement the other possible conversions.
+		@endcode
+		"""
+		return CursorWrapper.bind(sql, params, fromParamStyle,
+		                          toParamStyle, singleQuoteEscape)[0]
+	convert = staticmethod(convert)
+
+	def bind(sql,
+	         params=None,
+	         fromParamStyle='qmark',
+	         toParamStyle=None,
+	         singleQuoteEscape="''"
+	        ):
+		r"""
+		Convert an SQL query and its parameters from one parameter
+		style to another.
+
+		The valid parameter styles are those of convert(). Placeholders
+		inside quoted strings and identifiers are left alone, except in
+		the @c format and @c pyformat styles where the driver would not
+		leave them alone either. Converting to @c format or @c pyformat
+		doubles any literal percent signs.
+
+		Sequence parameters are returned for the @c qmark, @c format
+		and @c numeric styles, and dictionaries for the @c named and
+		@c pyformat styles. Positional parameters converted to a named
+		style are called @c p1, @c p2, and so on.
+
+		@param sql                The SQL query to convert.
+		@param params             The parameters for the SQL query.
+		@param fromParamStyle     The parameter style used in the
+		                          query.
+		@param toParamStyle       The parameter style used by the
+		                          underlying database.
+		@param singleQuoteEscape  The string used to replace single
+		                          quotes in the params when the
+					  @a toParamStyle is @c None.
+
+		@return A two element tuple of the converted SQL query and the
+		        converted parameters. If the query has no parameters,
+		        the parameters are @c None.
+
+		@pre @a fromParamStyle and @a toParamStyle must be valid
+		     parameter styles as defined in convert().
+
+		@code
+		>>> CursorWrapper.bind('SELECT [a?] FROM "t" WHERE "b"=? AND "c"=?', [1, 2], 'qmark', 'named')
+		('SELECT [a?] FROM "t" WHERE "b"=:p1 AND "c"=:p2', {'p2': 2, 'p1': 1})
+
+		@endcode
+
+		@code
+		>>> CursorWrapper.bind("SELECT '5%' FROM t WHERE b=:b", {'b': 1}, 'named', 'format')
+		("SELECT '5%%' FROM t WHERE b=%s", [1])
+
+		@endcode
+
+		@code
+		>>> CursorWrapper.bind('SELECT 1 WHERE "b"=:2 AND "c"=:1', [1, 2], 'numeric', 'qmark')
+		('SELECT 1 WHERE "b"=? AND "c"=?', [2, 1])
+
+		@endcode
 		"""
 
 		if (fromParamStyle == toParamStyle):
-			return sql
+			return (sql, params)
 
 		assert fromParamStyle == 'format' or \
 		       fromParamStyle == 'named' or \
@@ -104,51 +242,82 @@ class CursorWrapper(object):
 		       toParamStyle == None, \
 		       'toParamStyle is an invalid parameter style.'
 
-		# Temporary: Pending implementation of other conversions.
-		assert fromParamStyle == 'qmark' and toParamStyle == None, \
-			'Unsupported conversion.'
+		(texts, refs) = CursorWrapper.__parse(sql, fromParamStyle)
+		if len(refs) == 0:
+			return (''.join(texts), None)
 
-		if sql.count('?') == 0:
-			return sql
+		values = [params[x] for x in refs]
+
+		if toParamStyle == 'format' or toParamStyle == 'pyformat':
+			texts = [x.replace('%', '%%') for x in texts]
+
+		if toParamStyle == 'named' or toParamStyle == 'pyformat':
+			if type(refs[0]) == type(''):
+				names = refs
+			else:
+				names = ['p' + str(x + 1) for x in xrange(len(refs))]
+			params = {}
+			for (name, value) in zip(names, values):
+				params[name] = value
 		else:
-			sql2 = []
-			placeholder = 0
-			placeholder2 = 0
-			count = 0
-			while 1:
-				placeholder2 = sql.find('?', placeholder)
-				if placeholder2 == -1:
-					sql2.append(sql[placeholder:])
-					break
-				sql2.append(sql[placeholder:placeholder2])
-				sql2.append("'")
-
-				# XXX: This is a work-around for the ODBC
-				# driver not taking its own dbiDate objects
-				# back.
-				if CursorWrapper.__dbiDateType != None and \
-				   params[count] != None and \
-				   type(params[count]) == \
-				   CursorWrapper.__dbiDateType:
-					sql2.append((str( \
-						params[count])[4:]).replace( \
-						"'", singleQuoteEscape))
-				else:
-					sql2.append(str( \
-						params[count]).replace( \
-						"'", singleQuoteEscape))
-
-				sql2.append("'")
-				placeholder = placeholder2 + 1
-				count += 1
-			return ''.join(sql2)
-	convert = staticmethod(convert)
+			params = values
+
+		sql2 = [texts[0]]
+		for i in xrange(len(refs)):
+			if toParamStyle == None:
+				sql2.append(CursorWrapper.literal(values[i],
+				            singleQuoteEscape))
+			elif toParamStyle == 'qmark':
+				sql2.append('?')
+			elif toParamStyle == 'format':
+				sql2.append('%s')
+			elif toParamStyle == 'numeric':
+				sql2.append(':' + str(i + 1))
+			elif toParamStyle == 'named':
+				sql2.append(':' + names[i])
+			elif toParamStyle == 'pyformat':
+				sql2.append('%(' + names[i] + ')s')
+			sql2.append(texts[i + 1])
+
+		if toParamStyle == None:
+			params = None
+		return (''.join(sql2), params)
+	bind = staticmethod(bind)
+
+	def literal(value, singleQuoteEscape="''"):
+		r"""
+		Get the SQL literal for @a value.
+
+		@param value             The value.
+		@param singleQuoteEscape The string used to replace single
+		                         quotes in @a value.
+
+		@return @c NULL for @c None, otherwise @a value as a quoted
+		        string.
+
+		@code
+		>>> CursorWrapper.literal(None)
+		'NULL'
+
+		@endcode
+		"""
+		if value == None:
+			return 'NULL'
+
+		# XXX: This is a work-around for the ODBC driver not taking its
+		# own dbiDate objects back.
+		if CursorWrapper.__dbiDateType != None and \
+		   type(value) == CursorWrapper.__dbiDateType:
+			value = str(value)[4:]
+
+		return "'" + str(value).replace("'", singleQuoteEscape) + "'"
+	literal = staticmethod(literal)
 
 	def execute(cur,
 	            sql,
 		    params=None,
 		    fromParamStyle='qmark',
-		    toParamStyle=None,
+		    toParamStyle='native',
 		    singleQuoteEscape="''"
 		   ):
 		r"""
@@ -172,6 +341,13 @@ class CursorWrapper(object):
 		the method to rewrite the query so that the parameter values
 		are included in the SQL query.
 
+		The default @a toParamStyle, @c 'native', is the parameter
+		style of the driver as found by getParamStyle(). The parameters
+		are bound by the driver, so the database sees the same SQL text
+		for every execution of a query and can reuse its plan. If the
+		driver's parameter style is not known, the values are included
+		in the SQL query.
+
 		If @a fromParamStyle is the same as @a toParamStyle, the query
 		is executed with no conversion.
 
@@ -185,59 +361,38 @@ class CursorWrapper(object):
 		                          underlying database.
 		@param singleQuoteEscape  The string used to replace single
 		                          quotes in the params when the
-					  @a toParamStyle is 'none'. Examples
+					  @a toParamStyle is @c None. Examples
 					  would be: '' (double-single quotes),
 					  \' (backslash-escaped single quote)
 
 		@pre @a fromParamStyle and @a toParamStyle must be valid
 		     parameter styles as defined above.
-
-		@remarks This method currently only supports conversions from
-		         the @c 'qmark' parameter style to the @c None
-		         pseudo-style.
-
-		@todo Handle the other possible conversions.
 		"""
 
+		if toParamStyle == 'native':
+			toParamStyle = CursorWrapper.getParamStyle(cur)
+
 		if (fromParamStyle == toParamStyle):
-			cur.execute(sql)
+			if params:
+				cur.execute(sql, params)
+			else:
+				cur.execute(sql)
 			return
 
-		assert fromParamStyle == 'format' or \
-		       fromParamStyle == 'named' or \
-		       fromParamStyle == 'numeric' or \
-		       fromParamStyle == 'pyformat' or \
-		       fromParamStyle == 'qmark', \
-		       'fromParamStyle is an invalid parameter style.'
-
-		assert toParamStyle == 'format' or \
-		       toParamStyle == 'named' or \
-		       toParamStyle == 'numeric' or \
-		       toParamStyle == 'pyformat' or \
-		       toParamStyle == 'qmark' or \
-		       toParamStyle == None, \
-		       'toParamStyle is an invalid parameter style.'
-
-		# Temporary: Pending implementation of other conversions.
-		assert fromParamStyle == 'qmark' and toParamStyle == None, \
-			'Unsupported conversion.'
-
-#		if sql[0:22] != 'SELECT "InternalUserID':
-#			assert 0, sql
-
-		if sql.count('?') == 0:
+		(sql, params) = CursorWrapper.bind(sql, params, fromParamStyle,
+		                                   toParamStyle,
+		                                   singleQuoteEscape)
+		if params == None:
 			cur.execute(sql)
 		else:
-			cur.execute(CursorWrapper.convert(sql, params,
-			                    fromParamStyle, toParamStyle,
-					    singleQuoteEscape))
+			cur.execute(sql, params)
 	execute = staticmethod(execute)
 
 	def executemany(cur,
 	                sql,
 	                params_seq=None,
 	                fromParamStyle='qmark',
-	                toParamStyle='none',
+	                toParamStyle='native',
 			singleQuoteEscape="''"
 		       ):
 		r"""
@@ -256,10 +411,15 @@ class CursorWrapper(object):
 		an exception may be raised, but this behavior must not be
 		relied upon.
 
-		The parameter type 'none' is also supported for the
-		@a toParamStyle. Specifying the 'none' parameter style tells
+		The parameter type @c None is also supported for the
+		@a toParamStyle. Specifying the @c None parameter style tells
 		the method to rewrite the query so that the parameter values
-		are included in the SQL query.
+		are included in the SQL query. The query is then executed once
+		per parameter set.
+
+		The default @a toParamStyle, @c 'native', is the parameter
+		style of the driver as described in execute(). In that case,
+		the whole sequence is passed to the driver's @c executemany().
 
 		If @a fromParamStyle is the same as @a toParamStyle, the query
 		is executed with no conversion.
@@ -275,36 +435,175 @@ class CursorWrapper(object):
 		                          underlying database.
 		@param singleQuoteEscape  The string used to replace single
 		                          quotes in the params when the
-					  @a toParamStyle is 'none'. Examples
+					  @a toParamStyle is @c None. Examples
 					  would be: '' (double-single quotes),
 					  \' (backslash-escaped single quote)
 
 		@pre @a fromParamStyle and @a toParamStyle must be valid
 		     parameter styles as defined above.
-
-		@remarks This method currently only supports conversions from
-		         the @c 'qmark' parameter style to the @c None
-		         pseudo-style.
-
-		@todo Implement the other possible conversions.
 		"""
 
+		if toParamStyle == 'native':
+			toParamStyle = CursorWrapper.getParamStyle(cur)
+
 		if (fromParamStyle == toParamStyle):
 			cur.executemany(sql, params_seq)
 			return
 
-		assert fromParamStyle=='qmark' and toParamStyle=='none', \
-			'Unsupported conversion.'
-
-		if sql.count('?') == 0:
-			cur.executemany(sql, params_seq)
-		else:
+		if toParamStyle == None:
 			for params in params_seq:
 				CursorWrapper.execute(cur, sql, params,
 					fromParamStyle, toParamStyle,
 					singleQuoteEscape)
+			return
+
+		params_seq2 = []
+		for params in params_seq:
+			(sql2, params) = CursorWrapper.bind(sql, params,
+			                                    fromParamStyle,
+			                                    toParamStyle)
+			if params == None:
+				params = ()
+			params_seq2.append(params)
+		if len(params_seq2) > 0:
+			cur.executemany(sql2, params_seq2)
 	executemany = staticmethod(executemany)
 
+	def fetch(cur, arraysize=100):
+		r"""
+		Generate the rows of the result set of an executed query.
+
+		Rows are fetched from the driver in batches of @a arraysize
+		using @c fetchmany(), so the driver is not asked for every row
+		separately, while no more than one batch is held in memory at
+		once.
+
+		Errors raised by the driver are not caught. A failed fetch
+		raises instead of silently ending the result set.
+
+		@param cur       The DB-API cursor which executed the query.
+		@param arraysize The number of rows to fetch at a time.
+
+		@return Generates the rows of the result set.
+
+		@pre @a arraysize must be an integer greater than zero.
+		"""
+		try:
+			assert int(arraysize) > 0, \
+			       'arraysize must be greater than zero.'
+		except ValueError:
+			assert 0, 'arraysize must be convertable to an int.'
+		arraysize = int(arraysize)
+
+		# Some drivers only honor the attribute, others only the
+		# argument to fetchmany().
+		try:
+			cur.arraysize = arraysize
+		except (AttributeError, TypeError):
+			pass
+
+		while 1:
+			rows = cur.fetchmany(arraysize)
+			if not rows:
+				break
+			for row in rows:
+				yield row
+	fetch = staticmethod(fetch)
+
+	## protected:
+	def __parse(sql, paramStyle):
+		r"""
+		Split an SQL query at its placeholders.
+
+		@param sql        The SQL query.
+		@param paramStyle The parameter style used in the query.
+
+		@return A two element tuple of a list of the text between the
+		        placeholders (one more than the placeholders) and a
+		        list of what each placeholder refers to: an index into
+		        the parameters for the positional styles, or a name.
+		"""
+		key = (sql, paramStyle)
+		try:
+			return CursorWrapper.__parsed[key]
+		except KeyError:
+			pass
+
+		texts = []
+		refs = []
+		text = []
+		start = 0
+		i = 0
+		n = len(sql)
+		while i < n:
+			c = sql[i]
+
+			# The driver interpolates format and pyformat queries
+			# as a whole, quotes and all.
+			if CursorWrapper.__quotes.has_key(c) and \
+			   paramStyle != 'format' and paramStyle != 'pyformat':
+				close = CursorWrapper.__quotes[c]
+				i = sql.find(close, i + 1)
+				# A doubled quote is an escaped quote.
+				while i != -1 and sql[i + 1:i + 2] == close:
+					i = sql.find(close, i + 2)
+				if i == -1:
+					break
+				i += 1
+				continue
+
+			ref = None
+			if c == '?' and paramStyle == 'qmark':
+				ref = len(refs)
+				length = 1
+			elif c == '%' and (paramStyle == 'format' or
+			                   paramStyle == 'pyformat'):
+				if sql[i + 1:i + 2] == '%':
+					text.append(sql[start:i + 1])
+					i += 2
+					start = i
+					continue
+				if paramStyle == 'format':
+					if sql[i + 1:i + 2] == 's':
+						ref = len(refs)
+						length = 2
+				else:
+					match = CursorWrapper.__pyformatRe.match(sql, i)
+					if match:
+						ref = match.group(1)
+						length = match.end() - i
+			elif c == ':' and paramStyle == 'named':
+				match = CursorWrapper.__namedRe.match(sql, i)
+				if match:
+					ref = match.group(1)
+					length = match.end() - i
+			elif c == ':' and paramStyle == 'numeric':
+				match = CursorWrapper.__numericRe.match(sql, i)
+				if match:
+					ref = int(match.group(1)) - 1
+					length = match.end() - i
+
+			if ref == None:
+				i += 1
+				continue
+
+			text.append(sql[start:i])
+			texts.append(''.join(text))
+			text = []
+			refs.append(ref)
+			i += length
+			start = i
+
+		text.append(sql[start:])
+		texts.append(''.join(text))
+
+		if len(CursorWrapper.__parsed) >= CursorWrapper.__parsedMaxSize:
+			CursorWrapper.__parsed.clear()
+		CursorWrapper.__parsed[key] = (texts, refs)
+		return (texts, refs)
+	__parse = staticmethod(__parse)
+	## public:
+
 def __isprivate(prefix, base):
 	r"""
 	Doctest Workaround
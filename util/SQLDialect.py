@@ -0,0 +1,163 @@
+class SQLDialect(object):
+	r"""
+	Generates the SQL which differs between databases.
+
+	The structures generate SQL Server (Transact-SQL) queries. The few
+	pieces of SQL which other databases spell differently are generated
+	by the dialect of the database instead, which is looked up by the
+	name in the @c dbDialect of an @em env:
+	  - mssql   SQL Server
+	  - sqlite  The SQLite stand-in database used by benchmark.py
+
+	Like the parameter styles of CursorWrapper::CursorWrapper, further
+	dialects can be added with register().
+
+	@code
+	>>> SQLDialect.get('mssql').generateLimit(10)
+	('TOP 10 ', '')
+	>>> SQLDialect.get('sqlite').generateLimit(10)
+	('', ' LIMIT 10')
+
+	@endcode
+	"""
+
+	## protected:
+	# The dialects, keyed on their names.
+	__dialects = {}
+	## public:
+
+	def get(name):
+		r"""
+		Look up a dialect.
+
+		@param name The name of the dialect.
+
+		@return The SQLDialect.
+
+		@exception KeyError A @e KeyError will be thrown if there is no
+		                    dialect named @a name.
+		"""
+		return SQLDialect.__dialects[name]
+	get = staticmethod(get)
+
+	def register(name, dialect):
+		r"""
+		Add a dialect.
+
+		@param name    The name of the dialect.
+		@param dialect The SQLDialect.
+		"""
+		SQLDialect.__dialects[name] = dialect
+	register = staticmethod(register)
+
+	def generateLimit(self, count):
+		r"""
+		Generate the SQL which limits a @c SELECT to @a count rows.
+
+		@param count The maximum number of rows, or @c None.
+
+		@return A two element tuple of the SQL to put after @c SELECT
+		        (and @c DISTINCT) and the SQL to put at the end of the
+		        query.
+		"""
+		if count == None:
+			return ('', '')
+		return ('TOP ' + str(int(count)) + ' ', '')
+
+	def generateConvert(self, dbType, expression):
+		r"""
+		Generate the SQL which converts a value to another type.
+
+		@param dbType     The type, with its length if it has one.
+		@param expression The SQL expression of the value.
+
+		@return The SQL expression of the converted value.
+
+		@code
+		>>> SQLDialect.get('mssql').generateConvert('int', '"v"')
+		'CONVERT(int, "v")'
+		>>> SQLDialect.get('sqlite').generateConvert('int', '"v"')
+		'CAST("v" AS int)'
+
+		@endcode
+		"""
+		return 'CONVERT(' + dbType + ', ' + expression + ')'
+
+	def generateReturning(self, column):
+		r"""
+		Generate the SQL which makes an @c INSERT return a column of
+		each row it inserts, such as the @c IDENTITY column.
+
+		@param column The name of the column.
+
+		@return A two element tuple of the SQL to put before @c VALUES
+		        and the SQL to put at the end of the statement.
+
+		@code
+		>>> SQLDialect.get('mssql').generateReturning('ID')
+		('OUTPUT INSERTED."ID" ', '')
+		>>> SQLDialect.get('sqlite').generateReturning('ID')
+		('', ' RETURNING "ID"')
+
+		@endcode
+		"""
+		return ('OUTPUT INSERTED."' + column + '" ', '')
+
+	def generateTableExists(self):
+		r"""
+		Generate the query which checks if a table exists.
+
+		@return The SQL query. Its argument is the name of the table.
+		        The table exists if the query returns a row whose first
+		        column is not @c NULL.
+		"""
+		return 'SELECT OBJECT_ID(?)'
+
+class SQLiteDialect(SQLDialect):
+	r"""
+	The SQL dialect of SQLite.
+	"""
+
+	def generateLimit(self, count):
+		r"""
+		SQLite uses @c LIMIT at the end instead of @c TOP.
+		"""
+		if count == None:
+			return ('', '')
+		return ('', ' LIMIT ' + str(int(count)))
+
+	def generateConvert(self, dbType, expression):
+		r"""
+		SQLite uses @c CAST instead of @c CONVERT.
+		"""
+		return 'CAST(' + expression + ' AS ' + dbType + ')'
+
+	def generateReturning(self, column):
+		r"""
+		SQLite (3.35 and later) uses @c RETURNING instead of @c OUTPUT.
+		"""
+		return ('', ' RETURNING "' + column + '"')
+
+	def generateTableExists(self):
+		r"""
+		SQLite lists its tables in @c sqlite_master.
+		"""
+		return 'SELECT [name] FROM [sqlite_master] ' + \
+		       'WHERE [type]=\'table\' AND [name]=?'
+
+SQLDialect.register('mssql', SQLDialect())
+SQLDialect.register('sqlite', SQLiteDialect())
+
+def _test():
+	r"""
+	Test Method
+
+	This method is used when this file is run stand-alone to perform unit
+	tests with doctest.
+	"""
+	import doctest
+	import SQLDialect
+	return doctest.testmod(SQLDialect)
+
+if __name__ == "__main__":
+	_test()
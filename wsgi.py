@@ -0,0 +1,232 @@
+r"""
+Skime WSGI Application
+
+This module serves Skime through WSGI, as an alternative to the
+mod_python handlers in index.py. It runs the same authenhandler,
+handler and data module dispatch, but each request gets its own
+WSGIRequest, which acts like a mod_python request, and its own env. No
+state is kept in module globals, so one process can serve many
+requests at once under a threaded or multi-process WSGI server.
+
+The WSGI application object is @c application. The script can also be
+run to serve Skime with the reference server from the standard library
+(which requires Python 2.5 or later), one thread per request. If no
+port is given, 8000 is used:
+@verbatim
+Usage: wsgi.py [PORT]
+@endverbatim
+"""
+
+import base64
+import BaseHTTPServer
+import cgi
+
+import env
+import index
+
+class WSGIRequest:
+	r"""
+	A WSGI request which acts like a mod_python request.
+
+	Only the parts of the mod_python request object which Skime uses
+	are provided. As with mod_python, the response starts with the
+	first send_http_header() or write(), and everything written after
+	that is passed straight on to the WSGI server, so the client gets
+	the page as it is rendered.
+	"""
+
+	def __init__(self, environ, start_response):
+		r"""
+		@param environ        The WSGI environment of the request.
+		@param start_response The WSGI @c start_response function of
+		                      the request.
+		"""
+		self.environ = environ
+		self.start_response = start_response
+		# The WSGI write function, once the response has started.
+		self.serverWrite = None
+
+		self.uri = environ.get('SCRIPT_NAME', '') + \
+		           environ.get('PATH_INFO', '')
+		self.unparsed_uri = self.uri
+		if environ.get('QUERY_STRING'):
+			self.unparsed_uri += '?' + environ['QUERY_STRING']
+		self.hostname = environ.get('HTTP_HOST',
+		                            environ['SERVER_NAME']).split(':')[0]
+		self.server = WSGIServerInfo(int(environ['SERVER_PORT']))
+
+		self.user = None
+		self.password = None
+		authorization = environ.get('HTTP_AUTHORIZATION', '').split(' ', 1)
+		if len(authorization) == 2 and authorization[0].lower() == 'basic':
+			try:
+				credentials = base64.decodestring(authorization[1])
+			except:
+				credentials = ''
+			if ':' in credentials:
+				(self.user, self.password) = credentials.split(':', 1)
+
+		self.status = 200
+		self.content_type = None
+		self.headers_out = {}
+		self.cleanups = []
+
+	def get_basic_auth_pw(self):
+		r"""
+		@return The password of the HTTP Basic credentials, or @c None.
+		"""
+		return self.password
+
+	def send_http_header(self):
+		r"""
+		Start the response with @c status, @c content_type and
+		@c headers_out. Calling it again does nothing.
+		"""
+		if self.serverWrite != None:
+			return
+
+		headers = [('Content-Type', self.content_type or 'text/html')]
+		headers.extend(self.headers_out.items())
+		self.serverWrite = self.start_response(str(self.status) + ' ' +
+		  BaseHTTPServer.BaseHTTPRequestHandler.responses[self.status][0],
+		  headers)
+
+	def write(self, string):
+		r"""
+		Send part of the response body, starting the response first if
+		need be.
+
+		@param string The text to send.
+		"""
+		self.send_http_header()
+		self.serverWrite(string)
+
+	def register_cleanup(self, function, data=None):
+		r"""
+		Register a function to call at the end of the request.
+
+		@param function The function. It is called with @a data as its
+		                only argument.
+		@param data     The argument.
+		"""
+		self.cleanups.append((function, data))
+
+	def cleanup(self):
+		r"""
+		Call the functions given to register_cleanup().
+		"""
+		cleanups = self.cleanups
+		self.cleanups = []
+		for (function, data) in cleanups:
+			function(data)
+
+class WSGIServerInfo:
+	r"""
+	The part of the mod_python server object used through
+	WSGIRequest::server.
+	"""
+
+	def __init__(self, port):
+		self.port = port
+
+def parseFields(environ):
+	r"""
+	Parse the form fields of a request.
+
+	@param environ The WSGI environment of the request.
+
+	@return A dictionary of the fields. Like the mod_python
+	        FieldStorage, a field given more than once has a list of
+	        its values.
+	"""
+	fs = cgi.FieldStorage(fp=environ.get('wsgi.input'), environ=environ,
+	                      keep_blank_values=1)
+	fields = {}
+	if fs.list:
+		for name in fs.keys():
+			fields[name] = fs.getvalue(name)
+	return fields
+
+class Application:
+	r"""
+	The WSGI application.
+
+	Instances are callable as described by PEP 333, and can be shared
+	by any number of threads.
+
+	If every connection of the pool is leased for @c poolTimeout
+	seconds, the request is answered with 503 Service Unavailable,
+	rather than holding the worker while the pool's own timeout runs.
+	"""
+
+	## The number of seconds a request waits for a pooled connection.
+	poolTimeout = 1
+
+	def __init__(self, provider='provider1.example.com'):
+		r"""
+		@param provider The provider string to pass to the env.
+		"""
+		self.provider = provider
+
+	def __call__(self, environ, start_response):
+		req = WSGIRequest(environ, start_response)
+		try:
+			e = self.createEnv(req)
+			if e.poolExhausted:
+				status = index.apache.HTTP_SERVICE_UNAVAILABLE
+			else:
+				status = index.handler(req)
+		finally:
+			# This gives the database connection back to the pool.
+			req.cleanup()
+
+		if status == index.apache.HTTP_SERVICE_UNAVAILABLE:
+			req.status = status
+			req.headers_out['Retry-After'] = '1'
+			req.content_type = 'text/plain'
+			req.write('The server is busy. Please try again.\n')
+		elif status == index.apache.HTTP_UNAUTHORIZED:
+			req.status = status
+			req.headers_out['WWW-Authenticate'] = 'Basic realm="Skime"'
+			req.content_type = 'text/plain'
+			req.write('Authorization is required.\n')
+
+		req.send_http_header()
+		return []
+
+	def createEnv(self, req):
+		r"""
+		Create the env of a request, which index.py then uses.
+
+		@param req A WSGIRequest.
+
+		@return The @em env of @a req.
+		"""
+		return env.getRequestEnv(req, self.provider,
+		                         parseFields(req.environ), self.poolTimeout)
+
+application = Application()
+
+if __name__ == '__main__':
+	import os
+	import sys
+	import SocketServer
+	import wsgiref.simple_server
+
+	class ThreadingWSGIServer(SocketServer.ThreadingMixIn,
+	                          wsgiref.simple_server.WSGIServer):
+		daemon_threads = True
+
+	(path, name) = os.path.split(sys.argv[0])
+
+	if len(sys.argv) > 2:
+		print 'Usage: ' + name + ' [PORT]'
+		sys.exit()
+
+	port = 8000
+	if len(sys.argv) > 1:
+		port = int(sys.argv[1])
+
+	server = wsgiref.simple_server.make_server('', port, application,
+	                                           ThreadingWSGIServer)
+	server.serve_forever()